@@ -41,6 +41,10 @@ MAIN_LOG_FILE = "/tmp/anaconda.log"
 MAIN_LOG_TTY = "/dev/tty3"
 PROGRAM_LOG_FILE = "/tmp/program.log"
 PROGRAM_LOG_TTY = "/dev/tty5"
+# output of each external command, with the inst.cmdlogs boot option
+PROGRAM_LOG_DIR = "/tmp/program-logs"
+# resource usage of each external command, one JSON object per line
+COMMAND_TRACE_FILE = "/tmp/command-trace.json"
 STORAGE_LOG_FILE = "/tmp/storage.log"
 PACKAGING_LOG_FILE = "/tmp/packaging.log"
 SENSITIVE_INFO_LOG_FILE = "/tmp/sensitive-info.log"
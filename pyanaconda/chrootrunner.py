@@ -0,0 +1,253 @@
+#
+# chrootrunner.py:  run commands in the target system through one helper
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    A ChrootRunner starts this file as a helper process, which chroots into
+    the target system once and then runs the commands it is sent, several
+    at the same time if asked to, from there.
+
+    The helper is a fresh interpreter, not a fork of the installer: forking
+    a process with threads holding locks is not safe.  It only uses the
+    standard library, imported before the chroot.
+
+    Both directions carry marshalled tuples, each preceded by its length
+    on a line of its own.  Requests are (id, argv, env); the helper
+    answers with ("out", id, data) chunks of the combined stdout and
+    stderr, then ("rc", id, returncode, (user time, system time, max RSS))
+    or ("error", id, errno, strerror) if the command could not be started.
+"""
+
+import os
+import sys
+import errno
+import marshal
+import threading
+import subprocess
+from Queue import Queue
+
+import logging
+log = logging.getLogger("anaconda")
+
+# size of the reads of the output of the commands
+CHUNK_SIZE = 64 * 1024
+
+class ChrootRunnerError(Exception):
+    pass
+
+def _send(fobj, lock, message):
+    data = marshal.dumps(message)
+    with lock:
+        fobj.write("%d\n%s" % (len(data), data))
+        fobj.flush()
+
+def _receive(fobj):
+    """ Return the next message from fobj, None at the end of the stream. """
+    header = fobj.readline()
+    if not header:
+        return None
+    data = fobj.read(int(header))
+    if len(data) != int(header):
+        return None
+    return marshal.loads(data)
+
+def _serve_one(out, lock, request_id, argv, env):
+    try:
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, env=env, cwd="/",
+                                close_fds=True)
+    except OSError as e:
+        _send(out, lock, ("error", request_id, e.errno, e.strerror))
+        return
+
+    while True:
+        data = os.read(proc.stdout.fileno(), CHUNK_SIZE)
+        if not data:
+            break
+        _send(out, lock, ("out", request_id, data))
+    proc.stdout.close()
+    _pid, status, rusage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    _send(out, lock, ("rc", request_id, returncode,
+                      (rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss)))
+
+def serve(root):
+    """ Helper process main loop: chroot and run the requested commands
+        until stdin is closed.
+    """
+    os.chroot(root)
+    os.chdir("/")
+
+    # keep the protocol streams away from the commands
+    requests = os.fdopen(os.dup(0), "rb")
+    out = os.fdopen(os.dup(1), "wb")
+    devnull = os.open("/dev/null", os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    lock = threading.Lock()
+    while True:
+        request = _receive(requests)
+        if request is None:
+            break
+        thread = threading.Thread(target=_serve_one, args=(out, lock) + request)
+        thread.daemon = True
+        thread.start()
+
+    # wait for the running commands
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join()
+
+class ChrootRunner(object):
+    """ Client of a helper process running commands chrooted in root. """
+    def __init__(self, root):
+        """
+            :param root: the directory to chroot to
+            :type root: str
+        """
+        self.root = root
+        self._proc = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._queues = {}
+        self._next_id = 0
+        self._reader = None
+
+    @property
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        """ Start the helper process.
+
+            :raises OSError: if the helper cannot be started
+        """
+        path = os.path.abspath(__file__)
+        if path.endswith(".pyc") and os.path.exists(path[:-1]):
+            path = path[:-1]
+        # no site and no environment: only the standard library is needed
+        self._proc = subprocess.Popen([sys.executable, "-E", "-S", path,
+                                       self.root],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, close_fds=True)
+        self._reader = threading.Thread(name="AnaChrootRunner",
+                                        target=self._read)
+        self._reader.daemon = True
+        self._reader.start()
+        log.info("started the command helper in %s (pid %d)", self.root,
+                 self._proc.pid)
+
+    def stop(self):
+        """ Stop the helper once the running commands finish. """
+        if self._proc is None:
+            return
+        with self._send_lock:
+            self._proc.stdin.close()
+        self._proc.wait()
+        self._reader.join()
+        self._proc = None
+        log.info("stopped the command helper in %s", self.root)
+
+    def _read(self):
+        while True:
+            message = _receive(self._proc.stdout)
+            if message is None:
+                break
+            with self._lock:
+                queue = self._queues.get(message[1])
+            if queue is not None:
+                queue.put(message)
+
+        # the helper is gone, fail the commands still waiting
+        with self._lock:
+            queues = self._queues.values()
+        for queue in queues:
+            queue.put(None)
+
+    def run(self, argv, env=None):
+        """ Run argv in the target and return an iterator over the chunks of
+            its combined stdout and stderr.  The iterator's returncode
+            attribute is set once it is exhausted.
+
+            :raises OSError: if the command cannot be started
+            :raises ChrootRunnerError: if the helper died
+        """
+        if not self.alive:
+            raise ChrootRunnerError("the command helper is not running")
+
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            queue = self._queues[request_id] = Queue()
+        try:
+            _send(self._proc.stdin, self._send_lock,
+                  (request_id, list(argv), dict(env or os.environ)))
+        except (IOError, ValueError) as e:
+            with self._lock:
+                del self._queues[request_id]
+            raise ChrootRunnerError("cannot talk to the command helper: %s"
+                                    % e)
+        return _Output(self, request_id, queue)
+
+    def _done(self, request_id):
+        with self._lock:
+            del self._queues[request_id]
+
+class _Output(object):
+    """ Output chunks of a command run by a ChrootRunner.
+
+        returncode and rusage, the (user time, system time, max RSS in KiB)
+        of the command, are set once the output is exhausted.
+    """
+    def __init__(self, runner, request_id, queue):
+        self._runner = runner
+        self._id = request_id
+        self._queue = queue
+        self.returncode = None
+        self.rusage = None
+        self._first = queue.get()
+        if self._first and self._first[0] == "error":
+            runner._done(request_id)
+            raise OSError(self._first[2], self._first[3])
+
+    def __iter__(self):
+        message = self._first
+        while True:
+            if message is None:
+                self._runner._done(self._id)
+                raise ChrootRunnerError("the command helper died")
+            if message[0] == "rc":
+                self.returncode = message[2]
+                self.rusage = message[3]
+                self._runner._done(self._id)
+                return
+            yield message[2]
+            message = self._queue.get()
+
+if __name__ == "__main__":
+    try:
+        serve(sys.argv[1])
+    except KeyboardInterrupt:
+        pass
+    except EnvironmentError as e:
+        if e.errno != errno.EPIPE:
+            raise
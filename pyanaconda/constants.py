@@ -95,7 +95,7 @@ THREAD_PAYLOAD_MD = "AnaPayloadMDThread"
 THREAD_INPUT_BASENAME = "AnaInputThread"
 THREAD_SYNC_TIME_BASENAME = "AnaSyncTime"
 THREAD_EXCEPTION_HANDLING_TEST = "AnaExceptionHandlingTest"
-THREAD_LIVE_PROGRESS = "AnaLiveProgressThread"
+THREAD_TREE_MANIFEST = "AnaTreeManifestThread"
 THREAD_SOFTWARE_WATCHER = "AnaSoftwareWatcher"
 THREAD_CHECK_SOFTWARE = "AnaCheckSoftwareThread"
 THREAD_SOURCE_WATCHER = "AnaSourceWatcher"
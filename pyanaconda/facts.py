@@ -0,0 +1,222 @@
+#
+# facts.py:  cached facts about the system being installed from
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    Facts like the virtualization type or the OpenGL profile are asked for
+    by several steps of the installation, and each of them used to fork a
+    program or read a file again.  The facts object computes every fact
+    once, the first time it is needed or ahead of time on background
+    threads with prefetch(), and keeps it until it is invalidated.
+
+    Facts that change during the installation (lvm, once the storage has
+    been written) are not prefetched and have to be invalidated by the
+    code changing them.
+"""
+
+import os
+import pprint
+import threading
+import subprocess
+
+from blivet import arch
+
+import logging
+log = logging.getLogger("anaconda")
+
+def _detect_virt():
+    """ Return the systemd-detect-virt identifier, None on bare metal. """
+    try:
+        proc = subprocess.Popen(["/usr/bin/systemd-detect-virt"],
+                                stdout=subprocess.PIPE)
+    except OSError as e:
+        log.debug("cannot run systemd-detect-virt: %s", e)
+        return None
+    outcome = proc.communicate()[0]
+    if proc.returncode == 0:
+        return outcome.strip()
+    return None
+
+def _is_efi():
+    return arch.isEfi()
+
+def opengl_profile(chroot=""):
+    """ Return the OpenGL subsystem (ati, nvidia, xorg-x11) configured in
+        chroot.
+    """
+    ogl_path = chroot + "/etc/env.d/03opengl"
+    try:
+        with open(ogl_path) as f:
+            cont = [x.strip() for x in f.readlines() if
+                    x.strip().startswith("OPENGL_PROFILE")]
+    except IOError:
+        cont = []
+    if cont:
+        xprofile = cont[-1]
+        if "nvidia" in xprofile:
+            return "nvidia"
+        elif "ati" in xprofile:
+            return "ati"
+    return "xorg-x11"
+
+def _opengl():
+    return os.getenv("OPENGL_PROFILE") or opengl_profile()
+
+def _cmdline():
+    """ Return the list of the kernel command line arguments. """
+    try:
+        with open("/proc/cmdline") as f:
+            return f.readline().strip().split()
+    except IOError:
+        return []
+
+def _has_lvm():
+    """ Return True if any logical volume is active. """
+    env = dict(os.environ, LANG="C", LC_ALL="C")
+    try:
+        proc = subprocess.Popen(["lvscan"], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, env=env)
+    except OSError as e:
+        log.debug("cannot run lvscan: %s", e)
+        return False
+    out = proc.communicate()[0].split("\n")[0].strip()
+    return not out.startswith("No volume groups found")
+
+# fact name -> function computing it, and whether prefetch() computes it
+_COLLECTORS = {
+    "virt": (_detect_virt, True),
+    "efi": (_is_efi, True),
+    "opengl": (_opengl, True),
+    "cmdline": (_cmdline, True),
+    "lvm": (_has_lvm, False),
+}
+
+class Facts(object):
+    """ Lazily computed, cached system facts.
+
+        Facts are thread safe: a fact is computed by the first thread asking
+        for it, other threads asking at the same time wait for the result.
+    """
+    def __init__(self):
+        self._values = {}
+        self._pending = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """ Return the fact called name, computing it if needed. """
+        collector = _COLLECTORS[name][0]
+        while True:
+            with self._lock:
+                if name in self._values:
+                    return self._values[name]
+                event = self._pending.get(name)
+                owner = event is None
+                if owner:
+                    event = self._pending[name] = threading.Event()
+                    generation = self._generation
+
+            if not owner:
+                # computed by another thread, unless invalidated meanwhile
+                event.wait()
+                continue
+
+            try:
+                value = collector()
+            finally:
+                with self._lock:
+                    del self._pending[name]
+                event.set()
+
+            with self._lock:
+                if generation == self._generation:
+                    self._values[name] = value
+            return value
+
+    def prefetch(self, names=None):
+        """ Compute the facts called names, all the prefetchable ones if not
+            given, on background threads.
+        """
+        if names is None:
+            names = [name for name, (_func, early) in _COLLECTORS.items()
+                     if early]
+        for name in names:
+            thread = threading.Thread(name="AnaFact-%s" % name,
+                                      target=self.get, args=(name,))
+            thread.daemon = True
+            thread.start()
+
+    def invalidate(self, *names):
+        """ Forget the facts called names, all of them if none is given. """
+        with self._lock:
+            self._generation += 1
+            if not names:
+                self._values.clear()
+            for name in names:
+                self._values.pop(name, None)
+
+    def dump(self):
+        """ Log all the facts, computing the missing ones. """
+        values = dict((name, self.get(name)) for name in sorted(_COLLECTORS))
+        log.info("system facts:\n%s", pprint.pformat(values))
+        return values
+
+    @property
+    def virt(self):
+        """ systemd-detect-virt identifier, None on bare metal. """
+        return self.get("virt")
+
+    @property
+    def is_virtualbox(self):
+        return self.virt == "oracle"
+
+    @property
+    def is_kvm(self):
+        return self.virt == "kvm"
+
+    @property
+    def is_hyperv(self):
+        return self.virt == "microsoft"
+
+    @property
+    def is_efi(self):
+        return self.get("efi")
+
+    @property
+    def opengl(self):
+        """ OpenGL profile of the running system. """
+        return self.get("opengl")
+
+    @property
+    def cmdline(self):
+        """ Kernel command line arguments, as a list. """
+        return self.get("cmdline")
+
+    @property
+    def has_lvm(self):
+        return self.get("lvm")
+
+    @property
+    def is_sabayon_mce(self):
+        return any(arg in self.cmdline for arg in ("mceinstall", "sabayonmce"))
+
+    @property
+    def is_sabayon_steambox(self):
+        return any(arg in self.cmdline for arg in ("steaminstall", "steambox"))
+
+facts = Facts()
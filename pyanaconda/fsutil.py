@@ -0,0 +1,231 @@
+#
+# fsutil.py - low level file system helpers
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    Thin wrappers around the libc calls the python 2 os module does not
+    expose (extended attributes, in-kernel copies, reflinks, symlink
+    timestamps, mounts, directory file descriptor relative calls).
+    Every wrapper raises OSError with the proper errno on failure and
+    ENOSYS when the running libc does not provide the call at all.
+"""
+
+import os
+import errno
+import fcntl
+import ctypes
+import ctypes.util
+
+import logging
+log = logging.getLogger("anaconda")
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                    use_errno=True)
+
+_c_loff_t_p = ctypes.POINTER(ctypes.c_longlong)
+
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+
+def _libc_func(name, restype, argtypes):
+    func = getattr(_libc, name, None)
+    if func is None:
+        return None
+    func.restype = restype
+    func.argtypes = argtypes
+    return func
+
+_copy_file_range = _libc_func("copy_file_range", ctypes.c_ssize_t,
+                              [ctypes.c_int, _c_loff_t_p, ctypes.c_int,
+                               _c_loff_t_p, ctypes.c_size_t, ctypes.c_uint])
+_sendfile = _libc_func("sendfile64", ctypes.c_ssize_t,
+                       [ctypes.c_int, ctypes.c_int, _c_loff_t_p,
+                        ctypes.c_size_t])
+_llistxattr = _libc_func("llistxattr", ctypes.c_ssize_t,
+                         [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t])
+_lgetxattr = _libc_func("lgetxattr", ctypes.c_ssize_t,
+                        [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p,
+                         ctypes.c_size_t])
+_lsetxattr = _libc_func("lsetxattr", ctypes.c_int,
+                        [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                         ctypes.c_size_t, ctypes.c_int])
+
+_openat = _libc_func("openat", ctypes.c_int,
+                     [ctypes.c_int, ctypes.c_char_p, ctypes.c_int,
+                      ctypes.c_uint])
+_fchownat = _libc_func("fchownat", ctypes.c_int,
+                       [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint,
+                        ctypes.c_uint, ctypes.c_int])
+_mount = _libc_func("mount", ctypes.c_int,
+                    [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                     ctypes.c_ulong, ctypes.c_void_p])
+_umount2 = _libc_func("umount2", ctypes.c_int,
+                      [ctypes.c_char_p, ctypes.c_int])
+
+# mount flags
+MS_RDONLY = 1
+MS_REMOUNT = 32
+MS_BIND = 4096
+# umount flags
+MNT_DETACH = 2
+
+# ioctl sharing the data blocks of a file with another one
+FICLONE = 0x40049409
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+_utimensat = _libc_func("utimensat", ctypes.c_int,
+                        [ctypes.c_int, ctypes.c_char_p,
+                         ctypes.POINTER(_timespec), ctypes.c_int])
+
+def _raise_errno(what):
+    err = ctypes.get_errno()
+    raise OSError(err, "%s: %s" % (what, os.strerror(err)))
+
+def _check_available(func, name):
+    if func is None:
+        raise OSError(errno.ENOSYS, "%s is not available" % name)
+
+def copy_file_range(fd_in, fd_out, count):
+    """ Copy up to count bytes from fd_in to fd_out inside the kernel,
+        starting at the current file offsets.
+
+        :returns: number of bytes copied, 0 at end of file
+        :rtype: int
+    """
+    _check_available(_copy_file_range, "copy_file_range")
+    ret = _copy_file_range(fd_in, None, fd_out, None, count, 0)
+    if ret < 0:
+        _raise_errno("copy_file_range")
+    return ret
+
+def sendfile(fd_out, fd_in, count):
+    """ Copy up to count bytes from fd_in to fd_out using sendfile(2),
+        starting at the current file offsets.
+
+        :returns: number of bytes copied, 0 at end of file
+        :rtype: int
+    """
+    _check_available(_sendfile, "sendfile")
+    ret = _sendfile(fd_out, fd_in, None, count)
+    if ret < 0:
+        _raise_errno("sendfile")
+    return ret
+
+def llistxattr(path):
+    """ Return the list of extended attribute names of path, not following
+        symlinks.
+    """
+    _check_available(_llistxattr, "llistxattr")
+    while True:
+        size = _llistxattr(path, None, 0)
+        if size < 0:
+            _raise_errno("llistxattr %s" % path)
+        if size == 0:
+            return []
+        buf = ctypes.create_string_buffer(size)
+        ret = _llistxattr(path, buf, size)
+        if ret >= 0:
+            return [n for n in buf.raw[:ret].split("\0") if n]
+        # the list grew between the two calls, try again
+        if ctypes.get_errno() != errno.ERANGE:
+            _raise_errno("llistxattr %s" % path)
+
+def lgetxattr(path, name):
+    """ Return the value of the extended attribute name of path, not
+        following symlinks.
+    """
+    _check_available(_lgetxattr, "lgetxattr")
+    while True:
+        size = _lgetxattr(path, name, None, 0)
+        if size < 0:
+            _raise_errno("lgetxattr %s %s" % (path, name))
+        buf = ctypes.create_string_buffer(max(size, 1))
+        ret = _lgetxattr(path, name, buf, size)
+        if ret >= 0:
+            return buf.raw[:ret]
+        if ctypes.get_errno() != errno.ERANGE:
+            _raise_errno("lgetxattr %s %s" % (path, name))
+
+def lsetxattr(path, name, value):
+    """ Set the extended attribute name of path to value, not following
+        symlinks.
+    """
+    _check_available(_lsetxattr, "lsetxattr")
+    if _lsetxattr(path, name, value, len(value), 0) < 0:
+        _raise_errno("lsetxattr %s %s" % (path, name))
+
+def copy_xattrs(src, dst):
+    """ Copy all extended attributes (and thus POSIX ACLs, which are stored
+        as system.posix_acl_* attributes) from src to dst.
+    """
+    for name in llistxattr(src):
+        lsetxattr(dst, name, lgetxattr(src, name))
+
+def lutime(path, times):
+    """ Like os.utime, but does not follow symlinks.
+
+        :param times: (atime, mtime) tuple of floats
+    """
+    _check_available(_utimensat, "utimensat")
+    tspec = (_timespec * 2)()
+    for idx, value in enumerate(times):
+        tspec[idx].tv_sec = int(value)
+        tspec[idx].tv_nsec = int((value - int(value)) * 1e9)
+    if _utimensat(AT_FDCWD, path, tspec, AT_SYMLINK_NOFOLLOW) < 0:
+        _raise_errno("utimensat %s" % path)
+
+def clone_file(src_fd, dst_fd):
+    """ Make dst_fd share all the data blocks of src_fd (a reflink); both
+        have to be on the same file system and the file system has to
+        support it.
+    """
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except IOError as e:
+        raise OSError(e.errno, "FICLONE: %s" % os.strerror(e.errno))
+
+def mount(source, target, fstype=None, flags=0):
+    """ Call mount(2), see there. """
+    _check_available(_mount, "mount")
+    if _mount(source, target, fstype, flags, None) < 0:
+        _raise_errno("mount %s on %s" % (source, target))
+
+def umount(target, flags=0):
+    """ Call umount2(2), see there. """
+    _check_available(_umount2, "umount2")
+    if _umount2(target, flags) < 0:
+        _raise_errno("umount %s" % target)
+
+def openat(dir_fd, name, flags, mode=0):
+    """ Like os.open, name being relative to the directory dir_fd.
+
+        :returns: the new file descriptor
+    """
+    _check_available(_openat, "openat")
+    fd = _openat(dir_fd, name, flags, mode)
+    if fd < 0:
+        _raise_errno("openat %s" % name)
+    return fd
+
+def lchownat(dir_fd, name, uid, gid):
+    """ Like os.lchown, name being relative to the directory dir_fd. """
+    _check_available(_fchownat, "fchownat")
+    if _fchownat(dir_fd, name, uid, gid, AT_SYMLINK_NOFOLLOW) < 0:
+        _raise_errno("fchownat %s" % name)
@@ -26,9 +26,11 @@ from pyanaconda.bootloader import writeBootLoader
 from pyanaconda.progress import progress_report, progressQ
 from pyanaconda.users import createLuserConf, getPassAlgo, Users
 from pyanaconda import flags
+from pyanaconda import iutil
 from pyanaconda import timezone
 from pyanaconda.i18n import _
 from pyanaconda.threads import threadMgr
+from pyanaconda.facts import facts
 import logging
 log = logging.getLogger("anaconda")
 
@@ -101,6 +103,9 @@ def doConfiguration(storage, payload, ksdata, instClass):
         with progress_report(_("Joining realm: %s") % ksdata.realm.discovered):
             ksdata.realm.execute(storage, ksdata, instClass)
 
+    # before the post-installation scripts copy the logs to the target
+    iutil.log_command_summary()
+
     with progress_report(_("Running post-installation scripts")):
         runPostScripts(ksdata.scripts)
 
@@ -108,6 +113,8 @@ def doConfiguration(storage, payload, ksdata, instClass):
     # kickstart file over if one exists).
     _writeKS(ksdata)
 
+    iutil.stop_chroot_runner()
+
     progressQ.send_complete()
 
 def doInstall(storage, payload, ksdata, instClass):
@@ -145,6 +152,8 @@ def doInstall(storage, payload, ksdata, instClass):
     payload.preStorage()
 
     turnOnFilesystems(storage, mountOnly=flags.flags.dirInstall)
+    # logical volumes may have just been created
+    facts.invalidate("lvm")
     if not flags.flags.livecdInstall and not flags.flags.dirInstall:
         storage.write()
 
@@ -171,6 +180,11 @@ def doInstall(storage, payload, ksdata, instClass):
     if flags.flags.livecdInstall:
         storage.write()
 
+    # the configuration runs many commands in the target system, with
+    # inst.chrootrunner they share a helper that sets up the chroot once
+    if flags.flags.cmdline.getbool("inst.chrootrunner"):
+        iutil.start_chroot_runner(ROOT_PATH)
+
     with progress_report(_("Performing post-installation setup tasks")):
         payload.postInstall()
 
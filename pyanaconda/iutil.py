@@ -22,6 +22,7 @@
 
 import glob
 import os
+import sys
 import stat
 import os.path
 import errno
@@ -29,10 +30,23 @@ import subprocess
 import unicodedata
 import string
 import types
-from threading import Thread
-from Queue import Queue, Empty
-
+import time
+import json
+import itertools
+import select
+import threading
+import multiprocessing
+from collections import deque
+from Queue import Queue, LifoQueue
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+from pyanaconda import fsutil
 from pyanaconda.flags import flags
+from pyanaconda.chrootrunner import ChrootRunner, ChrootRunnerError
 from pyanaconda.constants import DRACUT_SHUTDOWN_EJECT, ROOT_PATH, TRANSLATIONS_UPDATE_DIR, UNSUPPORTED_HW
 from pyanaconda.regexes import PROXY_URL_PARSE
 
@@ -40,7 +54,8 @@ import logging
 log = logging.getLogger("anaconda")
 program_log = logging.getLogger("program")
 
-from pyanaconda.anaconda_log import program_log_lock
+from pyanaconda.anaconda_log import program_log_lock, PROGRAM_LOG_DIR, \
+    COMMAND_TRACE_FILE
 
 def augmentEnv():
     env = os.environ.copy()
@@ -49,13 +64,284 @@ def augmentEnv():
                })
     return env
 
-def _run_program(argv, root='/', stdin=None, stdout=None, env_prune=None):
+_chroot_runner = None
+
+def start_chroot_runner(root=ROOT_PATH):
+    """ Run the commands chrooted in root through a single helper process
+        from now on, instead of setting up a chroot for each of them.
+
+        Commands needing stdin and commands run anywhere else are not
+        affected.  If the helper cannot be started or dies, commands are
+        run the usual way.
+    """
+    global _chroot_runner
+
+    stop_chroot_runner()
+    runner = ChrootRunner(root)
+    try:
+        runner.start()
+    except OSError as e:
+        log.error("cannot start the command helper: %s", e)
+        return
+    _chroot_runner = runner
+
+def stop_chroot_runner():
+    """ Stop the helper started by start_chroot_runner(), if any. """
+    global _chroot_runner
+
+    runner = _chroot_runner
+    _chroot_runner = None
+    if runner:
+        runner.stop()
+
+class CommandLog(object):
+    """ Log of a single external command.
+
+        Every command gets an id tagging its lines in program.log, so the
+        output of commands running at the same time can be told apart.
+        With the inst.cmdlogs boot option the output goes to a file of its
+        own in PROGRAM_LOG_DIR instead, program.log only names it.
+
+        A buffered log keeps everything until flush(), to write the log of
+        a command in one block.
+
+        program_log_lock is only held while writing to program.log.
+
+        Once the command finishes, its wall time, resource usage and amount
+        of output are added to the command trace, see trace_command().
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, argv, root="/", buffered=False):
+        self.id = next(self._ids)
+        self.argv = argv
+        self.root = root
+        self.timed_out = False
+        self.output_bytes = 0
+        self._start = time.time()
+        self._thread = threading.current_thread().name
+        self._file = None
+        self._to_file = flags.cmdline.getbool("inst.cmdlogs")
+        self._records = [] if buffered else None
+        self._log(logging.INFO, "Running... %s", " ".join(argv))
+
+    def _log(self, level, fmt, *args):
+        fmt = "[%d] " + fmt
+        args = (self.id,) + args
+        if self._records is not None:
+            self._records.append((level, fmt, args))
+            return
+        with program_log_lock:
+            program_log.log(level, fmt, *args)
+
+    def flush(self):
+        """ Write the records kept by a buffered log. """
+        if not self._records:
+            return
+        with program_log_lock:
+            for level, fmt, args in self._records:
+                program_log.log(level, fmt, *args)
+        del self._records[:]
+
+    def _open(self):
+        mkdirChain(PROGRAM_LOG_DIR)
+        path = os.path.join(PROGRAM_LOG_DIR, "%04d-%s.log"
+                            % (self.id, os.path.basename(self.argv[0])))
+        try:
+            self._file = open(path, "w")
+        except IOError as e:
+            log.error("cannot log the output of %s to %s: %s", self.argv[0],
+                      path, e)
+            self._to_file = False
+            return
+        self._log(logging.INFO, "output in %s", path)
+
+    def lines(self, lines):
+        """ Log lines of output, without their line breaks. """
+        self.output_bytes += sum(len(line) + 1 for line in lines)
+        if self._to_file and self._file is None:
+            self._open()
+        if self._file:
+            for line in lines:
+                self._file.write(line + "\n")
+            return
+        if self._records is not None:
+            for line in lines:
+                self._log(logging.INFO, "%s", line)
+            return
+        with program_log_lock:
+            for line in lines:
+                program_log.info("[%d] %s", self.id, line)
+
+    def error(self, e):
+        self.close()
+        self._log(logging.ERROR, "Error running %s: %s", self.argv[0],
+                  e.strerror)
+
+    def kill(self, proc, timeout):
+        """ Kill proc, which has been running for timeout seconds. """
+        self.timed_out = True
+        self._log(logging.ERROR, "Killing %s after %s seconds", self.argv[0],
+                  timeout)
+        try:
+            proc.kill()
+        except OSError:
+            # it exited meanwhile
+            pass
+
+    def finish(self, returncode, rusage=None):
+        """ Log the end of the command.
+
+            :param rusage: (user time, system time, max RSS in KiB) of the
+                           command, None if unknown
+            :type rusage: tuple or None
+        """
+        self.close()
+        self._log(logging.DEBUG, "Return code: %d", returncode)
+        utime, stime, maxrss = rusage or (None, None, None)
+        if rusage:
+            utime, stime = round(utime, 3), round(stime, 3)
+        trace_command({"id": self.id,
+                       "argv": self.argv,
+                       "root": self.root,
+                       "thread": self._thread,
+                       "start": round(self._start, 3),
+                       "wall": round(time.time() - self._start, 3),
+                       "utime": utime,
+                       "stime": stime,
+                       "maxrss_kb": maxrss,
+                       "output_bytes": self.output_bytes,
+                       "returncode": returncode,
+                       "timed_out": self.timed_out})
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+_trace_lock = threading.Lock()
+_traced_commands = []
+
+def trace_command(record):
+    """ Add the record of a finished command to the command trace, kept in
+        memory for log_command_summary() and appended to COMMAND_TRACE_FILE
+        as a line of JSON.
+
+        :param record: wall time, resource usage and so on of the command
+        :type record: dict
+    """
+    line = json.dumps(record, sort_keys=True)
+    with _trace_lock:
+        _traced_commands.append(record)
+        try:
+            with open(COMMAND_TRACE_FILE, "a") as f:
+                f.write(line + "\n")
+        except IOError as e:
+            log.debug("cannot write to %s: %s", COMMAND_TRACE_FILE, e)
+
+def log_command_summary(count=10):
+    """ Log the count external commands that took the longest so far, and
+        the totals of all of them.
+    """
+    with _trace_lock:
+        records = list(_traced_commands)
+    if not records:
+        return
+
+    def cpu(record):
+        return (record["utime"] or 0.0) + (record["stime"] or 0.0)
+
+    log.info("%d external commands: %.1f s wall time, %.1f s CPU time",
+             len(records), sum(r["wall"] for r in records),
+             sum(cpu(r) for r in records))
+    log.info("the %d longest ones:", min(count, len(records)))
+    for record in sorted(records, key=lambda r: r["wall"], reverse=True)[:count]:
+        log.info("  [%d] %.2f s wall, %.2f s CPU, %s KiB max RSS, %d bytes "
+                 "of output: %s", record["id"], record["wall"], cpu(record),
+                 record["maxrss_kb"] if record["maxrss_kb"] is not None
+                 else "?", record["output_bytes"], " ".join(record["argv"]))
+
+def _wait_rusage(proc, block=True):
+    """ Like proc.wait(), or proc.poll() if block is False, getting the
+        resource usage of proc on the way.
+
+        :returns: (returncode, (user time, system time, max RSS in KiB)),
+                  the usage is None if proc had been waited for already
+    """
+    if proc.returncode is not None:
+        return (proc.returncode, None)
+
+    while True:
+        try:
+            pid, status, rusage = os.wait4(proc.pid, 0 if block else os.WNOHANG)
+            break
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno != errno.ECHILD:
+                raise
+            # reaped by someone else, let subprocess sort it out
+            return (proc.wait() if block else proc.poll(), None)
+
+    if pid == 0:
+        return (None, None)
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return (proc.returncode,
+            (rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss))
+
+def _run_in_runner(argv, root, stdin, env, on_lines):
+    """ Run argv through the chroot helper, if it serves root.
+
+        :param on_lines: called with each batch of complete output lines
+        :returns: (returncode, output, rusage), None if argv has to be run
+                  the usual way
+    """
+    runner = _chroot_runner
+    if runner is None or stdin is not None or not runner.alive or \
+            os.path.normpath(root) != os.path.normpath(runner.root):
+        return None
+
+    try:
+        output = runner.run(argv, env)
+    except ChrootRunnerError as e:
+        log.error("command helper failed, running commands directly: %s", e)
+        return None
+
+    chunks = []
+    pending = ""
+    returncode = None
+    rusage = None
+    try:
+        for chunk in output:
+            chunks.append(chunk)
+            lines = (pending + chunk).split("\n")
+            pending = lines.pop()
+            if lines:
+                on_lines(lines)
+        returncode = output.returncode
+        rusage = output.rusage
+    except ChrootRunnerError as e:
+        # the command may have done part of its job, do not run it again
+        log.error("command helper died running %s: %s", argv[0], e)
+        returncode = -1
+    if pending:
+        on_lines([pending])
+    return (returncode, "".join(chunks), rusage)
+
+def _run_program(argv, root='/', stdin=None, stdout=None, env_prune=None,
+                 env_add=None, timeout=None, cmdlog=None):
     """ Run an external program, log the output and return it to the caller
         @param argv The command to run and argument
         @param root The directory to chroot to before running command.
         @param stdin The file object to read stdin from.
         @param stdout Optional file object to write stdout and stderr to.
         @param env_prune environment variable to remove before execution
+        @param env_add dict of environment variables to set
+        @param timeout seconds after which the program is killed
+        @param cmdlog CommandLog to use instead of a new one
         @return The return code of the command and the output
     """
     if env_prune is None:
@@ -66,35 +352,56 @@ def _run_program(argv, root='/', stdin=None, stdout=None, env_prune=None):
             os.chroot(root)
             os.chdir("/")
 
-    with program_log_lock:
-        program_log.info("Running... %s", " ".join(argv))
+    if cmdlog is None:
+        cmdlog = CommandLog(argv, root=root)
 
-        env = augmentEnv()
-        for var in env_prune:
-            env.pop(var, None)
+    def on_lines(lines):
+        cmdlog.lines(lines)
+        if stdout:
+            for line in lines:
+                stdout.write(line)
+                stdout.write("\n")
 
-        try:
+    env = augmentEnv()
+    env.update(env_add or {})
+    for var in env_prune:
+        env.pop(var, None)
+
+    try:
+        result = None
+        if timeout is None:
+            # the helper cannot kill commands
+            result = _run_in_runner(argv, root, stdin, env, on_lines)
+        if result is None:
             proc = subprocess.Popen(argv,
                                     stdin=stdin,
                                     stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT,
+                                    stderr=subprocess.STDOUT, bufsize=-1,
                                     preexec_fn=chroot, cwd=root, env=env)
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, cmdlog.kill,
+                                        args=(proc, timeout))
+                timer.daemon = True
+                timer.start()
+            # stream the output, other commands may be logging meanwhile
+            out = []
+            try:
+                for line in iter(proc.stdout.readline, b''):
+                    out.append(line)
+                    on_lines([line.rstrip("\r\n")])
+                proc.stdout.close()
+                returncode, rusage = _wait_rusage(proc)
+            finally:
+                if timer:
+                    timer.cancel()
+            result = (returncode, "".join(out), rusage)
+    except OSError as e:
+        cmdlog.error(e)
+        raise
 
-            out = proc.communicate()[0]
-            if out:
-                for line in out.splitlines():
-                    program_log.info(line)
-                    if stdout:
-                        stdout.write(line)
-                        stdout.write("\n")
-
-        except OSError as e:
-            program_log.error("Error running %s: %s", argv[0], e.strerror)
-            raise
-
-        program_log.debug("Return code: %d", proc.returncode)
-
-    return (proc.returncode, out)
+    cmdlog.finish(result[0], result[2])
+    return result[:2]
 
 def execWithRedirect(command, argv, stdin=None, stdout=None,
                      root='/', env_prune=None):
@@ -131,6 +438,82 @@ def execWithCapture(command, argv, stdin=None, root='/'):
     argv = [command] + argv
     return _run_program(argv, stdin=stdin, root=root)[1]
 
+class LineReader(object):
+    """ Read the output of several processes at the same time, line by line,
+        with poll() and without threads.
+
+        Processes are added with add() and must have been started with
+        stdout=subprocess.PIPE.  Iterating over the reader yields
+        (key, line) tuples, lines without their line break, until all the
+        processes closed their output; each process is waited for once its
+        output is closed.  The resource usage of the processes, as returned
+        by _wait_rusage(), is then in the rusage dict, by key.
+    """
+    # milliseconds without output after which exited processes are checked
+    # for, their output may be held open by a child left behind
+    EXIT_CHECK_INTERVAL = 1000
+
+    def __init__(self):
+        self._poller = select.poll()
+        self._streams = {}
+        self.rusage = {}
+
+    def add(self, key, proc):
+        fd = proc.stdout.fileno()
+        self._streams[fd] = [key, proc, ""]
+        self._poller.register(fd, select.POLLIN | select.POLLPRI)
+
+    def _close(self, fd):
+        key, proc, pending = self._streams.pop(fd)
+        self._poller.unregister(fd)
+        proc.stdout.close()
+        rusage = _wait_rusage(proc)[1]
+        if rusage is not None:
+            self.rusage[key] = rusage
+        if pending:
+            return [(key, pending)]
+        return []
+
+    def __iter__(self):
+        while self._streams:
+            try:
+                events = self._poller.poll(self.EXIT_CHECK_INTERVAL)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if not events:
+                # nothing is buffered in the pipes of exited processes
+                for fd, (key, proc, _pending) in self._streams.items():
+                    returncode, rusage = _wait_rusage(proc, block=False)
+                    if rusage is not None:
+                        self.rusage[key] = rusage
+                    if returncode is not None:
+                        for item in self._close(fd):
+                            yield item
+                continue
+
+            for fd, _event in events:
+                stream = self._streams[fd]
+                try:
+                    data = os.read(fd, 65536)
+                except OSError as e:
+                    if e.errno in (errno.EINTR, errno.EAGAIN):
+                        continue
+                    if e.errno != errno.EIO:
+                        raise
+                    data = ""
+                if not data:
+                    for item in self._close(fd):
+                        yield item
+                    continue
+
+                lines = (stream[2] + data).split("\n")
+                stream[2] = lines.pop()
+                for line in lines:
+                    yield (stream[0], line)
+
 def execReadlines(command, argv, stdin=None, root='/', env_prune=None):
     """ Execute an external command and return the line output of the command
         in real-time.
@@ -149,20 +532,13 @@ def execReadlines(command, argv, stdin=None, root='/', env_prune=None):
     if env_prune is None:
         env_prune = []
 
-    # Return the lines from stdout via a Queue
-    def queue_lines(out, queue):
-        for line in iter(out.readline, b''):
-            queue.put(line.strip())
-        out.close()
-
     def chroot():
         if root and root != '/':
             os.chroot(root)
             os.chdir("/")
 
     argv = [command] + argv
-    with program_log_lock:
-        program_log.info("Running... %s", " ".join(argv))
+    cmdlog = CommandLog(argv, root=root)
 
     env = augmentEnv()
     for var in env_prune:
@@ -172,27 +548,217 @@ def execReadlines(command, argv, stdin=None, root='/', env_prune=None):
                                 stdin=stdin,
                                 stdout=subprocess.PIPE,
                                 stderr=subprocess.STDOUT,
-                                bufsize=1,
                                 preexec_fn=chroot, cwd=root, env=env)
     except OSError as e:
-        program_log.error("Error running %s: %s", argv[0], e.strerror)
+        cmdlog.error(e)
         raise
 
-    q = Queue()
-    t = Thread(target=queue_lines, args=(proc.stdout, q))
-    t.daemon = True # thread dies with the program
-    t.start()
+    reader = LineReader()
+    reader.add(None, proc)
+    for _key, line in reader:
+        cmdlog.output_bytes += len(line) + 1
+        yield line.strip()
+    cmdlog.finish(proc.returncode, reader.rusage.get(None))
+
+def start_program(argv, **kwargs):
+    """ Start an external program that the caller talks to itself, as a
+        stage of a pipeline for instance.  It is logged and traced like
+        the programs run by execWithRedirect() once wait_program() is
+        called for it.
+
+        :param argv: the command to run and its arguments
+        :type argv: list of str
+        :param kwargs: passed to subprocess.Popen
+        :rtype: subprocess.Popen
+    """
+    cmdlog = CommandLog(argv)
+    kwargs.setdefault("env", augmentEnv())
+    try:
+        proc = subprocess.Popen(argv, **kwargs)
+    except OSError as e:
+        cmdlog.error(e)
+        raise
+    proc.cmdlog = cmdlog
+    return proc
 
-    while True:
+def wait_program(proc, output=None):
+    """ Wait for a program started with start_program() and log its end.
+
+        :param output: lines the program wrote, if it did not write to a
+                       pipe read by the caller
+        :type output: list of str or None
+        :returns: the return code of the program
+        :rtype: int
+    """
+    returncode, rusage = _wait_rusage(proc)
+    if output:
+        proc.cmdlog.lines(output)
+    proc.cmdlog.finish(returncode, rusage)
+    return returncode
+
+
+class CommandFuture(object):
+    """ A command submitted to a CommandPool. """
+    def __init__(self, argv):
+        self.argv = argv
+        self.returncode = None
+        self.output = None
+        self.timed_out = False
+        self.cmdlog = None
+        self._exc_info = None
+        self._done = threading.Event()
+
+    def _run(self, kwargs):
+        if flags.testing:
+            log.info("not running command because we're testing: %s",
+                     " ".join(self.argv))
+            self.returncode, self.output = 0, ""
+            self._done.set()
+            return
+
+        self.cmdlog = CommandLog(self.argv, root=kwargs.get("root", "/"),
+                                 buffered=True)
         try:
-            line = q.get(timeout=.1)
-            yield line
-            q.task_done()
-        except Empty:
-            if proc.poll() is not None:
-                break
-    q.join()
+            self.returncode, self.output = _run_program(self.argv,
+                                                        cmdlog=self.cmdlog,
+                                                        **kwargs)
+            self.timed_out = self.cmdlog.timed_out
+        except Exception: # pylint: disable=broad-except
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self):
+        """ Return the exception raised running the command, None if it
+            could be run.  Waits for the command.
+        """
+        self._done.wait()
+        return self._exc_info[1] if self._exc_info else None
+
+    def result(self):
+        """ Wait for the command and return its return code, raising the
+            error that prevented running it, if any.
+        """
+        self._done.wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self.returncode
+
+class CommandPool(object):
+    """ Run independent external commands, at most workers of them at the
+        same time.
+
+        Commands are submitted with submit(), which returns a CommandFuture
+        right away.  The log of each command is written to program.log in
+        one block, in the order the commands were submitted.  wait()
+        returns once all the commands finished and raises the first error
+        that prevented running one, like threadMgr.wait() does for threads.
+
+        The worker threads are AnacondaThreads registered with threadMgr,
+        so a failure of the pool itself goes through the usual exception
+        handling.
+    """
+    _pool_ids = itertools.count()
 
+    def __init__(self, workers=None, name="AnaCommandPool"):
+        """
+            :param workers: maximum number of commands running at once, the
+                            number of CPUs if not given
+            :type workers: int or None
+            :param name: prefix of the worker thread names
+            :type name: str
+        """
+        self.workers = workers or multiprocessing.cpu_count()
+        self.name = "%s%d" % (name, next(self._pool_ids))
+        self.futures = []
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._pending = deque()
+        self._unlogged = deque()
+        self._active = 0
+        self._started = 0
+
+    def submit(self, command, argv, root='/', env_prune=None, env=None,
+               timeout=None):
+        """ Submit command with the arguments argv.
+
+            :param root: the directory to chroot to
+            :param env_prune: environment variables to remove
+            :type env_prune: list of str
+            :param env: environment variables to set
+            :type env: dict
+            :param timeout: seconds after which the command is killed
+            :type timeout: int or None
+            :rtype: CommandFuture
+        """
+        future = CommandFuture([command] + argv)
+        kwargs = {"root": root, "env_prune": env_prune, "env_add": env,
+                  "timeout": timeout}
+        with self._lock:
+            self.futures.append(future)
+            self._pending.append((future, kwargs))
+            self._unlogged.append(future)
+            start = self._active < self.workers
+            if start:
+                self._active += 1
+                idx = self._started
+                self._started += 1
+        if start:
+            self._start_worker("%s-%d" % (self.name, idx))
+        return future
+
+    def submit_all(self, specs):
+        """ Submit (command, argv) or (command, argv, kwargs) tuples, the
+            kwargs being those of submit().
+
+            :returns: the futures, in the order of specs
+            :rtype: list of CommandFuture
+        """
+        futures = []
+        for spec in specs:
+            kwargs = spec[2] if len(spec) > 2 else {}
+            futures.append(self.submit(spec[0], spec[1], **kwargs))
+        return futures
+
+    def _start_worker(self, name):
+        from pyanaconda import threads
+        if threads.threadMgr:
+            threads.threadMgr.add(threads.AnacondaThread(name=name,
+                                                         target=self._worker))
+        else:
+            thread = threading.Thread(name=name, target=self._worker)
+            thread.daemon = True
+            thread.start()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._active -= 1
+                    return
+                future, kwargs = self._pending.popleft()
+            future._run(kwargs)
+            self._flush_logs()
+
+    def _flush_logs(self):
+        with self._log_lock:
+            while self._unlogged and self._unlogged[0].done():
+                future = self._unlogged.popleft()
+                if future.cmdlog:
+                    future.cmdlog.flush()
+
+    def wait(self):
+        """ Wait for all the submitted commands.
+
+            :returns: the return codes, in submission order
+            :rtype: list of int
+        """
+        for future in list(self.futures):
+            future.exception()
+        self._flush_logs()
+        return [future.result() for future in self.futures]
 
 ## Run a shell.
 def execConsole():
@@ -202,44 +768,156 @@ def execConsole():
     except OSError as e:
         raise RuntimeError("Error running /bin/sh: " + e.strerror)
 
-def getDirSize(directory):
-    """ Get the size of a directory and all its subdirectories.
-    @param dir The name of the directory to find the size of.
-    @return The size of the directory in kilobytes.
+class DirUsage(object):
+    """ Disk usage of a directory tree, see dir_usage(). """
+    def __init__(self):
+        # apparent size and allocated blocks of the regular files, in bytes,
+        # hardlinked files counted once
+        self.bytes = 0
+        self.allocated = 0
+        # number of entries that are not directories, hardlinks included
+        self.files = 0
+        # how many of them are extra names of a file already counted
+        self.hardlinks = 0
+        # relative path ("/" for the tree itself) -> (bytes, allocated) of
+        # the subtrees, down to the requested depth
+        self.dirs = {}
+
+def _scan_dir(directory):
+    """ Return the (name, is_dir, lstat result) entries of directory; the
+        stat result is None for the entries that do not need one.
     """
-    def getSubdirSize(directory):
-        # returns size in bytes
+    entries = []
+    if scandir is not None:
+        for entry in scandir(directory):
+            # the file type comes with the directory entry, only the
+            # directories and regular files need to be stat-ed
+            if entry.is_symlink() or not (entry.is_dir() or entry.is_file()):
+                entries.append((entry.name, False, None))
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError as e:
+                log.debug("failed to stat %s/%s: %s", directory, entry.name, e)
+                continue
+            entries.append((entry.name, stat.S_ISDIR(st.st_mode), st))
+        return entries
+
+    for name in os.listdir(directory):
         try:
-            mydev = os.lstat(directory)[stat.ST_DEV]
+            st = os.lstat(os.path.join(directory, name))
         except OSError as e:
-            log.debug("failed to stat %s: %s", directory, e)
-            return 0
+            log.debug("failed to stat %s/%s: %s", directory, name, e)
+            continue
+        entries.append((name, stat.S_ISDIR(st.st_mode), st))
+    return entries
+
+def dir_usage(directory, workers=8, depth=0):
+    """ Return the DirUsage of directory, not crossing file systems.
+
+        The subdirectories are scanned by a pool of threads, the time is
+        spent waiting for the storage.
+
+        :param directory: the directory to measure
+        :type directory: str
+        :param workers: number of scanning threads
+        :type workers: int
+        :param depth: how many levels of subdirectories to report in
+                      DirUsage.dirs, None for all of them
+        :type depth: int or None
+        :rtype: DirUsage
+    """
+    directory = os.path.normpath(directory)
+    usage = DirUsage()
+    try:
+        root_dev = os.lstat(directory).st_dev
+    except OSError as e:
+        log.debug("failed to stat %s: %s", directory, e)
+        return usage
 
+    lock = threading.Lock()
+    inodes = set()
+    # relative path -> [bytes, allocated] of the files directly in it
+    own = {}
+    work_q = Queue()
+
+    def scan(relpath):
+        path = directory + relpath if relpath != "/" else directory
         try:
-            dirlist = os.listdir(directory)
+            entries = _scan_dir(path)
         except OSError as e:
-            log.debug("failed to listdir %s: %s", directory, e)
-            return 0
-
-        dsize = 0
-        for f in dirlist:
-            curpath = '%s/%s' % (directory, f)
-            try:
-                sinfo = os.lstat(curpath)
-            except OSError as e:
-                log.debug("failed to stat %s/%s: %s", directory, f, e)
+            log.debug("failed to list %s: %s", path, e)
+            return
+        dsize = dalloc = nfiles = nlinks = 0
+        subdirs = []
+        for name, is_dir, st in entries:
+            if is_dir:
+                if st.st_dev == root_dev:
+                    subdirs.append(relpath.rstrip("/") + "/" + name)
                 continue
+            nfiles += 1
+            if st is None or not stat.S_ISREG(st.st_mode):
+                continue
+            if st.st_nlink > 1:
+                with lock:
+                    if (st.st_dev, st.st_ino) in inodes:
+                        nlinks += 1
+                        continue
+                    inodes.add((st.st_dev, st.st_ino))
+            dsize += st.st_size
+            dalloc += st.st_blocks * 512
+        with lock:
+            own[relpath] = [dsize, dalloc]
+            usage.files += nfiles
+            usage.hardlinks += nlinks
+        for subdir in subdirs:
+            work_q.put(subdir)
+
+    def worker():
+        while True:
+            relpath = work_q.get()
+            if relpath is None:
+                return
+            try:
+                scan(relpath)
+            except Exception as e: # pylint: disable=broad-except
+                # a dead worker would leave the walk waiting forever
+                log.error("failed to scan %s%s: %s", directory, relpath, e)
+            finally:
+                work_q.task_done()
+
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(name="AnaDirUsage%d" % i, target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    work_q.put("/")
+    work_q.join()
+    for thread in threads:
+        work_q.put(None)
+
+    # roll the sizes up to the parent directories, deepest first
+    for relpath in sorted(own, key=lambda d: d.count("/"), reverse=True):
+        if relpath == "/":
+            continue
+        parent = os.path.dirname(relpath)
+        own[parent][0] += own[relpath][0]
+        own[parent][1] += own[relpath][1]
 
-            if stat.S_ISDIR(sinfo[stat.ST_MODE]):
-                if os.path.ismount(curpath):
-                    continue
-                if mydev == sinfo[stat.ST_DEV]:
-                    dsize += getSubdirSize(curpath)
-            elif stat.S_ISREG(sinfo[stat.ST_MODE]):
-                dsize += sinfo[stat.ST_SIZE]
+    usage.bytes, usage.allocated = own.get("/", (0, 0))
+    for relpath, sizes in own.items():
+        level = 0 if relpath == "/" else relpath.count("/")
+        if depth is None or level <= depth:
+            usage.dirs[relpath] = tuple(sizes)
+    return usage
 
-        return dsize
-    return getSubdirSize(directory)/1024
+def getDirSize(directory):
+    """ Get the size of a directory and all its subdirectories.
+    @param dir The name of the directory to find the size of.
+    @return The size of the directory in kilobytes.
+    """
+    return dir_usage(directory).bytes / 1024
 
 ## Create a directory path.  Don't fail if the directory already exists.
 # @param dir The directory path to create.
@@ -646,10 +1324,163 @@ def dir_tree_map(root, func, files=True, dirs=True):
         # directories under the directory entry will appear as directory entries
         # in the loop
 
+class _DirHandle(object):
+    """ File descriptor of a directory, closed once all the subdirectories
+        waiting for it have been opened.
+    """
+    def __init__(self, fd, path, users):
+        self.fd = fd
+        self.path = path
+        self._users = users
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if self._users:
+                return
+        os.close(self.fd)
+
+def fd_tree_map(root, func, files=True, dirs=True, stat_entries=False,
+                workers=8):
+    """
+    Apply func to all the files and directories in the directory tree under
+    root, root included, on a pool of threads.
+
+    The tree is walked through directory file descriptors: every entry is
+    given to func as a directory descriptor and a name in it, so renamed
+    or replaced path components cannot redirect the walk, and no path is
+    resolved again from the root.  Symlinks are not followed.
+
+    :param root: root of the directory tree the function should be mapped to
+    :type root: str
+    :param func: a function taking the descriptor of the directory holding
+                 the entry, the name of the entry and its lstat result (None
+                 unless stat_entries is set) and returning True if it
+                 changed the entry; OSErrors it raises are ignored
+    :type func: (int, str, stat result) -> bool
+    :param files: whether to apply the function to the files in the dir. tree
+    :type files: bool
+    :param dirs: whether to apply the function to the directories in the dir. tree
+    :type dirs: bool
+    :param stat_entries: whether func needs the lstat result of the entries
+    :type stat_entries: bool
+    :param workers: number of threads
+    :type workers: int
+    :returns: number of entries func changed
+    :rtype: int
+    """
+    root = os.path.normpath(os.path.abspath(root))
+    # list directories by their descriptor when /proc is there
+    by_fd = os.path.isdir("/proc/self/fd")
+    open_flags = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+    lock = threading.Lock()
+    counts = [0]
+    work_q = LifoQueue()
+
+    def apply(dir_fd, dir_path, name, st):
+        try:
+            if func(dir_fd, name, st):
+                return 1
+        except OSError as e:
+            log.debug("%s/%s: %s", dir_path, name, e)
+        return 0
+
+    def entries(fd, path):
+        """ Yield (name, is_dir, lstat result or None) of the directory. """
+        listed = "/proc/self/fd/%d" % fd if by_fd else path
+        if scandir is not None and not stat_entries:
+            for entry in scandir(listed):
+                yield entry.name, entry.is_dir(follow_symlinks=False), None
+            return
+        for name in os.listdir(listed):
+            if stat_entries:
+                try:
+                    st = os.lstat(os.path.join(listed, name))
+                except OSError as e:
+                    log.debug("failed to stat %s/%s: %s", path, name, e)
+                    continue
+                yield name, stat.S_ISDIR(st.st_mode), st
+                continue
+            # no file type without a stat, find it out by opening the entry
+            try:
+                os.close(fsutil.openat(fd, name, open_flags))
+                yield name, True, None
+            except OSError:
+                yield name, False, None
+
+    def scan(parent, name):
+        path = os.path.join(parent.path, name)
+        try:
+            fd = fsutil.openat(parent.fd, name, open_flags)
+        except OSError as e:
+            log.debug("failed to open %s: %s", path, e)
+            return
+        finally:
+            parent.release()
+
+        changed = 0
+        subdirs = []
+        try:
+            for entry_name, is_dir, st in entries(fd, path):
+                if is_dir:
+                    subdirs.append(entry_name)
+                    if dirs:
+                        changed += apply(fd, path, entry_name, st)
+                elif files:
+                    changed += apply(fd, path, entry_name, st)
+        except OSError as e:
+            log.debug("failed to list %s: %s", path, e)
+
+        with lock:
+            counts[0] += changed
+        if not subdirs:
+            os.close(fd)
+            return
+        handle = _DirHandle(fd, path, len(subdirs))
+        for subdir in subdirs:
+            work_q.put((handle, subdir))
+
+    def worker():
+        while True:
+            item = work_q.get()
+            if item is None:
+                return
+            try:
+                scan(*item)
+            except Exception as e: # pylint: disable=broad-except
+                # a dead worker would leave the walk waiting forever
+                log.error("failed to walk %s/%s: %s", item[0].path, item[1], e)
+            finally:
+                work_q.task_done()
+
+    parent_path, root_name = os.path.split(root)
+    parent = _DirHandle(os.open(parent_path, os.O_RDONLY | os.O_DIRECTORY),
+                        parent_path, 2)
+    if dirs:
+        st = os.lstat(root) if stat_entries else None
+        counts[0] += apply(parent.fd, parent_path, root_name, st)
+
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(name="AnaTreeMap%d" % i, target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    work_q.put((parent, root_name))
+    work_q.join()
+    for _thread in threads:
+        work_q.put(None)
+    for thread in threads:
+        thread.join()
+    parent.release()
+    return counts[0]
+
 def chown_dir_tree(root, uid, gid, from_uid_only=None, from_gid_only=None):
     """
     Change owner (uid and gid) of the files and directories under the given
-    directory tree (recursively).
+    directory tree (recursively).  Symlinks themselves are changed, they are
+    not followed.
 
     :param root: root of the directory tree that should be chown'ed
     :type root: str
@@ -663,27 +1494,32 @@ def chown_dir_tree(root, uid, gid, from_uid_only=None, from_gid_only=None):
     :param from_gid_only: if given, the owner is changed only for the files and
                           directories owned by that GID
     :type from_gid_only: int or None
+    :returns: number of files and directories changed
+    :rtype: int
 
     """
 
-    def conditional_chown(path, uid, gid, from_uid=None, from_gid=None):
-        stats = os.stat(path)
-        if (from_uid and stats.st_uid != from_uid) or \
-                (from_gid and stats.st_gid != from_gid):
+    def chown(dir_fd, name, _stats):
+        fsutil.lchownat(dir_fd, name, uid, gid)
+        return True
+
+    def conditional_chown(dir_fd, name, stats):
+        if (from_uid_only and stats.st_uid != from_uid_only) or \
+                (from_gid_only and stats.st_gid != from_gid_only):
             # owner UID or GID not matching, do nothing
-            return
+            return False
 
         # UID and GID matching or not required
-        os.chown(path, uid, gid)
+        fsutil.lchownat(dir_fd, name, uid, gid)
+        return True
 
     if not from_uid_only and not from_gid_only:
-        # the easy way
-        dir_tree_map(root, lambda path: os.chown(path, uid, gid))
+        # the easy way, no need to look at the current owners
+        changed = fd_tree_map(root, chown)
     else:
-        # conditional chown
-        dir_tree_map(root, lambda path: conditional_chown(path, uid, gid,
-                                                          from_uid_only,
-                                                          from_gid_only))
+        changed = fd_tree_map(root, conditional_chown, stat_entries=True)
+    log.info("changed the owner of %d entries under %s", changed, root)
+    return changed
 
 def is_unsupported_hw():
     """ Check to see if the hardware is supported or not.
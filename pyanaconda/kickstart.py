@@ -51,6 +51,7 @@ from pyanaconda.timezone import NTP_PACKAGE, NTP_SERVICE
 from pyanaconda import localization
 from pyanaconda import network
 from pyanaconda import nm
+from pyanaconda.servicebatch import ServiceBatch
 from pyanaconda.simpleconfig import SimpleConfigFile
 from pyanaconda.users import getPassAlgo
 from pyanaconda.desktop import Desktop
@@ -1302,19 +1303,10 @@ class SELinux(commands.selinux.FC3_SELinux):
 
 class Services(commands.services.FC6_Services):
     def execute(self, storage, ksdata, instClass):
-        for svc in self.disabled:
-            if not svc.endswith(".service"):
-                svc += ".service"
-
-            iutil.execWithRedirect("systemctl", ["disable", svc],
-                                   root=ROOT_PATH)
-
-        for svc in self.enabled:
-            if not svc.endswith(".service"):
-                svc += ".service"
-
-            iutil.execWithRedirect("systemctl", ["enable", svc],
-                                   root=ROOT_PATH)
+        services = ServiceBatch()
+        services.disable(*self.disabled)
+        services.enable(*self.enabled)
+        services.apply()
 
 class Timezone(commands.timezone.F18_Timezone):
     def __init__(self, *args):
@@ -31,7 +31,7 @@ import ntplib
 import socket
 
 from pyanaconda import isys
-from pyanaconda.threads import threadMgr, AnacondaThread
+from pyanaconda.threads import threadMgr, PRIORITY_HIGH
 from pyanaconda.constants import THREAD_SYNC_TIME_BASENAME
 
 NTP_CONFIG_FILE = "/etc/chrony.conf"
@@ -192,9 +192,9 @@ def one_time_sync(server, callback=None):
 def one_time_sync_async(server, callback=None):
     """
     Asynchronously synchronize the system time with a given NTP server. This
-    function is non-blocking it starts a new thread for synchronization and
+    function is non-blocking it submits a task for synchronization and
     returns. Use callback argument to specify the function called when the
-    new thread finishes if needed.
+    task finishes if needed.
 
     :param server: NTP server
     :param callback: callback function to run after sync or failure
@@ -203,9 +203,9 @@ def one_time_sync_async(server, callback=None):
     """
 
     thread_name = "%s_%s" % (THREAD_SYNC_TIME_BASENAME, server)
-    if threadMgr.get(thread_name):
+    if threadMgr.exists(thread_name):
         #syncing with the same server running
         return
 
-    threadMgr.add(AnacondaThread(name=thread_name, target=one_time_sync,
-                                 args=(server, callback)))
+    threadMgr.submit(one_time_sync, args=(server, callback), name=thread_name,
+                     priority=PRIORITY_HIGH)
@@ -32,7 +32,6 @@ import os, sys
 from urlgrabber.grabber import URLGrabber
 from urlgrabber.grabber import URLGrabError
 import ConfigParser
-import shutil
 import time
 
 if __name__ == "__main__":
@@ -48,6 +47,7 @@ from pyanaconda.image import findFirstIsoImage
 from pyanaconda.image import mountImage
 from pyanaconda.image import opticalInstallMedia
 from pyanaconda.iutil import ProxyString, ProxyStringError
+from pyanaconda.packaging import staging
 
 from pykickstart.parser import Group
 
@@ -552,21 +552,24 @@ class Payload(object):
 
         # Multiple driver disks may be loaded, so we need to glob for all
         # the firmware files in the common DD firmware directory
+        # the files stay on the installed system, share their data blocks
+        # with the originals where the file system allows it
         for f in glob.glob(DD_FIRMWARE+"/*"):
             try:
-                shutil.copyfile(f, "%s/lib/firmware/" % ROOT_PATH)
-            except IOError as e:
+                staging.clone_file(f, "%s/lib/firmware/%s"
+                                   % (ROOT_PATH, os.path.basename(f)))
+            except EnvironmentError as e:
                 log.error("Could not copy firmware file %s: %s", f, e.strerror)
 
         #copy RPMS
         for d in glob.glob(DD_RPMS):
-            shutil.copytree(d, ROOT_PATH + "/root/" + os.path.basename(d))
+            staging.clone_tree(d, ROOT_PATH + "/root/" + os.path.basename(d))
 
         #copy modules and firmware into root's home directory
         if os.path.exists(DD_ALL):
             try:
-                shutil.copytree(DD_ALL, ROOT_PATH + "/root/DD")
-            except IOError as e:
+                staging.clone_tree(DD_ALL, ROOT_PATH + "/root/DD")
+            except EnvironmentError as e:
                 log.error("failed to copy driver disk files: %s", e.strerror)
                 # XXX TODO: real error handling, as this is probably going to
                 #           prevent boot on some systems
@@ -584,22 +587,27 @@ class Payload(object):
         if not force and self._createdInitrds:
             return
 
+        # the images of different kernels are independent, but
+        # new-kernel-pkg also updates the bootloader configuration, so only
+        # plain dracut runs are done at the same time
+        pool = iutil.CommandPool(workers=None if flags.imageInstall else 1)
         for kernel in self.kernelVersionList:
             log.info("recreating initrd for %s", kernel)
             if not flags.imageInstall:
-                iutil.execWithRedirect("new-kernel-pkg",
-                                       ["--mkinitrd", "--dracut",
-                                        "--depmod", "--update", kernel],
-                                       root=ROOT_PATH)
+                pool.submit("new-kernel-pkg",
+                            ["--mkinitrd", "--dracut",
+                             "--depmod", "--update", kernel],
+                            root=ROOT_PATH)
             else:
                 # hostonly is not sensible for disk image installations
                 # using /dev/disk/by-uuid/ is necessary due to disk image naming
-                iutil.execWithRedirect("dracut",
-                                       ["-N",
-                                        "--persistent-policy", "by-uuid",
-                                        "-f", "/boot/initramfs-%s.img" % kernel,
-                                        kernel],
-                                        root=ROOT_PATH)
+                pool.submit("dracut",
+                            ["-N",
+                             "--persistent-policy", "by-uuid",
+                             "-f", "/boot/initramfs-%s.img" % kernel,
+                             kernel],
+                            root=ROOT_PATH)
+        pool.wait()
 
         self._createdInitrds = True
 
@@ -899,14 +907,17 @@ class PackagePayload(Payload):
 
         return url, mirrorlist, sslverify
 
+# threads payloadInitialize needs, to be given as the requires of its task
+# FIXME: condition for cases where we don't want network
+# (set and use payload.needsNetwork ?)
+PAYLOAD_INIT_REQUIRES = (THREAD_STORAGE, THREAD_WAIT_FOR_CONNECTING_NM)
+
 def payloadInitialize(storage, ksdata, payload):
     from pyanaconda.threads import threadMgr
 
-    threadMgr.wait(THREAD_STORAGE)
-
-    # FIXME: condition for cases where we don't want network
-    # (set and use payload.needsNetwork ?)
-    threadMgr.wait(THREAD_WAIT_FOR_CONNECTING_NM)
+    # no-ops when run as a task requiring them
+    for name in PAYLOAD_INIT_REQUIRES:
+        threadMgr.wait(name)
 
     payload.setup(storage)
 
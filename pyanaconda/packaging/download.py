@@ -0,0 +1,302 @@
+# download.py
+# Streaming, resumable download of large installation images.
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    ImageDownload fetches a (multi GB) image to a local file and computes
+    its sha256 while the data arrives, so the checksum does not need a
+    second pass over the file.  Dropped connections are resumed with HTTP
+    Range requests instead of restarting from zero, and when the server
+    supports ranges the image can be fetched over several connections,
+    each writing its own segment of a preallocated file.
+"""
+
+import io
+import os
+import ssl
+import time
+import socket
+import httplib
+import urllib2
+import hashlib
+import threading
+
+import logging
+log = logging.getLogger("packaging")
+
+# size of a single read from the connection
+CHUNK_SIZE = 1024 * 1024
+
+# do not split the image in segments smaller than this
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+
+class DownloadError(Exception):
+    pass
+
+class _ShortRead(Exception):
+    pass
+
+def _retriable(e):
+    """ Return True if the error is worth another attempt. """
+    if isinstance(e, urllib2.HTTPError):
+        return e.code >= 500 or e.code == 408
+    return isinstance(e, (urllib2.URLError, socket.error,
+                          httplib.HTTPException, _ShortRead))
+
+class ImageDownload(object):
+    """ Download url to path. """
+    def __init__(self, url, path, proxies=None, sslverify=True, segments=1,
+                 retries=5, timeout=60, progress=None):
+        """
+            :param url: the url to download
+            :type url: str
+            :param path: where to store the downloaded file
+            :type path: str
+            :param proxies: protocol -> proxy url mapping
+            :type proxies: dict or None
+            :param sslverify: verify the server certificate
+            :type sslverify: bool
+            :param segments: number of connections to use when the server
+                             supports range requests
+            :type segments: int
+            :param retries: attempts to resume each connection after an error
+            :type retries: int
+            :param timeout: socket timeout in seconds
+            :type timeout: int
+            :param progress: object with the start/update/end methods of
+                             livepayload.URLGrabberProgress
+        """
+        self.url = url
+        self.path = path
+        self.segments = max(1, segments)
+        self.retries = retries
+        self.timeout = timeout
+        self.progress = progress
+        self.size = None
+        self._digest = hashlib.sha256()
+
+        handlers = [urllib2.ProxyHandler(proxies or {})]
+        if not sslverify and hasattr(ssl, "_create_unverified_context"):
+            handlers.append(urllib2.HTTPSHandler(
+                context=ssl._create_unverified_context()))
+        self._opener = urllib2.build_opener(*handlers)
+
+        self._lock = threading.Lock()
+        self._done = 0
+
+    def _open(self, start=0, end=None):
+        """ Open the url, asking for the given byte range. """
+        req = urllib2.Request(self.url)
+        if start or end is not None:
+            req.add_header("Range", "bytes=%d-%s" % (start,
+                                                    "" if end is None else end))
+        return self._opener.open(req, timeout=self.timeout)
+
+    def _account(self, nbytes):
+        if not self.progress or not self.size:
+            return
+        with self._lock:
+            self._done += nbytes
+            done = self._done
+        self.progress.update(done)
+
+    def _probe(self):
+        """ Return (size, ranges) for the url: the content length, None if
+            unknown, and whether range requests are honoured.
+        """
+        try:
+            resp = self._open(0, 0)
+        except urllib2.HTTPError as e:
+            if e.code == 416:
+                # range not satisfiable, most likely an empty file
+                return None, False
+            raise
+        try:
+            if resp.getcode() == 206:
+                crange = resp.info().get("content-range", "")
+                total = crange.rpartition("/")[2]
+                if total.isdigit():
+                    return int(total), True
+                return None, False
+            length = resp.info().get("content-length")
+            return (int(length) if length else None), False
+        finally:
+            resp.close()
+
+    def _fetch_range(self, fobj, start, end, digest=None):
+        """ Fetch bytes start..end (inclusive, end None for the rest of the
+            file) into fobj at the same offsets, resuming after errors.
+
+            :returns: number of bytes fetched
+        """
+        pos = start
+        attempts = 0
+        while end is None or pos <= end:
+            try:
+                resp = self._open(pos, end)
+                try:
+                    if pos and resp.getcode() != 206:
+                        if start != 0 or digest is None:
+                            raise DownloadError("%s does not support "
+                                                "range requests" % self.url)
+                        # the server ignored the range, start over
+                        log.info("restarting the download of %s", self.url)
+                        fobj.seek(0)
+                        fobj.truncate()
+                        digest = self._digest = hashlib.sha256()
+                        self._account(-pos)
+                        pos = 0
+                    fobj.seek(pos)
+                    while end is None or pos <= end:
+                        chunk = resp.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        fobj.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                        pos += len(chunk)
+                        self._account(len(chunk))
+                finally:
+                    resp.close()
+
+                if end is None and self.size is not None and pos < self.size:
+                    raise _ShortRead("connection closed at %d of %d bytes"
+                                     % (pos, self.size))
+                if end is not None and pos <= end:
+                    raise _ShortRead("connection closed at %d of %d bytes"
+                                     % (pos, end + 1))
+                break
+            except Exception as e: # pylint: disable=broad-except
+                if not _retriable(e) or attempts >= self.retries:
+                    raise DownloadError("downloading %s failed: %s"
+                                        % (self.url, e))
+                attempts += 1
+                log.warning("downloading %s failed at byte %d (%s), "
+                            "resuming (attempt %d)", self.url, pos, e,
+                            attempts)
+                time.sleep(min(2 ** attempts, 30))
+        return pos - start
+
+    def _fetch_stream(self):
+        with open(self.path, "wb") as f:
+            self._fetch_range(f, 0, None, self._digest)
+
+    def _fetch_segmented(self):
+        """ Fetch the segments on their own threads into a preallocated
+            file and hash the contiguous prefix of the file as it grows.
+        """
+        with open(self.path, "wb") as f:
+            f.truncate(self.size)
+
+        count = min(self.segments, max(1, self.size // MIN_SEGMENT_SIZE))
+        seg_size = self.size // count
+        bounds = [(i * seg_size,
+                   self.size - 1 if i == count - 1 else (i + 1) * seg_size - 1)
+                  for i in range(count)]
+        filled = [start for start, _end in bounds]
+        errors = []
+        cond = threading.Condition()
+
+        class _Tracker(object):
+            """ File wrapper recording how far a segment was written. """
+            def __init__(self, fobj, idx):
+                self.fobj = fobj
+                self.idx = idx
+
+            def seek(self, pos):
+                self.fobj.seek(pos)
+
+            def truncate(self):
+                raise DownloadError("cannot restart a segment")
+
+            def write(self, data):
+                self.fobj.write(data)
+                self.fobj.flush()
+                with cond:
+                    filled[self.idx] += len(data)
+                    cond.notify_all()
+
+        def fetch(idx, start, end):
+            try:
+                with open(self.path, "r+b") as f:
+                    self._fetch_range(_Tracker(f, idx), start, end)
+            except Exception as e: # pylint: disable=broad-except
+                with cond:
+                    errors.append(e)
+                    cond.notify_all()
+
+        log.info("downloading %s in %d segments", self.url, count)
+        threads = []
+        for idx, (start, end) in enumerate(bounds):
+            thread = threading.Thread(name="AnaDownload%d" % idx,
+                                      target=fetch, args=(idx, start, end))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # hash the file in order while the segments arrive, the data is
+        # still in the page cache at this point; unbuffered, so no stale
+        # read-ahead of the unwritten parts is ever hashed
+        with io.open(self.path, "rb", buffering=0) as f:
+            pos = 0
+            while pos < self.size:
+                idx = min(pos // seg_size, count - 1)
+                with cond:
+                    while filled[idx] <= pos and not errors:
+                        cond.wait(1)
+                    if errors:
+                        break
+                    available = filled[idx]
+                f.seek(pos)
+                while pos < available:
+                    data = f.read(min(CHUNK_SIZE, available - pos))
+                    self._digest.update(data)
+                    pos += len(data)
+
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def run(self):
+        """ Download the file.
+
+            :returns: the sha256 hex digest of the downloaded data
+            :rtype: str
+            :raises DownloadError: if the download failed
+        """
+        try:
+            self.size, ranges = self._probe()
+        except Exception as e: # pylint: disable=broad-except
+            if not _retriable(e):
+                raise DownloadError("opening %s failed: %s" % (self.url, e))
+            self.size, ranges = None, False
+
+        if self.progress and self.size:
+            self.progress.start(self.path, self.url,
+                                os.path.basename(self.path),
+                                self.size or 0, None)
+
+        if ranges and self.segments > 1 and self.size >= 2 * MIN_SEGMENT_SIZE:
+            self._fetch_segmented()
+        else:
+            self._fetch_stream()
+
+        if self.progress and self.size:
+            self.progress.end(self._done)
+        return self._digest.hexdigest()
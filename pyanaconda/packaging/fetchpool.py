@@ -0,0 +1,269 @@
+# fetchpool.py
+# Concurrent download of many small files, like packages.
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    A FetchPool downloads files on a bounded pool of threads, in the order
+    they were submitted.  Each worker keeps one persistent HTTP/1.1
+    connection per server, so fetching many small files from the same
+    mirror does not pay a connect (and TLS handshake) per file.
+
+    Every file comes with a list of urls, the same file on several mirrors
+    in order of preference; the next one is tried when a mirror fails or
+    serves a file with the wrong checksum.  Files are written next to
+    their destination and renamed into place once complete, so a failed
+    download never leaves a partial file behind.
+"""
+
+import os
+import errno
+import httplib
+import urllib
+import urlparse
+import hashlib
+import threading
+from Queue import Queue
+
+import logging
+log = logging.getLogger("packaging")
+
+# size of a single read from the connection
+CHUNK_SIZE = 256 * 1024
+
+class FetchError(Exception):
+    pass
+
+def file_md5(path):
+    """ Return the md5 hex digest of the file at path. """
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+class FetchFuture(object):
+    """ A file submitted to a FetchPool. """
+    def __init__(self, urls, path, md5=None):
+        self.urls = list(urls)
+        self.path = path
+        self.md5 = md5.lower() if md5 else None
+        self.url = None
+        self._error = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self):
+        """ Wait for the file and return the FetchError that prevented
+            fetching it, None if it was fetched.
+        """
+        self._done.wait()
+        return self._error
+
+    def result(self):
+        """ Wait for the file and return its path.
+
+            :raises FetchError: if no url could provide the file
+        """
+        self._done.wait()
+        if self._error:
+            raise self._error
+        return self.path
+
+class FetchPool(object):
+    """ Download files, at most workers of them at the same time. """
+    def __init__(self, workers=4, timeout=60, name="AnaFetch"):
+        """
+            :param workers: number of files fetched at the same time
+            :type workers: int
+            :param timeout: socket timeout in seconds
+            :type timeout: int
+            :param name: prefix of the worker thread names
+            :type name: str
+        """
+        self.timeout = timeout
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(name="%s%d" % (name, i),
+                                      target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, urls, path, md5=None):
+        """ Fetch the file available at urls to path.
+
+            A file already at path with the expected md5 is not fetched
+            again.
+
+            :param urls: urls of the file, in order of preference
+            :type urls: list of str
+            :param path: where to store the file
+            :type path: str
+            :param md5: the md5 hex digest of the file, if known
+            :type md5: str or None
+            :rtype: FetchFuture
+        """
+        future = FetchFuture(urls, path, md5)
+        self._queue.put(future)
+        return future
+
+    def shutdown(self):
+        """ Wait for the submitted files and stop the workers. """
+        for _thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.shutdown()
+
+    def _worker(self):
+        conns = {}
+        try:
+            while True:
+                future = self._queue.get()
+                if future is None:
+                    return
+                try:
+                    self._fetch(future, conns)
+                except FetchError as e:
+                    future._error = e
+                except Exception as e: # pylint: disable=broad-except
+                    # a bug must not leave the caller waiting forever
+                    log.error("fetching %s failed: %s", future.path, e)
+                    future._error = FetchError(str(e))
+                finally:
+                    future._done.set()
+        finally:
+            for conn in conns.values():
+                conn.close()
+
+    def _fetch(self, future, conns):
+        if future.md5 and os.path.exists(future.path) and \
+                file_md5(future.path) == future.md5:
+            log.debug("%s is already there", future.path)
+            return
+
+        directory = os.path.dirname(future.path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise FetchError("cannot create %s: %s" % (directory, e))
+
+        tmp_path = future.path + ".part"
+        errors = []
+        for url in future.urls:
+            try:
+                with open(tmp_path, "wb") as f:
+                    md5 = self._fetch_url(url, f, conns)
+                if future.md5 and md5 != future.md5:
+                    raise FetchError("checksum mismatch")
+                os.rename(tmp_path, future.path)
+                future.url = url
+                return
+            except (EnvironmentError, httplib.HTTPException, FetchError) as e:
+                log.debug("cannot fetch %s: %s", url, e)
+                errors.append("%s: %s" % (url, e))
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        raise FetchError("cannot fetch %s: %s" % (os.path.basename(future.path),
+                                                  "; ".join(errors) or "no url"))
+
+    def _connection(self, parsed, conns):
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+        conn = conns.get(key)
+        if conn is None:
+            if parsed.scheme == "https":
+                conn = httplib.HTTPSConnection(parsed.hostname, port,
+                                               timeout=self.timeout)
+            else:
+                conn = httplib.HTTPConnection(parsed.hostname, port,
+                                              timeout=self.timeout)
+            conns[key] = conn
+            with self._lock:
+                self.connections += 1
+        return key, conn
+
+    def _fetch_url(self, url, fobj, conns):
+        """ Write the file at url to fobj and return its md5 hex digest. """
+        parsed = urlparse.urlsplit(url)
+        digest = hashlib.md5()
+
+        if parsed.scheme == "file":
+            with open(urllib.url2pathname(parsed.path), "rb") as src:
+                for data in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    digest.update(data)
+                    fobj.write(data)
+            return digest.hexdigest()
+
+        if parsed.scheme not in ("http", "https"):
+            raise FetchError("cannot fetch %s urls" % parsed.scheme)
+
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        key, conn = self._connection(parsed, conns)
+        reused = conn.sock is not None
+        try:
+            try:
+                conn.request("GET", path)
+                resp = conn.getresponse()
+            except (EnvironmentError, httplib.HTTPException):
+                if not reused:
+                    raise
+                # the server closed the idle connection, open a new one
+                conn.close()
+                del conns[key]
+                key, conn = self._connection(parsed, conns)
+                conn.request("GET", path)
+                resp = conn.getresponse()
+
+            if resp.status == 200:
+                for data in iter(lambda: resp.read(CHUNK_SIZE), b""):
+                    digest.update(data)
+                    fobj.write(data)
+                if resp.length:
+                    raise FetchError("connection closed %d bytes early"
+                                     % resp.length)
+            else:
+                # read the error page, the connection can then be reused
+                resp.read()
+            if resp.will_close:
+                conn.close()
+                del conns[key]
+        except Exception:
+            # the state of the connection is unknown
+            conns.pop(key, None)
+            conn.close()
+            raise
+
+        if resp.status != 200:
+            raise FetchError("HTTP error %d" % resp.status)
+        return digest.hexdigest()
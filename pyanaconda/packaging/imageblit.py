@@ -0,0 +1,234 @@
+# imageblit.py
+# Block level deployment of a live root file system image.
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    When the target is a single root file system of the same type as the
+    live root image, writing the image blocks straight to the root device
+    and growing the file system afterwards is much faster than copying the
+    tree file by file.  This is used when booting with livecopy=image;
+    layouts that do not qualify fall back to the file copy.
+"""
+
+import os
+import io
+import errno
+import glob
+import mmap
+
+from pyanaconda import iutil
+from pyanaconda.constants import ROOT_PATH
+from pyanaconda.packaging.treemanifest import mount_source, backing_file
+
+import logging
+log = logging.getLogger("packaging")
+
+# file systems that can be grown and get a new UUID after the copy
+GROWABLE_FSTYPES = ("ext2", "ext3", "ext4", "xfs")
+
+# size of a single write, a multiple of any logical block size
+BLOCK_SIZE = 4 * 1024 * 1024
+
+class ImageBlitError(Exception):
+    pass
+
+def device_size(path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        return f.tell()
+
+def find_blit_source(storage, mountpoint):
+    """ Return (image, fstype) if the image mounted on mountpoint can be
+        written to the root device of storage, None otherwise.
+
+        The target must have a root file system of the same type as the
+        image, nothing else mounted under it and a root device big enough
+        to hold the image.  The image must not be a loop device backed by
+        a file on the target, like the disk.img of a liveimg install, the
+        copy would overwrite its own source.
+    """
+    image, fstype = mount_source(mountpoint)
+    if not image or not image.startswith("/dev/"):
+        log.info("block copy: no image device mounted on %s", mountpoint)
+        return None
+
+    backing = os.path.realpath(backing_file(image))
+    if backing.startswith(os.path.realpath(ROOT_PATH).rstrip("/") + "/"):
+        log.info("block copy: %s is backed by %s on the target", image,
+                 backing)
+        return None
+
+    if fstype not in GROWABLE_FSTYPES:
+        log.info("block copy: %s file system cannot be grown", fstype)
+        return None
+
+    mounts = [m for m in storage.mountpoints if m != "/"]
+    if mounts:
+        log.info("block copy: extra mount points %s", sorted(mounts))
+        return None
+
+    root = storage.rootDevice
+    if root is None or root.format.type != fstype:
+        log.info("block copy: root is %s, image is %s",
+                 getattr(root and root.format, "type", None), fstype)
+        return None
+
+    try:
+        image_size = device_size(image)
+        root_size = device_size(root.path)
+    except IOError as e:
+        log.info("block copy: cannot get device sizes: %s", e)
+        return None
+
+    if root_size < image_size:
+        log.info("block copy: root device too small (%d < %d)",
+                 root_size, image_size)
+        return None
+
+    return image, fstype
+
+class ImageBlitter(object):
+    """ Write a file system image to the root device of storage, then grow
+        the file system and give it the UUID blivet assigned to the root.
+    """
+    def __init__(self, storage, image, fstype, progress=None):
+        """
+            :param storage: the storage configuration
+            :param image: path of the file system image (or its device)
+            :type image: str
+            :param fstype: type of the file system in the image
+            :type fstype: str
+            :param progress: progress reporter
+            :type progress: treecopy.CopyProgress or None
+        """
+        self.storage = storage
+        self.image = image
+        self.fstype = fstype
+        self.progress = progress
+        self.device = storage.rootDevice
+
+    def _write(self):
+        """ Stream the image with large aligned writes. """
+        size = device_size(self.image)
+        # O_DIRECT needs aligned buffers, anonymous mmap memory is page
+        # aligned; the tail of an unaligned image is written buffered
+        buf = mmap.mmap(-1, BLOCK_SIZE)
+        src = io.FileIO(self.image, "r")
+        try:
+            dst = os.open(self.device.path,
+                          os.O_WRONLY | getattr(os, "O_DIRECT", 0))
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            dst = os.open(self.device.path, os.O_WRONLY)
+        try:
+            done = 0
+            while done < size:
+                count = src.readinto(buf)
+                if not count:
+                    break
+                if count % 4096:
+                    os.close(dst)
+                    dst = os.open(self.device.path, os.O_WRONLY)
+                    os.lseek(dst, done, os.SEEK_SET)
+                self._write_all(dst, buf, count)
+                done += count
+                if self.progress:
+                    self.progress.update(count)
+            os.fsync(dst)
+        finally:
+            os.close(dst)
+            src.close()
+            buf.close()
+
+        if done != size:
+            raise ImageBlitError("short read of %s: %d of %d bytes"
+                                 % (self.image, done, size))
+
+    def _write_all(self, fd, buf, count):
+        """ Write the first count bytes of buf to fd, os.write() may write
+            less than asked.
+        """
+        written = 0
+        while written < count:
+            ret = os.write(fd, buffer(buf, written, count - written))
+            if ret <= 0:
+                raise ImageBlitError("short write to %s: %d of %d bytes"
+                                     % (self.device.path, written, count))
+            written += ret
+
+    def _run(self, cmd, args):
+        rc = iutil.execWithRedirect(cmd, args)
+        if rc:
+            raise ImageBlitError("%s %s failed with %d"
+                                 % (cmd, " ".join(args), rc))
+
+    def _set_uuid(self, uuid):
+        path = self.device.path
+        if self.fstype == "xfs":
+            self._run("xfs_admin", ["-U", uuid, path])
+        else:
+            self._run("tune2fs", ["-U", uuid, path])
+
+    def _fixup(self):
+        """ Check, grow and re-UUID the unmounted file system. """
+        path = self.device.path
+        if self.fstype != "xfs":
+            # resize2fs refuses to work on a file system not just checked
+            rc = iutil.execWithRedirect("e2fsck", ["-f", "-y", path])
+            if rc not in (0, 1):
+                raise ImageBlitError("e2fsck of %s failed with %d" % (path, rc))
+            self._run("resize2fs", [path])
+
+        uuid = self.device.format.uuid
+        if uuid:
+            self._set_uuid(uuid)
+        else:
+            self._set_uuid("generate" if self.fstype == "xfs" else "random")
+            self.device.format.uuid = iutil.execWithCapture(
+                "blkid", ["-s", "UUID", "-o", "value", path]).strip()
+
+    def run(self):
+        log.info("writing %s to %s", self.image, self.device.path)
+        self.storage.umountFilesystems(swapoff=False)
+        try:
+            self._write()
+            self._fixup()
+        finally:
+            self.storage.mountFilesystems()
+
+        if self.fstype == "xfs":
+            self._run("xfs_growfs", [ROOT_PATH])
+
+        if self.progress:
+            self.progress.finish()
+
+def prune_excludes(dest, excludes):
+    """ Remove the files a file copy would have excluded.  Excluded
+        directories are kept, they are mount points.
+    """
+    for pattern in excludes:
+        if pattern.endswith("/"):
+            continue
+        for path in glob.glob(dest + pattern):
+            if os.path.isdir(path) and not os.path.islink(path):
+                continue
+            try:
+                os.unlink(path)
+            except OSError as e:
+                log.error("failed to remove %s: %s", path, e)
@@ -31,19 +31,18 @@
 """
 import os
 import stat
-from time import sleep
-from threading import Lock
-from urlgrabber.grabber import URLGrabber
-from urlgrabber.grabber import URLGrabError
 from pyanaconda.iutil import ProxyString, ProxyStringError, lowerASCII
 import urllib
-import hashlib
 import glob
 
 from pyanaconda.packaging import ImagePayload, PayloadSetupError, PayloadInstallError
+from pyanaconda.packaging import treecopy, treemanifest, treeverify
+from pyanaconda.packaging.download import ImageDownload, DownloadError
+from pyanaconda.flags import flags
 
-from pyanaconda.constants import INSTALL_TREE, ROOT_PATH, THREAD_LIVE_PROGRESS
-from pyanaconda.constants import IMAGE_DIR
+from pyanaconda.constants import INSTALL_TREE, ROOT_PATH
+from pyanaconda.constants import IMAGE_DIR, THREAD_TREE_MANIFEST
+from pyanaconda.threads import threadMgr, AnacondaThread
 
 from pyanaconda import iutil
 
@@ -54,17 +53,29 @@ from pyanaconda.errors import errorHandler, ERROR_RAISE
 from pyanaconda.progress import progressQ
 from blivet.size import Size
 import blivet.util
-from pyanaconda.threads import threadMgr, AnacondaThread
 from pyanaconda.i18n import _
 
 class LiveImagePayload(ImagePayload):
     """ A LivePayload copies the source image onto the target system. """
     def __init__(self, *args, **kwargs):
         super(LiveImagePayload, self).__init__(*args, **kwargs)
-        # Used to adjust size of ROOT_PATH when files are already present
-        self._adj_size = 0
-        self.pct = 0
-        self.pct_lock = None
+        self._manifest = None
+
+    def _load_manifest(self):
+        self._manifest = treemanifest.get_manifest(
+            os.path.realpath(INSTALL_TREE))
+
+    @property
+    def manifest(self):
+        """ Size manifest of the live tree, built in the background by
+            setup() and only looked up afterwards.
+        """
+        if self._manifest is None:
+            threadMgr.wait(THREAD_TREE_MANIFEST)
+        if self._manifest is None:
+            # setup() has not been called, the tree is mounted by now
+            self._load_manifest()
+        return self._manifest
 
     def setup(self, storage):
         super(LiveImagePayload, self).setup(storage)
@@ -77,70 +88,48 @@ class LiveImagePayload(ImagePayload):
                 raise exn
         blivet.util.mount(osimg.path, INSTALL_TREE, fstype="auto", options="ro")
 
+        # the used blocks of a squashfs are the compressed size, the
+        # progress needs the real amount of data
+        if self._manifest is None and \
+                not threadMgr.exists(THREAD_TREE_MANIFEST):
+            threadMgr.add(AnacondaThread(name=THREAD_TREE_MANIFEST,
+                                         target=self._load_manifest))
+
     def preInstall(self, packages=None, groups=None):
         """ Perform pre-installation tasks. """
         super(LiveImagePayload, self).preInstall(packages=packages, groups=groups)
         progressQ.send_message(_("Installing software") + (" %d%%") % (0,))
 
-    def progress(self):
-        """Monitor the amount of disk space used on the target and source and
-           update the hub's progress bar.
-        """
-        source = os.statvfs(INSTALL_TREE)
-        source_size = source.f_frsize * (source.f_blocks - source.f_bfree)
-        mountpoints = self.storage.mountpoints.copy()
-        last_pct = -1
-        while self.pct < 100:
-            dest_size = 0
-            for mnt in mountpoints:
-                mnt_stat = os.statvfs(ROOT_PATH+mnt)
-                dest_size += mnt_stat.f_frsize * (mnt_stat.f_blocks - mnt_stat.f_bfree)
-            if dest_size >= self._adj_size:
-                dest_size -= self._adj_size
-
-            pct = int(100 * dest_size / source_size)
-            if pct != last_pct:
-                with self.pct_lock:
-                    self.pct = pct
-                last_pct = pct
-                progressQ.send_message(_("Installing software") + (" %d%%") % (min(100, self.pct),))
-            sleep(0.777)
-
     def install(self):
         """ Install the payload. """
-        self.pct_lock = Lock()
-        self.pct = 0
-        threadMgr.add(AnacondaThread(name=THREAD_LIVE_PROGRESS,
-                                     target=self.progress))
-
-        cmd = "rsync"
-        # preserve: permissions, owners, groups, ACL's, xattrs, times,
-        #           symlinks, hardlinks
-        # go recursively, include devices and special files, don't cross
-        # file system boundaries
-        args = ["-pogAXtlHrDx", "--exclude", "/dev/", "--exclude", "/proc/",
-                "--exclude", "/sys/", "--exclude", "/run/", "--exclude", "/boot/*rescue*",
-                "--exclude", "/etc/machine-id", INSTALL_TREE+"/", ROOT_PATH]
+        excludes = ["/dev/", "/proc/", "/sys/", "/run/", "/boot/*rescue*",
+                    "/etc/machine-id"]
         try:
-            rc = iutil.execWithRedirect(cmd, args)
-        except (OSError, RuntimeError) as e:
-            msg = None
+            treecopy.copy_tree(INSTALL_TREE, ROOT_PATH, excludes,
+                               self.manifest.total_bytes,
+                               self.manifest.total_files,
+                               storage=self.storage)
+        except (OSError, RuntimeError, treecopy.TreeCopyError) as e:
             err = str(e)
             log.error(err)
-        else:
-            err = None
-            msg = "%s exited with code %d" % (cmd, rc)
-            log.info(msg)
+            exn = PayloadInstallError(err)
+            if errorHandler.cb(exn) == ERROR_RAISE:
+                raise exn
 
-        if err or rc == 12:
-            exn = PayloadInstallError(err or msg)
+        mismatches = treeverify.verify_tree(INSTALL_TREE, ROOT_PATH, excludes,
+                                            self._own_files())
+        if mismatches:
+            exn = PayloadInstallError(
+                "%d installed files do not match the installation source: %s"
+                % (len(mismatches), ", ".join(mismatches[:10])))
             if errorHandler.cb(exn) == ERROR_RAISE:
                 raise exn
 
-        # Wait for progress thread to finish
-        with self.pct_lock:
-            self.pct = 100
-        threadMgr.wait(THREAD_LIVE_PROGRESS)
+    def _own_files(self):
+        """ Return the files the payload itself keeps in ROOT_PATH during
+            install(), as excludes relative to ROOT_PATH.
+        """
+        return []
 
     def postInstall(self):
         """ Perform post-installation tasks. """
@@ -258,26 +247,35 @@ class LiveImageKSPayload(LiveImagePayload):
 
         log.debug("liveimg size is %s", self._min_size)
 
+    @staticmethod
+    def _download_segments():
+        """ Number of connections used for the download, can be set with
+            liveimg.segments=N on the boot command line.
+        """
+        try:
+            return max(1, int(flags.cmdline.get("liveimg.segments") or 1))
+        except ValueError:
+            return 1
+
     def preInstall(self, *args, **kwargs):
         """ Download image and loopback mount it.
 
             This is called after partitioning is setup, we now have space
             to grab the image. Download it to ROOT_PATH and provide feedback
-            during the download (using urlgrabber callback).
+            during the download (using the urlgrabber progress callback).
         """
-        # Setup urlgrabber and call back to download image to ROOT_PATH
-        progress = URLGrabberProgress()
-        ugopts = {"ssl_verify_peer": not self.data.method.noverifyssl,
-                  "ssl_verify_host": not self.data.method.noverifyssl,
-                  "proxies" : self._proxies,
-                  "progress_obj" : progress,
-                  "copy_local" : True}
+        # Download the image to ROOT_PATH, hashing it on the way
+        download = ImageDownload(self.data.method.url, self.image_path,
+                                 proxies=self._proxies,
+                                 sslverify=not self.data.method.noverifyssl,
+                                 segments=self._download_segments(),
+                                 progress=URLGrabberProgress())
 
         error = None
+        filesum = None
         try:
-            ug = URLGrabber()
-            ug.urlgrab(self.data.method.url, self.image_path, **ugopts)
-        except URLGrabError as e:
+            filesum = download.run()
+        except DownloadError as e:
             log.error("Error downloading liveimg: %s", e)
             error = e
         else:
@@ -290,19 +288,7 @@ class LiveImageKSPayload(LiveImagePayload):
             if errorHandler.cb(exn) == ERROR_RAISE:
                 raise exn
 
-        # Used to make install progress % look correct
-        self._adj_size = os.stat(self.image_path)[stat.ST_SIZE]
-
         if self.data.method.checksum:
-            progressQ.send_message(_("Checking image checksum"))
-            sha256 = hashlib.sha256()
-            with open(self.image_path, "rb") as f:
-                while True:
-                    data = f.read(1024*1024)
-                    if not data:
-                        break
-                    sha256.update(data)
-            filesum = sha256.hexdigest()
             log.debug("sha256 of %s is %s", self.data.method.url, filesum)
 
             if lowerASCII(self.data.method.checksum) != filesum:
@@ -331,6 +317,10 @@ class LiveImageKSPayload(LiveImagePayload):
                 blivet.util.mount(IMAGE_DIR+"/LiveOS/"+img_file, INSTALL_TREE,
                                   fstype="auto", options="ro")
 
+    def _own_files(self):
+        """ The downloaded image stays in ROOT_PATH until postInstall(). """
+        return [self.image_path[len(ROOT_PATH):]]
+
     def postInstall(self):
         """ Unmount image, remove image file from target
         """
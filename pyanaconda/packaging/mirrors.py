@@ -0,0 +1,263 @@
+# mirrors.py
+# Concurrent ranking of package mirrors.
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    MirrorRanker probes all the mirrors at the same time on a pool of
+    threads.  Each probe measures the connect latency (name resolution
+    included) and fetches a small sample to estimate the throughput, with
+    its own deadline; the whole ranking returns within a fixed wall clock
+    budget, mirrors that did not answer in time are ranked last.
+
+    Rankings are cached for the rest of the installation, keyed by the
+    network the installer is on (default routes and name servers).
+"""
+
+import ssl
+import time
+import socket
+import httplib
+import urlparse
+import threading
+from Queue import Queue, Empty
+
+import logging
+log = logging.getLogger("packaging")
+
+# wall clock seconds a whole ranking may take
+RANKING_BUDGET = 10
+# seconds a single connect or read may take
+PROBE_TIMEOUT = 3
+# bytes fetched from each mirror to estimate its throughput
+SAMPLE_SIZE = 64 * 1024
+# mirrors are scored by the estimated time to fetch this many bytes
+REFERENCE_SIZE = 1024 * 1024
+# samples shorter than this are too small to estimate a throughput
+MIN_SAMPLE = 8 * 1024
+
+_cache = {}
+_cache_lock = threading.Lock()
+_ssl_context = None
+
+def _get_ssl_context():
+    """ Return the SSL context shared by the https probes. """
+    global _ssl_context
+    with _cache_lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context()
+        return _ssl_context
+
+def network_identity():
+    """ Return a string identifying the network the system is on. """
+    parts = []
+    try:
+        with open("/proc/net/route") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                # default routes: destination and mask 0
+                if len(fields) > 7 and fields[1] == "00000000" and \
+                        fields[7] == "00000000":
+                    parts.append("%s:%s" % (fields[0], fields[2]))
+    except IOError:
+        pass
+    try:
+        with open("/etc/resolv.conf") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1 and fields[0] == "nameserver":
+                    parts.append(fields[1])
+    except IOError:
+        pass
+    return ",".join(sorted(parts))
+
+class MirrorProbe(object):
+    """ Measurements of a single mirror. """
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.throughput = None
+        self.sample_time = None
+        self.error = None
+
+    @property
+    def score(self):
+        """ Estimated seconds to fetch REFERENCE_SIZE bytes, None if the
+            mirror could not be probed.
+        """
+        if self.error or self.latency is None:
+            return None
+        if self.throughput:
+            return self.latency + REFERENCE_SIZE / float(self.throughput)
+        # too small a sample, fall back to the time it took
+        return self.latency + (self.sample_time or 0)
+
+    def run(self, timeout=PROBE_TIMEOUT, sample_size=SAMPLE_SIZE,
+            sample_path=""):
+        """ Probe the mirror, errors are stored in self.error. """
+        try:
+            self._probe(timeout, sample_size, sample_path)
+        except (EnvironmentError, httplib.HTTPException, ValueError,
+                ssl.SSLError) as e:
+            self.error = str(e) or e.__class__.__name__
+        return self
+
+    def _probe(self, timeout, sample_size, sample_path):
+        parsed = urlparse.urlsplit(self.url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError("cannot probe %s urls" % parsed.scheme)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+
+        start = time.time()
+        sock = socket.create_connection((parsed.hostname, port), timeout)
+        self.latency = time.time() - start
+        try:
+            if parsed.scheme == "https":
+                # with SNI, virtual hosts present the right certificate
+                sock = _get_ssl_context().wrap_socket(
+                    sock, server_hostname=parsed.hostname)
+            conn = httplib.HTTPConnection(parsed.hostname, port,
+                                          timeout=timeout)
+            # reuse the connection the latency was measured on
+            conn.sock = sock
+            path = parsed.path.rstrip("/") + "/" + sample_path.lstrip("/")
+            start = time.time()
+            conn.request("GET", path,
+                         headers={"Range": "bytes=0-%d" % (sample_size - 1)})
+            resp = conn.getresponse()
+            if resp.status >= 400:
+                raise httplib.HTTPException("HTTP error %d" % resp.status)
+
+            size = 0
+            deadline = start + timeout
+            while size < sample_size and time.time() < deadline:
+                data = resp.read(min(16 * 1024, sample_size - size))
+                if not data:
+                    break
+                size += len(data)
+            self.sample_time = time.time() - start
+            if size >= MIN_SAMPLE and self.sample_time > 0:
+                self.throughput = size / self.sample_time
+        finally:
+            sock.close()
+
+class MirrorRanker(object):
+    """ Rank mirror urls, best first. """
+    def __init__(self, urls, budget=RANKING_BUDGET, timeout=PROBE_TIMEOUT,
+                 sample_size=SAMPLE_SIZE, sample_path="", workers=8):
+        """
+            :param urls: the mirror urls
+            :type urls: list of str
+            :param budget: wall clock seconds the ranking may take
+            :type budget: float
+            :param timeout: seconds a single connect or read may take
+            :type timeout: float
+            :param sample_size: bytes to fetch from each mirror
+            :type sample_size: int
+            :param sample_path: path, relative to the mirror urls, of the
+                                file to sample
+            :type sample_path: str
+            :param workers: number of mirrors probed at the same time
+            :type workers: int
+        """
+        self.urls = list(urls)
+        self.budget = budget
+        self.timeout = min(timeout, budget)
+        self.sample_size = sample_size
+        self.sample_path = sample_path
+        self.workers = workers
+        self.probes = {}
+
+    def _worker(self, work_q, done_q):
+        while True:
+            try:
+                url = work_q.get_nowait()
+            except Empty:
+                return
+            done_q.put(MirrorProbe(url).run(self.timeout, self.sample_size,
+                                            self.sample_path))
+
+    def rank(self):
+        """ Probe the mirrors and return the urls sorted by score.
+
+            Mirrors that could not be probed within the budget keep their
+            relative order at the end of the list.
+        """
+        start = time.time()
+        work_q = Queue()
+        done_q = Queue()
+        for url in self.urls:
+            work_q.put(url)
+
+        for i in range(min(self.workers, len(self.urls))):
+            # probes stuck in name resolution cannot be interrupted, they
+            # are left behind when the budget runs out
+            thread = threading.Thread(name="AnaMirrorProbe%d" % i,
+                                      target=self._worker,
+                                      args=(work_q, done_q))
+            thread.daemon = True
+            thread.start()
+
+        deadline = start + self.budget
+        while len(self.probes) < len(self.urls):
+            left = deadline - time.time()
+            if left <= 0:
+                break
+            try:
+                probe = done_q.get(timeout=left)
+            except Empty:
+                break
+            self.probes[probe.url] = probe
+            if probe.error:
+                log.debug("mirror %s: %s", probe.url, probe.error)
+            else:
+                log.debug("mirror %s: latency %.3fs, %s bytes/s, score %.3f",
+                          probe.url, probe.latency, probe.throughput,
+                          probe.score)
+
+        def key(url):
+            probe = self.probes.get(url)
+            score = probe.score if probe else None
+            if score is None:
+                return (1, self.urls.index(url))
+            return (0, score)
+
+        ranked = sorted(self.urls, key=key)
+        log.info("ranked %d mirrors (%d answered) in %.1f seconds",
+                 len(self.urls), len([p for p in self.probes.values()
+                                      if p.score is not None]),
+                 time.time() - start)
+        return ranked
+
+def rank_mirrors(urls, **kwargs):
+    """ Return urls ranked by MirrorRanker, using the ranking cached for
+        the current network if there is one.  Keyword arguments are passed
+        to MirrorRanker.
+    """
+    key = (network_identity(), tuple(urls), kwargs.get("sample_path", ""))
+    with _cache_lock:
+        if key in _cache:
+            log.info("using the cached ranking of %d mirrors", len(urls))
+            return list(_cache[key])
+
+    ranker = MirrorRanker(urls, **kwargs)
+    ranked = ranker.rank()
+    # do not remember that nothing answered, the network may come up
+    if any(probe.score is not None for probe in ranker.probes.values()):
+        with _cache_lock:
+            _cache[key] = ranked
+    return list(ranked)
@@ -0,0 +1,163 @@
+# staging.py
+# Make files of the installation environment available to the target.
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    Files needed inside the target only while a step runs (driver packages
+    to install, for instance) are not copied there: StagedDirectory bind
+    mounts their directory read-only inside the target root.  Files that
+    have to stay on the installed system are reflinked when source and
+    destination share a file system that supports it.  Copying the data is
+    the last resort in both cases.
+"""
+
+import os
+import errno
+import shutil
+import tempfile
+
+from pyanaconda import fsutil
+from pyanaconda.constants import ROOT_PATH
+
+import logging
+log = logging.getLogger("packaging")
+
+METHOD_BIND = "bind"
+METHOD_REFLINK = "reflink"
+METHOD_COPY = "copy"
+
+# errors meaning the data cannot be shared and has to be copied
+_CLONE_ERRNOS = (errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP,
+                 errno.ENOTSUP, errno.ENOSYS, errno.EBADF)
+
+def clone_file(src, dst):
+    """ Copy the file src to dst with its permissions and times, sharing
+        the data blocks when possible.
+
+        :returns: METHOD_REFLINK or METHOD_COPY
+        :raises EnvironmentError: if the file cannot be copied
+    """
+    try:
+        with open(src, "rb") as fsrc:
+            with open(dst, "wb") as fdst:
+                fsutil.clone_file(fsrc.fileno(), fdst.fileno())
+        shutil.copystat(src, dst)
+        return METHOD_REFLINK
+    except OSError as e:
+        if e.errno not in _CLONE_ERRNOS:
+            raise
+    shutil.copy2(src, dst)
+    return METHOD_COPY
+
+def clone_tree(src, dst, names=None):
+    """ Copy the directory src to dst, which may exist already, with
+        clone_file() for the regular files.  Symlinks are copied as such.
+
+        :param names: the entries of src to copy, all of them if None
+        :type names: list of str
+        :returns: number of files reflinked and copied
+        :rtype: dict of method -> int
+    """
+    counts = {METHOD_REFLINK: 0, METHOD_COPY: 0}
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+    for name in sorted(os.listdir(src) if names is None else names):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.islink(src_path):
+            os.symlink(os.readlink(src_path), dst_path)
+        elif os.path.isdir(src_path):
+            for method, count in clone_tree(src_path, dst_path).items():
+                counts[method] += count
+        else:
+            counts[clone_file(src_path, dst_path)] += 1
+    shutil.copystat(src, dst)
+    return counts
+
+class StagedDirectory(object):
+    """ Context manager making a directory available inside the target
+        root, for the duration of the with block.
+
+        The staged directory is at path in this process and at chroot_path
+        in the target.
+    """
+    def __init__(self, source, root=ROOT_PATH, names=None):
+        """
+            :param source: the directory to stage
+            :type source: str
+            :param root: the target root
+            :type root: str
+            :param names: the entries of source needed, used to copy only
+                          those if the directory cannot be mounted
+            :type names: list of str
+        """
+        self.source = source
+        self.root = root
+        self.names = names
+        self.path = None
+        self.chroot_path = None
+        self.method = None
+
+    def _bind(self):
+        fsutil.mount(self.source, self.path, None, fsutil.MS_BIND)
+        try:
+            # the read-only flag of a bind mount is only honoured by a remount
+            fsutil.mount(None, self.path, None,
+                         fsutil.MS_REMOUNT | fsutil.MS_BIND | fsutil.MS_RDONLY)
+        except OSError:
+            fsutil.umount(self.path)
+            raise
+
+    def __enter__(self):
+        parent = os.path.join(self.root, "tmp")
+        if not os.path.isdir(parent):
+            parent = self.root
+        self.path = tempfile.mkdtemp(prefix="anaconda-stage-", dir=parent)
+        self.chroot_path = "/" + os.path.relpath(self.path, self.root)
+
+        try:
+            self._bind()
+            self.method = METHOD_BIND
+        except OSError as e:
+            log.info("cannot bind mount %s, copying it: %s", self.source, e)
+            try:
+                counts = clone_tree(self.source, self.path, self.names)
+            except EnvironmentError:
+                shutil.rmtree(self.path, True)
+                raise
+            self.method = METHOD_COPY if counts[METHOD_COPY] \
+                else METHOD_REFLINK
+            log.info("%s: %d files reflinked, %d copied", self.source,
+                     counts[METHOD_REFLINK], counts[METHOD_COPY])
+
+        log.info("staged %s at %s (%s)", self.source, self.chroot_path,
+                 self.method)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if self.method == METHOD_BIND:
+            try:
+                fsutil.umount(self.path)
+            except OSError as e:
+                # something inside the target still uses it
+                log.warning("detaching busy %s: %s", self.path, e)
+                fsutil.umount(self.path, fsutil.MNT_DETACH)
+            os.rmdir(self.path)
+        else:
+            shutil.rmtree(self.path, True)
+        return False
@@ -21,12 +21,20 @@
 #
 
 """
-    TODO
-        - error handling!!!
-        - document all methods
-
+    The archive is never scanned with tarfile's random access API: the
+    total size and the kernel names come from a TarIndex, either shipped
+    next to the archive (<archive>.index) or built in a single streaming
+    pass and cached.  Extraction pipes the archive through an external,
+    multi-threaded where available, decompressor into tar; the progress is
+    the share of the compressed archive fed to the pipeline.
 """
 
+import os
+import json
+import errno
+import subprocess
+import tempfile
+
 import logging
 log = logging.getLogger("anaconda")
 
@@ -36,43 +44,305 @@ except ImportError:
     log.error("import of tarfile failed")
     tarfile = None
 
+from pyanaconda import iutil
 from pyanaconda.constants import ROOT_PATH
-from pyanaconda.packaging import ArchivePayload, PayloadError
+from pyanaconda.errors import errorHandler, ERROR_RAISE
+from pyanaconda.packaging import ArchivePayload, PayloadError, PayloadInstallError
+from pyanaconda.packaging.treecopy import CopyProgress
+
+# where indexes built at runtime are cached
+INDEX_CACHE = "/tmp/anaconda-tar-index.json"
+
+INDEX_VERSION = 1
+
+# size of a single read from the archive
+CHUNK_SIZE = 1024 * 1024
+
+# magic bytes of the compressed formats and the decompressors for them, in
+# order of preference; all of them write the data to stdout
+DECOMPRESSORS = (
+    ("\xfd7zXZ\x00", (["xz", "-d", "-c", "-T0"],)),
+    ("\x1f\x8b", (["pigz", "-d", "-c"], ["gzip", "-d", "-c"])),
+    ("\x28\xb5\x2f\xfd", (["zstd", "-d", "-c", "-T0"],)),
+    ("BZh", (["lbzip2", "-d", "-c"], ["pbzip2", "-d", "-c"],
+             ["bzip2", "-d", "-c"])),
+)
+
+def find_program(name):
+    """ Return the full path of program name, None if it is not in PATH. """
+    for directory in os.environ.get("PATH", "/usr/bin:/bin").split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+def decompressor(path):
+    """ Return (compressed, argv) for the archive at path.
+
+        argv is the decompressor command to pipe the archive through, None
+        if the archive is not compressed or no decompressor for it is
+        installed.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(8)
+
+    for prefix, commands in DECOMPRESSORS:
+        if magic.startswith(prefix):
+            for argv in commands:
+                if find_program(argv[0]):
+                    return True, argv
+            return True, None
+    return False, None
+
+def archive_identity(path):
+    """ Return a string that changes when the archive at path is replaced. """
+    st = os.stat(path)
+    return "%s:%d:%d" % (os.path.realpath(path), st.st_size, int(st.st_mtime))
+
+class TarIndex(object):
+    """ Sizes and kernels of a tar archive. """
+    def __init__(self, total_bytes=0, total_files=0, kernels=None,
+                 identity=None):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.kernels = kernels or []
+        self.identity = identity
+
+    @classmethod
+    def build(cls, path, identity=None):
+        """ Read the member headers of the archive in one streaming pass.
+
+            :raises tarfile.TarError: if the archive cannot be read
+        """
+        log.info("building the index of %s", path)
+        index = cls(identity=identity)
+        _compressed, argv = decompressor(path)
+        proc = None
+        with open(path, "rb") as src:
+            if argv:
+                proc = iutil.start_program(argv, stdin=src,
+                                           stdout=subprocess.PIPE)
+                archive = tarfile.open(fileobj=proc.stdout, mode="r|")
+            else:
+                archive = tarfile.open(fileobj=src, mode="r|*")
+
+            try:
+                for member in archive:
+                    index.total_files += 1
+                    index.total_bytes += member.size
+                    if "boot/vmlinuz-" in member.name:
+                        index.kernels.append(member.name)
+            finally:
+                archive.close()
+                if proc:
+                    proc.stdout.close()
+                    iutil.wait_program(proc)
+
+        if proc and proc.returncode:
+            raise tarfile.ReadError("%s failed with %d"
+                                    % (argv[0], proc.returncode))
+
+        log.info("index of %s: %d bytes in %d files", path,
+                 index.total_bytes, index.total_files)
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """ Load an index saved with save(), None if it is not usable. """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                return None
+            return cls(int(data["total_bytes"]), int(data["total_files"]),
+                       list(data.get("kernels", [])), data.get("identity"))
+        except (IOError, ValueError, KeyError, TypeError, AttributeError) as e:
+            log.debug("cannot load tar index %s: %s", path, e)
+            return None
+
+    def save(self, path):
+        """ Save the index to path as JSON, errors are only logged. """
+        data = {"version": INDEX_VERSION,
+                "total_bytes": self.total_bytes,
+                "total_files": self.total_files,
+                "kernels": self.kernels,
+                "identity": self.identity}
+        try:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            log.warning("cannot save tar index %s: %s", path, e)
+
+def get_index(path, cache_path=INDEX_CACHE):
+    """ Return the index of the archive at path.
+
+        The index shipped next to the archive is preferred, then the cached
+        one if it was built from the same archive; otherwise the archive is
+        read once and the result cached.
+    """
+    shipped = TarIndex.load(path + ".index")
+    if shipped:
+        log.info("using the index shipped with %s", path)
+        return shipped
+
+    identity = archive_identity(path)
+    cached = TarIndex.load(cache_path)
+    if cached and cached.identity == identity:
+        log.info("using the cached index of %s", path)
+        return cached
+
+    index = TarIndex.build(path, identity)
+    index.save(cache_path)
+    return index
+
+class _ProgressReader(object):
+    """ File wrapper reporting the bytes read to a CopyProgress. """
+    def __init__(self, fobj, progress):
+        self.fobj = fobj
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = self.fobj.read(size)
+        self.progress.update(len(data))
+        return data
 
 class TarPayload(ArchivePayload):
     """ A TarPayload unpacks a single tar archive onto the target system. """
     def __init__(self, data):
+        """
+            :param data: the kickstart data of the payload
+        """
         if tarfile is None:
             raise PayloadError("unsupported payload type")
 
         super(TarPayload, self).__init__(data)
-        self.archive = None
+        self.index = None
         self.image_file = None
 
     def setup(self, storage):
+        """ Set up the archive and get its index.
+
+            :raises PayloadError: if the archive cannot be read
+        """
         super(TarPayload, self).setup(storage)
 
         try:
-            self.archive = tarfile.open(self.image_file)
-        except (tarfile.ReadError, tarfile.CompressionError) as e:
-            # maybe we only need to catch ReadError and CompressionError here
+            self.index = get_index(self.image_file)
+        except (EnvironmentError, tarfile.TarError) as e:
             log.error("opening tar archive %s: %s", self.image_file, e)
             raise PayloadError("invalid payload format")
 
     @property
     def requiredSpace(self):
-        byte_count = sum(m.size for m in self.archive.getmembers())
-        return byte_count / (1024.0 * 1024.0)   # FIXME: Size
+        return self.index.total_bytes / (1024.0 * 1024.0)   # FIXME: Size
 
     @property
     def kernelVersionList(self):
-        names = self.archive.getnames()
-        kernels = [n for n in names if "boot/vmlinuz-" in n]
-        return kernels
+        return self.index.kernels
+
+    def _extract_tarfile(self, progress):
+        """ Extract with the tarfile module, the archive is decompressed in
+            this process.
+        """
+        with open(self.image_file, "rb") as src:
+            archive = tarfile.open(fileobj=_ProgressReader(src, progress),
+                                   mode="r|*")
+            try:
+                archive.extractall(path=ROOT_PATH)
+            finally:
+                archive.close()
+
+    def _extract_pipeline(self, argv, progress):
+        """ Feed the archive to decompressor | tar.
+
+            The stages are started with iutil.start_program(), the output
+            of each one is logged once it exits.
+
+            :param argv: the decompressor command, None if the archive is
+                         not compressed
+            :type argv: list of str or None
+            :raises tarfile.ExtractError: if a stage fails
+        """
+        tar_argv = ["tar", "-x", "-p", "--numeric-owner", "-f", "-",
+                    "-C", ROOT_PATH]
+        stages = []
+        feed = None
+
+        def start(stage_argv, **kwargs):
+            errlog = tempfile.TemporaryFile()
+            kwargs.setdefault("stdout", errlog)
+            try:
+                proc = iutil.start_program(stage_argv, stderr=errlog,
+                                           **kwargs)
+            except OSError:
+                errlog.close()
+                raise
+            stages.append((proc, errlog))
+            return proc
+
+        try:
+            if argv:
+                dec = start(argv, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE)
+                feed = dec.stdin
+                try:
+                    tar = start(tar_argv, stdin=dec.stdout)
+                finally:
+                    # only tar reads the decompressed data
+                    dec.stdout.close()
+            else:
+                tar = start(tar_argv, stdin=subprocess.PIPE)
+                feed = tar.stdin
+
+            with open(self.image_file, "rb") as src:
+                while True:
+                    data = src.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    try:
+                        feed.write(data)
+                    except IOError as e:
+                        # the pipeline died, its return code tells why
+                        if e.errno != errno.EPIPE:
+                            raise
+                        break
+                    progress.update(len(data))
+        finally:
+            # without the end of its input the pipeline never exits
+            if feed:
+                try:
+                    feed.close()
+                except IOError:
+                    pass
+            for proc, errlog in stages:
+                errlog.seek(0)
+                iutil.wait_program(proc, errlog.read().splitlines())
+                errlog.close()
+
+        failed = [proc for proc, _errlog in stages if proc.returncode]
+        if failed:
+            raise tarfile.ExtractError("extraction failed with %d"
+                                       % failed[0].returncode)
 
     def install(self):
+        progress = CopyProgress(os.stat(self.image_file).st_size,
+                                self.index.total_files)
+        progress.start()
+
+        compressed, argv = decompressor(self.image_file)
         try:
-            self.archive.extractall(path=ROOT_PATH)
-        except (tarfile.ExtractError, tarfile.CompressionError) as e:
+            if not find_program("tar") or (compressed and not argv):
+                self._extract_tarfile(progress)
+            else:
+                self._extract_pipeline(argv, progress)
+        except (EnvironmentError, tarfile.TarError) as e:
             log.error("extracting tar archive %s: %s", self.image_file, e)
-
+            exn = PayloadInstallError("Failed to extract %s: %s"
+                                      % (self.image_file, e))
+            if errorHandler.cb(exn) == ERROR_RAISE:
+                raise exn
+        else:
+            progress.update(nfiles=self.index.total_files)
+            progress.finish()
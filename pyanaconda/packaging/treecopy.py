@@ -0,0 +1,551 @@
+# treecopy.py
+# Parallel copy of a live file system tree onto the target system.
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    The live payloads used to copy the source tree with a single rsync
+    process, which copies one file at a time.  TreeCopier walks the tree in
+    the calling thread, creating directories, symlinks, device nodes and
+    hardlinks itself, and hands regular files over to a pool of worker
+    threads that copy the data in the kernel (copy_file_range/sendfile)
+    whenever possible.
+
+    The rsync semantics the installer relied on are kept: permissions,
+    owners, groups, ACLs, xattrs, times, symlinks, hardlinks, devices and
+    special files are preserved and file system boundaries are not crossed.
+"""
+
+import os
+import stat
+import time
+import re
+import sys
+import errno
+import threading
+import multiprocessing
+from Queue import Queue
+
+from pyanaconda import iutil
+from pyanaconda import fsutil
+from pyanaconda.flags import flags
+from pyanaconda.packaging import imageblit
+from pyanaconda.progress import progressQ
+from pyanaconda.i18n import _
+
+from blivet.size import Size
+
+import logging
+log = logging.getLogger("packaging")
+
+# boot option selecting the copy engine, "livecopy=rsync" restores the
+# old single rsync process behaviour, "livecopy=image" writes the root
+# image blocks when the target layout allows it
+COPY_MODE_NATIVE = "native"
+COPY_MODE_RSYNC = "rsync"
+COPY_MODE_IMAGE = "image"
+COPY_MODES = (COPY_MODE_NATIVE, COPY_MODE_RSYNC, COPY_MODE_IMAGE)
+
+# errors that make continuing the copy pointless
+FATAL_ERRNOS = (errno.ENOSPC, errno.EDQUOT, errno.EIO, errno.EROFS)
+
+# size of a single in-kernel copy request
+CHUNK_SIZE = 8 * 1024 * 1024
+
+class TreeCopyError(Exception):
+    pass
+
+def default_workers():
+    """ Number of copy threads to use, can be set with livecopy.workers=N """
+    try:
+        workers = int(flags.cmdline.get("livecopy.workers") or 0)
+    except ValueError:
+        workers = 0
+    if workers > 0:
+        return workers
+    # the work is I/O bound, so oversubscribe the CPUs a bit
+    return max(4, min(16, multiprocessing.cpu_count() * 2))
+
+def copy_mode():
+    """ Return the copy engine selected on the boot command line. """
+    mode = flags.cmdline.get("livecopy") or COPY_MODE_NATIVE
+    if mode not in COPY_MODES:
+        log.warning("unknown livecopy mode %s, using %s", mode,
+                    COPY_MODE_NATIVE)
+        mode = COPY_MODE_NATIVE
+    return mode
+
+_pattern_cache = {}
+
+def _compile_exclude(pattern):
+    """ Translate an rsync exclude pattern, without its trailing slash, to
+        a regular expression matched against "/" + the relative path.
+
+        Like rsync, "*" and "?" do not match "/" while "**" does, a pattern
+        starting with "/" is anchored at the root of the tree and any other
+        pattern matches the end of the path at a directory boundary.
+    """
+    regex = _pattern_cache.get(pattern)
+    if regex is not None:
+        return regex
+
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            end = pattern.find("]", i + 2)
+            if end < 0:
+                parts.append(re.escape(char))
+            else:
+                chars = pattern[i + 1:end]
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                parts.append("[%s]" % chars.replace("\\", "\\\\"))
+                i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+
+    if pattern.startswith("/"):
+        regex = re.compile("^%s$" % "".join(parts))
+    else:
+        regex = re.compile("(^|/)%s$" % "".join(parts))
+    _pattern_cache[pattern] = regex
+    return regex
+
+def excluded(relpath, is_dir, excludes):
+    """ Return True if relpath ("/" followed by the path relative to the
+        root of the tree) matches one of the rsync style excludes, see
+        _compile_exclude().  A trailing slash only matches directories.
+    """
+    for pattern in excludes:
+        if pattern.endswith("/"):
+            if not is_dir:
+                continue
+            pattern = pattern[:-1]
+        if _compile_exclude(pattern).search(relpath):
+            return True
+    return False
+
+# minimum time between two progress messages, in seconds
+PROGRESS_INTERVAL = 0.5
+
+class CopyProgress(object):
+    """ Turn the byte counts reported by the copy workers into progress
+        messages with throughput and ETA.  Messages are sent from whatever
+        thread reports the progress, there is no monitor thread.
+    """
+    def __init__(self, total_bytes, total_files=None):
+        """
+            :param total_bytes: number of bytes that are going to be copied
+            :type total_bytes: int
+            :param total_files: number of files, if known
+            :type total_files: int or None
+        """
+        self.total_bytes = max(int(total_bytes), 1)
+        self.total_files = total_files
+        self.bytes_done = 0
+        self.files_done = 0
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._last_sent = 0
+        self._last_pct = -1
+
+    @property
+    def throughput(self):
+        """ Average throughput so far in bytes per second. """
+        elapsed = time.time() - self._start
+        if elapsed <= 0:
+            return 0
+        return int(self.bytes_done / elapsed)
+
+    @property
+    def eta(self):
+        """ Estimated seconds left, None if not known yet. """
+        speed = self.throughput
+        if not speed:
+            return None
+        return max(0, self.total_bytes - self.bytes_done) / speed
+
+    def start(self):
+        self._start = time.time()
+        self._last_pct = 0
+        self._send(0)
+
+    def update(self, nbytes=0, nfiles=0):
+        """ Account nbytes more bytes and nfiles more files as copied. """
+        with self._lock:
+            self.bytes_done += nbytes
+            self.files_done += nfiles
+            pct = min(99, int(100 * self.bytes_done / self.total_bytes))
+            now = time.time()
+            if pct == self._last_pct or now - self._last_sent < PROGRESS_INTERVAL:
+                return
+            self._last_pct = pct
+            self._last_sent = now
+        self._send(pct)
+
+    def finish(self):
+        self._send(100)
+        elapsed = time.time() - self._start
+        log.info("copied %d bytes in %d files in %.1f seconds (%s/s)",
+                 self.bytes_done, self.files_done, elapsed,
+                 Size(bytes=self.throughput))
+
+    def _send(self, pct):
+        msg = _("Installing software") + (" %d%%") % (pct,)
+        eta = self.eta
+        if 0 < pct < 100 and eta is not None:
+            msg += " (%s/s, %d:%02d)" % (Size(bytes=self.throughput),
+                                         eta // 60, eta % 60)
+        if self.total_files:
+            log.debug("copy progress: %d/%d bytes, %d/%d files",
+                      self.bytes_done, self.total_bytes,
+                      self.files_done, self.total_files)
+        else:
+            log.debug("copy progress: %d/%d bytes, %d files",
+                      self.bytes_done, self.total_bytes, self.files_done)
+        progressQ.send_message(msg)
+
+def _copy_data(src_fd, dst_fd, progress=None):
+    """ Copy the whole content of src_fd into dst_fd, trying the in-kernel
+        copy methods first and falling back to read()/write().
+    """
+    copied = 0
+    for method in (fsutil.copy_file_range,
+                   lambda i, o, c: fsutil.sendfile(o, i, c)):
+        try:
+            while True:
+                ret = method(src_fd, dst_fd, CHUNK_SIZE)
+                if not ret:
+                    return copied
+                copied += ret
+                if progress:
+                    progress.update(ret)
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                               errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+            if copied:
+                # the offsets were advanced, do not start over
+                break
+
+    while True:
+        buf = os.read(src_fd, CHUNK_SIZE)
+        if not buf:
+            return copied
+        while buf:
+            written = os.write(dst_fd, buf)
+            copied += written
+            buf = buf[written:]
+            if progress:
+                progress.update(written)
+
+class TreeCopier(object):
+    """ Copy a directory tree preserving everything rsync -pogAXtlHrDx
+        would, using a pool of worker threads for the file contents.
+    """
+    def __init__(self, source, dest, excludes=None, workers=None,
+                 one_file_system=True, progress=None):
+        """
+            :param source: the directory to copy from
+            :type source: str
+            :param dest: the directory to copy to
+            :type dest: str
+            :param excludes: rsync style patterns, see excluded()
+            :type excludes: list of str
+            :param workers: number of copy threads
+            :type workers: int or None
+            :param one_file_system: do not descend into other file systems
+            :type one_file_system: bool
+            :param progress: progress reporter fed by the copy
+            :type progress: CopyProgress or None
+        """
+        self.source = os.path.normpath(source)
+        self.dest = os.path.normpath(dest)
+        self.excludes = excludes or []
+        self.workers = workers or default_workers()
+        self.one_file_system = one_file_system
+        self.progress = progress
+
+        self._queue = Queue(maxsize=self.workers * 64)
+        self._abort = threading.Event()
+        self._lock = threading.Lock()
+        self._fatal = None
+        self.errors = []
+        self._dirs = []
+        self._links = []
+
+    def _error(self, path, e, fatal=False):
+        """ Record an error; fatal errors stop the whole copy. """
+        with self._lock:
+            self.errors.append("%s: %s" % (path, e))
+            if fatal or getattr(e, "errno", None) in FATAL_ERRNOS:
+                if self._fatal is None:
+                    self._fatal = "%s: %s" % (path, e)
+                self._abort.set()
+        log.error("failed to copy %s: %s", path, e)
+
+    def _set_metadata(self, src, dst, st):
+        """ Apply owner, mode, xattrs and times of st to dst.  The order
+            matters: chown clears setuid bits and file capabilities.
+        """
+        is_link = stat.S_ISLNK(st.st_mode)
+        os.lchown(dst, st.st_uid, st.st_gid)
+        if not is_link:
+            os.chmod(dst, stat.S_IMODE(st.st_mode))
+        try:
+            fsutil.copy_xattrs(src, dst)
+        except OSError as e:
+            if e.errno not in (errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS):
+                raise
+        if is_link:
+            fsutil.lutime(dst, (st.st_atime, st.st_mtime))
+        else:
+            os.utime(dst, (st.st_atime, st.st_mtime))
+
+    def _copy_file(self, src, dst, st):
+        src_fd = os.open(src, os.O_RDONLY | os.O_NOFOLLOW)
+        try:
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                             os.O_NOFOLLOW, 0600)
+            try:
+                _copy_data(src_fd, dst_fd, self.progress)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+        self._set_metadata(src, dst, st)
+        if self.progress:
+            self.progress.update(nfiles=1)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._abort.is_set():
+                    continue
+                src, dst, st = item
+                try:
+                    self._copy_file(src, dst, st)
+                except (OSError, IOError) as e:
+                    self._error(src, e)
+                except Exception as e: # pylint: disable=broad-except
+                    # keep draining the queue, the walker would block on it
+                    log.error("copying %s failed", src, exc_info=sys.exc_info())
+                    self._error(src, e, fatal=True)
+            finally:
+                self._queue.task_done()
+
+    def _make_node(self, src, dst, st):
+        """ Create anything that is not a regular file or a directory. """
+        try:
+            os.unlink(dst)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(src), dst)
+        elif stat.S_ISFIFO(st.st_mode):
+            os.mkfifo(dst, stat.S_IMODE(st.st_mode))
+        else:
+            # character and block devices, sockets
+            os.mknod(dst, st.st_mode, st.st_rdev)
+        self._set_metadata(src, dst, st)
+        if self.progress:
+            self.progress.update(nfiles=1)
+
+    def _make_dir(self, src, dst, st):
+        try:
+            # keep the directory writable until its metadata is applied
+            os.mkdir(dst, stat.S_IMODE(st.st_mode) | stat.S_IRWXU)
+        except OSError as e:
+            if e.errno != errno.EEXIST or not os.path.isdir(dst):
+                raise
+        self._dirs.append((src, dst, st))
+
+    def _walk(self, root_dev):
+        """ Walk the source tree depth first, queueing the regular files. """
+        inodes = {}
+        stack = [""]
+        while stack and not self._abort.is_set():
+            reldir = stack.pop()
+            srcdir = self.source + reldir
+            try:
+                names = os.listdir(srcdir)
+            except OSError as e:
+                self._error(srcdir, e)
+                continue
+
+            for name in names:
+                if self._abort.is_set():
+                    return
+                relpath = reldir + "/" + name
+                src = self.source + relpath
+                dst = self.dest + relpath
+                try:
+                    st = os.lstat(src)
+                    mode = st.st_mode
+                    if excluded(relpath, stat.S_ISDIR(mode), self.excludes):
+                        continue
+
+                    if stat.S_ISDIR(mode):
+                        self._make_dir(src, dst, st)
+                        # like rsync -x, keep the empty mount point
+                        if not self.one_file_system or st.st_dev == root_dev:
+                            stack.append(relpath)
+                        continue
+
+                    if st.st_nlink > 1:
+                        key = (st.st_dev, st.st_ino)
+                        if key in inodes:
+                            self._links.append((inodes[key], dst))
+                            continue
+                        inodes[key] = dst
+
+                    if stat.S_ISREG(mode):
+                        self._queue.put((src, dst, st))
+                    else:
+                        self._make_node(src, dst, st)
+                except (OSError, IOError) as e:
+                    self._error(src, e)
+
+    def _finish(self):
+        """ Create the hardlinks and apply the directory metadata, deepest
+            directories first so their times are not touched again.
+        """
+        for target, dst in self._links:
+            try:
+                try:
+                    os.unlink(dst)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                os.link(target, dst)
+            except OSError as e:
+                self._error(dst, e)
+
+        for src, dst, st in reversed(self._dirs):
+            try:
+                self._set_metadata(src, dst, st)
+            except OSError as e:
+                self._error(dst, e)
+
+    def run(self):
+        """ Copy the tree.
+
+            :raises TreeCopyError: if anything could not be copied, the
+                                   errors are also in the errors attribute
+        """
+        log.info("copying %s to %s using %d threads", self.source, self.dest,
+                 self.workers)
+        root_st = os.lstat(self.source)
+        iutil.mkdirChain(self.dest)
+        self._dirs.append((self.source, self.dest, root_st))
+
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(name="AnaTreeCopy%d" % i,
+                                      target=self._worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            self._walk(root_st.st_dev)
+        finally:
+            for _thread in threads:
+                self._queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if not self._abort.is_set():
+            self._finish()
+
+        if self._fatal:
+            raise TreeCopyError(self._fatal)
+        log.info("copy of %s finished with %d errors", self.source,
+                 len(self.errors))
+        if self.errors:
+            raise TreeCopyError("%d files could not be copied: %s"
+                                % (len(self.errors),
+                                   ", ".join(self.errors[:10])))
+        if self.progress:
+            self.progress.finish()
+
+def rsync_tree(source, dest, excludes):
+    """ Copy the tree with rsync, the way the live payloads always did. """
+    cmd = "rsync"
+    # preserve: permissions, owners, groups, ACL's, xattrs, times,
+    #           symlinks, hardlinks
+    # go recursively, include devices and special files, don't cross
+    # file system boundaries
+    args = ["-pogAXtlHrDx"]
+    for pattern in excludes:
+        args.extend(["--exclude", pattern])
+    args.extend([source.rstrip("/") + "/", dest])
+
+    rc = iutil.execWithRedirect(cmd, args)
+    log.info("%s exited with code %d", cmd, rc)
+    if rc == 12:
+        raise TreeCopyError("%s exited with code %d" % (cmd, rc))
+
+def copy_tree(source, dest, excludes, total_bytes, total_files=None,
+              storage=None):
+    """ Copy the source tree to dest with the engine selected by the
+        livecopy= boot option, reporting the progress through progressQ.
+
+        :param total_bytes: size of the data to copy, used for the progress
+        :param total_files: number of files to copy, if known
+        :param storage: the target storage, needed for livecopy=image
+        :raises TreeCopyError, OSError, RuntimeError: on failure
+    """
+    mode = copy_mode()
+    if mode == COPY_MODE_IMAGE and storage is not None:
+        blit_source = imageblit.find_blit_source(storage, source)
+        if blit_source:
+            image, fstype = blit_source
+            progress = CopyProgress(imageblit.device_size(image))
+            progress.start()
+            try:
+                imageblit.ImageBlitter(storage, image, fstype, progress).run()
+            except imageblit.ImageBlitError as e:
+                raise TreeCopyError(str(e))
+            imageblit.prune_excludes(dest, excludes)
+            return
+        log.info("target layout does not allow a block copy, copying files")
+
+    progress = CopyProgress(total_bytes, total_files)
+    progress.start()
+    if mode == COPY_MODE_RSYNC:
+        # rsync does not tell us anything until it is done
+        rsync_tree(source, dest, excludes)
+        progress.finish()
+    else:
+        TreeCopier(source, dest, excludes, progress=progress).run()
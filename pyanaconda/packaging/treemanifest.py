@@ -0,0 +1,182 @@
+# treemanifest.py
+# Size manifest of a live file system tree.
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    Walking the whole live tree to learn its size takes seconds on slow
+    media, and the space checker asks for it after every spoke.  A
+    TreeManifest records the size of the tree once: the total number of
+    bytes and files (hardlinks counted once) and the size of every
+    directory.  It is either shipped on the media or built once and cached,
+    keyed by the identity of the image backing the tree.
+"""
+
+import os
+import stat
+import json
+
+from pyanaconda import iutil
+
+import logging
+log = logging.getLogger("packaging")
+
+# manifest shipped inside the live image by the image build scripts
+SHIPPED_MANIFEST = "/install-data/tree-manifest.json"
+# where manifests built at runtime are cached
+MANIFEST_CACHE = "/tmp/anaconda-tree-manifest.json"
+
+MANIFEST_VERSION = 1
+
+def mount_source(mountpoint):
+    """ Return a (source, fstype) tuple describing what is mounted on
+        mountpoint, (None, None) if nothing is.
+    """
+    mountpoint = os.path.realpath(mountpoint)
+    source, fstype = None, None
+    try:
+        with open("/proc/self/mountinfo") as f:
+            for line in f:
+                fields = line.split()
+                # the separator is followed by fstype and mount source
+                sep = fields.index("-")
+                if fields[4] == mountpoint:
+                    # the last mount on a mountpoint wins
+                    fstype, source = fields[sep + 1], fields[sep + 2]
+    except (IOError, ValueError, IndexError) as e:
+        log.debug("failed to parse mountinfo: %s", e)
+    return source, fstype
+
+def backing_file(device):
+    """ Return the file backing a loop device, or the device itself. """
+    backing = "/sys/block/%s/loop/backing_file" % os.path.basename(device)
+    if os.path.exists(backing):
+        try:
+            return open(backing).read().strip()
+        except IOError:
+            pass
+    return device
+
+def image_identity(mountpoint):
+    """ Return a string identifying the image mounted on mountpoint.
+
+        For loop devices (the squashfs image of the live media) the backing
+        file is used, otherwise the device itself.  None is returned when
+        nothing is mounted there.
+    """
+    source, _fstype = mount_source(mountpoint)
+    if not source or not source.startswith("/dev/"):
+        return None
+
+    path = backing_file(source)
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        log.debug("failed to stat %s: %s", path, e)
+        return None
+
+    if stat.S_ISBLK(st.st_mode):
+        try:
+            with open(path) as dev:
+                dev.seek(0, os.SEEK_END)
+                size = dev.tell()
+        except IOError:
+            size = None
+        return "%s:%s:%s" % (path, st.st_rdev, size)
+    return "%s:%d:%d:%d" % (path, st.st_ino, st.st_size, int(st.st_mtime))
+
+class TreeManifest(object):
+    """ Sizes of a directory tree.
+
+        dirs maps every directory, relative to the root of the tree and
+        starting with "/", to the number of bytes stored under it.  The root
+        of the tree is "/".
+    """
+    def __init__(self, total_bytes=0, total_files=0, dirs=None, identity=None):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.dirs = dirs or {}
+        self.identity = identity
+
+    def dir_size(self, relpath):
+        """ Return the bytes stored under relpath, 0 if it is not known. """
+        relpath = "/" + relpath.strip("/")
+        return self.dirs.get(relpath, 0)
+
+    @classmethod
+    def build(cls, root, identity=None):
+        """ Walk root, not crossing file system boundaries. """
+        log.info("building the manifest of %s", root)
+        usage = iutil.dir_usage(root, depth=None)
+        dirs = dict((relpath, sizes[0])
+                    for relpath, sizes in usage.dirs.items())
+
+        manifest = cls(usage.bytes, usage.files - usage.hardlinks, dirs,
+                       identity)
+        log.info("manifest of %s: %d bytes in %d files", root,
+                 manifest.total_bytes, manifest.total_files)
+        return manifest
+
+    @classmethod
+    def load(cls, path):
+        """ Load a manifest saved with save(), None if it is not usable. """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") != MANIFEST_VERSION:
+                return None
+            return cls(int(data["total_bytes"]), int(data["total_files"]),
+                       data.get("dirs", {}), data.get("identity"))
+        except (IOError, ValueError, KeyError, TypeError, AttributeError) as e:
+            log.debug("cannot load tree manifest %s: %s", path, e)
+            return None
+
+    def save(self, path):
+        data = {"version": MANIFEST_VERSION,
+                "total_bytes": self.total_bytes,
+                "total_files": self.total_files,
+                "dirs": self.dirs,
+                "identity": self.identity}
+        try:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            log.warning("cannot save tree manifest %s: %s", path, e)
+
+def get_manifest(root, cache_path=MANIFEST_CACHE):
+    """ Return the manifest of the tree mounted on root.
+
+        The manifest shipped on the media is preferred, then the cached one
+        if it was built from the same image; otherwise the tree is walked
+        and the result cached.
+    """
+    shipped = TreeManifest.load(root + SHIPPED_MANIFEST)
+    if shipped:
+        log.info("using the tree manifest shipped on the media")
+        return shipped
+
+    identity = image_identity(root)
+    cached = TreeManifest.load(cache_path)
+    if cached and identity and cached.identity == identity:
+        log.info("using the cached tree manifest of %s", identity)
+        return cached
+
+    manifest = TreeManifest.build(root, identity)
+    manifest.save(cache_path)
+    return manifest
@@ -0,0 +1,287 @@
+# treeverify.py
+# Verification of a copied live file system tree.
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    Flaky install media can silently corrupt the copy of the live tree.
+    TreeVerifier hashes the regular files of the installed tree on a pool
+    of threads and compares them to a checksum manifest: the one shipped on
+    the media when there is one (so bad reads of the media are caught too),
+    otherwise the hashes of the source files.
+
+    Verification is enabled with the liveverify boot option.  A value
+    (liveverify=10) only verifies a random sample of files holding that
+    percentage of the bytes.
+"""
+
+import os
+import stat
+import mmap
+import random
+import hashlib
+import threading
+from Queue import Queue
+
+from pyanaconda.flags import flags
+from pyanaconda.packaging.treecopy import excluded, default_workers
+from pyanaconda.progress import progressQ
+from pyanaconda.i18n import _
+
+import logging
+log = logging.getLogger("packaging")
+
+# checksum manifest shipped inside the live image, in sha256sum format
+SHIPPED_CHECKSUMS = "/install-data/tree-sha256sums"
+
+# hash this much of a mapped file at a time
+HASH_CHUNK = 16 * 1024 * 1024
+
+def verify_percentage():
+    """ Return the percentage of bytes to verify, 0 if disabled. """
+    if "liveverify" not in flags.cmdline:
+        return 0
+    value = flags.cmdline.get("liveverify")
+    if not value:
+        return 100
+    try:
+        return max(0, min(100, int(value)))
+    except ValueError:
+        log.warning("invalid liveverify value %s, verifying everything", value)
+        return 100
+
+def hash_file(path):
+    """ Return the sha256 hex digest of the file at path. """
+    digest = hashlib.sha256()
+    fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    try:
+        size = os.fstat(fd).st_size
+        if size:
+            mapped = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size, HASH_CHUNK):
+                    digest.update(buffer(mapped, offset, HASH_CHUNK))
+            finally:
+                mapped.close()
+    finally:
+        os.close(fd)
+    return digest.hexdigest()
+
+def load_checksums(path):
+    """ Parse a sha256sum style file into a relpath -> digest dict, None if
+        it cannot be read.
+    """
+    checksums = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line or line.startswith("#"):
+                    continue
+                digest, name = line.split(None, 1)
+                name = name.lstrip("*")
+                if name.startswith("./"):
+                    name = name[1:]
+                elif not name.startswith("/"):
+                    name = "/" + name
+                checksums[name] = digest.lower()
+    except (IOError, ValueError) as e:
+        log.debug("cannot load checksums %s: %s", path, e)
+        return None
+    return checksums
+
+class TreeVerifier(object):
+    """ Compare the files of dest to those of source. """
+    def __init__(self, source, dest, excludes=None, percentage=100,
+                 workers=None, checksums=None, dest_excludes=None):
+        """
+            :param source: the tree that was copied
+            :type source: str
+            :param dest: the copy
+            :type dest: str
+            :param excludes: rsync style excludes used for the copy
+            :type excludes: list of str
+            :param percentage: percentage of bytes to verify
+            :type percentage: int
+            :param workers: number of hashing threads
+            :type workers: int or None
+            :param checksums: relpath -> sha256 digest of the source files,
+                              the source files are hashed if not given
+            :type checksums: dict or None
+            :param dest_excludes: rsync style excludes for files of dest
+                                  that are not part of the copy, like the
+                                  image a payload downloaded there
+            :type dest_excludes: list of str
+        """
+        self.source = os.path.normpath(source)
+        self.dest = os.path.normpath(dest)
+        self.excludes = excludes or []
+        self.dest_excludes = self.excludes + (dest_excludes or [])
+        self.percentage = percentage
+        self.workers = workers or default_workers()
+        self.checksums = checksums
+        self.mismatches = []
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def _walk(self, root, excludes):
+        """ Yield the (relpath, stat) of the regular files under root that
+            are not excluded.
+        """
+        root_dev = os.lstat(root).st_dev
+        for dirpath, dirnames, filenames in os.walk(root):
+            reldir = dirpath[len(root):]
+            for name in list(dirnames):
+                try:
+                    st = os.lstat(os.path.join(dirpath, name))
+                except OSError:
+                    dirnames.remove(name)
+                    continue
+                if not stat.S_ISDIR(st.st_mode) or st.st_dev != root_dev or \
+                        excluded(reldir + "/" + name, True, excludes):
+                    dirnames.remove(name)
+
+            for name in filenames:
+                relpath = reldir + "/" + name
+                if excluded(relpath, False, excludes):
+                    continue
+                try:
+                    st = os.lstat(root + relpath)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    yield relpath, st
+
+    def _files(self):
+        """ Return the (relpath, size) of the regular files to verify, every
+            source file name is also added to self._names.
+        """
+        inodes = set()
+        files = []
+        for relpath, st in self._walk(self.source, self.excludes):
+            self._names.add(relpath)
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in inodes:
+                    continue
+                inodes.add((st.st_dev, st.st_ino))
+            files.append((relpath, st.st_size))
+        return files
+
+    def _extra_files(self):
+        """ Return the regular files of dest that are not in source. """
+        extra = []
+        for relpath, _st in self._walk(self.dest, self.dest_excludes):
+            if relpath not in self._names:
+                log.error("verification of %s failed: not in the source",
+                          relpath)
+                extra.append(relpath)
+        return extra
+
+    def _sample(self, files):
+        """ Pick random files until they hold the wanted share of bytes. """
+        if self.percentage >= 100:
+            return files
+        wanted = sum(size for _path, size in files) * self.percentage / 100
+        random.shuffle(files)
+        sample = []
+        picked = 0
+        for relpath, size in files:
+            if picked >= wanted:
+                break
+            sample.append((relpath, size))
+            picked += size
+        return sample
+
+    def _verify(self, relpath):
+        try:
+            if self.checksums is not None:
+                expected = self.checksums.get(relpath)
+                if expected is None:
+                    log.debug("%s is not in the checksum manifest", relpath)
+                    return
+            else:
+                expected = hash_file(self.source + relpath)
+            actual = hash_file(self.dest + relpath)
+        except EnvironmentError as e:
+            actual, expected = str(e), None
+
+        if actual != expected:
+            log.error("verification of %s failed: %s != %s", relpath,
+                      actual, expected)
+            with self._lock:
+                self.mismatches.append(relpath)
+
+    def _worker(self, queue):
+        while True:
+            relpath = queue.get()
+            try:
+                if relpath is None:
+                    return
+                self._verify(relpath)
+            finally:
+                queue.task_done()
+
+    def run(self):
+        """ Verify the tree.  Files of dest missing from source are always
+            reported, whatever the percentage.
+
+            :returns: list of relative paths that do not match
+            :rtype: list of str
+        """
+        files = self._sample(self._files())
+        log.info("verifying %d files (%d bytes) of %s using %d threads",
+                 len(files), sum(size for _path, size in files), self.dest,
+                 self.workers)
+
+        queue = Queue(maxsize=self.workers * 64)
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(name="AnaTreeVerify%d" % i,
+                                      target=self._worker, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # biggest files first, so the pool does not end on a single one
+        for relpath, _size in sorted(files, key=lambda f: f[1], reverse=True):
+            queue.put(relpath)
+        for _thread in threads:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+        self.mismatches.extend(self._extra_files())
+
+        log.info("verification of %s found %d mismatches", self.dest,
+                 len(self.mismatches))
+        return sorted(self.mismatches)
+
+def verify_tree(source, dest, excludes, dest_excludes=None):
+    """ Verify dest against source if the liveverify boot option asks for
+        it.  dest_excludes are passed to TreeVerifier, see there.
+
+        :returns: list of relative paths that do not match
+        :rtype: list of str
+    """
+    percentage = verify_percentage()
+    if not percentage:
+        return []
+
+    progressQ.send_message(_("Verifying installed software"))
+    checksums = load_checksums(source + SHIPPED_CHECKSUMS)
+    return TreeVerifier(source, dest, excludes, percentage,
+                        checksums=checksums,
+                        dest_excludes=dest_excludes).run()
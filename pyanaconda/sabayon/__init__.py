@@ -33,6 +33,8 @@ from entropy.output import nocolor
 from entropy.fetchers import UrlFetcher
 import entropy.tools
 
+from pyanaconda.facts import facts
+
 log = logging.getLogger("packaging")
 
 class Entropy(Client):
@@ -73,21 +75,11 @@ class Entropy(Client):
 
     @staticmethod
     def is_sabayon_mce():
-        with open("/proc/cmdline", "r") as cmd_f:
-            args = cmd_f.readline().strip().split()
-            for tstr in ("mceinstall", "sabayonmce"):
-                if tstr in args:
-                    return True
-            return False
+        return facts.is_sabayon_mce
 
     @staticmethod
     def is_sabayon_steambox():
-        with open("/proc/cmdline", "r") as cmd_f:
-            args = cmd_f.readline().strip().split()
-            for tstr in ("steaminstall", "steambox"):
-                if tstr in args:
-                    return True
-            return False
+        return facts.is_sabayon_steambox
 
 # in this way, any singleton class that tries to directly load Client
 # gets Entropy in change
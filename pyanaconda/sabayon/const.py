@@ -24,3 +24,9 @@ SB_PRIVATE_KEY = "/boot/SecureBoot/user-private.key"
 SB_PUBLIC_X509 = "/boot/SecureBoot/user-public.crt"
 # look for collisions
 SB_PUBLIC_DER = "/boot/efi/EFI/sabayon/enroll-this.cer"
+
+# prestaged entropy repositories shipped on the live media, one directory
+# per repository laid out like its client database directory
+PRESTAGED_REPOS_DIR = "/install-data/entropy-repositories"
+# seconds the network sync of the entropy repositories may take
+REPOS_SYNC_TIME_BUDGET = 300
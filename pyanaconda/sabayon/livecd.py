@@ -19,18 +19,19 @@
 #
 
 import os
-import time
 import logging
 import threading
 
 from pyanaconda.errors import errorHandler, ERROR_RAISE
-from pyanaconda import iutil
+from pyanaconda.facts import facts
 from pyanaconda.flags import flags
 from pyanaconda.packaging import ImagePayload, PayloadInstallError
+from pyanaconda.packaging import treecopy, treemanifest, treeverify
 from pyanaconda.threads import threadMgr, AnacondaThread
 from pyanaconda.i18n import _
-from pyanaconda.constants import ROOT_PATH, INSTALL_TREE, THREAD_LIVE_PROGRESS
+from pyanaconda.constants import ROOT_PATH, INSTALL_TREE, THREAD_TREE_MANIFEST
 from pyanaconda.progress import progressQ
+from pyanaconda.taskgraph import TaskGraph
 
 from blivet.size import Size
 
@@ -39,17 +40,20 @@ from pyanaconda.sabayon import Entropy
 
 log = logging.getLogger("packaging")
 
+# resources of the postInstall steps that are not a path in the target:
+# the entropy client (its chroot is process wide), the files owned by
+# packages, the systemd unit links and the network bandwidth
+RES_ENTROPY = "entropy"
+RES_PACKAGES = "packages"
+RES_SERVICES = "services"
+RES_NETWORK = "network"
+
 
 class LiveCDCopyBackend(ImagePayload):
 
     def __init__(self, *args, **kwargs):
         super(LiveCDCopyBackend, self).__init__(*args, **kwargs)
 
-        # Used to adjust size of ROOT_PATH when files are already present
-        self._adj_size = 0
-        self.pct = 0
-        self.pct_lock = None
-        self._source_size = None
         self._sabayon_install = None
 
         self._packages = None
@@ -57,6 +61,8 @@ class LiveCDCopyBackend(ImagePayload):
         self._entropy_prop = None
         self._entropy_prop_lock = threading.RLock()
 
+        self._manifest = None
+
     @property
     def entropy(self):
         with self._entropy_prop_lock:
@@ -73,10 +79,25 @@ class LiveCDCopyBackend(ImagePayload):
                 vers.append(name[len("kernel-genkernel-"):])
         return vers
 
+    def _load_manifest(self):
+        self._manifest = treemanifest.get_manifest(
+            os.path.realpath(INSTALL_TREE))
+
+    @property
+    def manifest(self):
+        """ Size manifest of the live tree, built in the background by
+            setup() and only looked up afterwards.
+        """
+        if self._manifest is None:
+            threadMgr.wait(THREAD_TREE_MANIFEST)
+        if self._manifest is None:
+            # setup() has not been called
+            self._load_manifest()
+        return self._manifest
+
     @property
     def spaceRequired(self):
-        return Size(bytes=iutil.getDirSize(
-                os.path.realpath(INSTALL_TREE)) * 1024)
+        return Size(bytes=self.manifest.total_bytes)
 
     def recreateInitrds(self, force=False):
         log.info("calling recreateInitrds()")
@@ -103,30 +124,13 @@ class LiveCDCopyBackend(ImagePayload):
     def setup(self, storage):
         super(LiveCDCopyBackend, self).setup(storage)
 
-    def progress(self):
-        """Monitor the amount of disk space used on the target and source and
-           update the hub's progress bar.
-        """
-        mountpoints = self.storage.mountpoints.copy()
-        last_pct = -1
-        while self.pct < 100:
-            dest_size = 0
-            for mnt in mountpoints:
-                mnt_stat = os.statvfs(ROOT_PATH+mnt)
-                dest_size += mnt_stat.f_frsize * (mnt_stat.f_blocks - mnt_stat.f_bfree)
-            if dest_size >= self._adj_size:
-                dest_size -= self._adj_size
-
-            pct = 0
-            source_size = int(self._source_size)
-            if source_size:
-                pct = int(100 * dest_size / source_size)
-            if pct != last_pct:
-                with self.pct_lock:
-                    self.pct = pct
-                last_pct = pct
-                progressQ.send_message(_("Installing software") + (" %d%%") % (min(100, self.pct),))
-            time.sleep(0.777)
+        # needed by postInstall, gather them while the user is busy
+        facts.prefetch()
+
+        if self._manifest is None and \
+                not threadMgr.exists(THREAD_TREE_MANIFEST):
+            threadMgr.add(AnacondaThread(name=THREAD_TREE_MANIFEST,
+                                         target=self._load_manifest))
 
     def preInstall(self, packages=None, groups=None):
         """ Perform pre-installation tasks. """
@@ -139,41 +143,26 @@ class LiveCDCopyBackend(ImagePayload):
 
     def install(self):
         """ Install the payload. """
-        self.pct_lock = threading.Lock()
-        self.pct = 0
-        self._source_size = self.spaceRequired
-
-        threadMgr.add(AnacondaThread(name=THREAD_LIVE_PROGRESS,
-                                     target=self.progress))
-
-        cmd = "rsync"
-        # preserve: permissions, owners, groups, ACL's, xattrs, times,
-        #           symlinks, hardlinks
-        # go recursively, include devices and special files, don't cross
-        # file system boundaries
-        args = ["-pogAXtlHrDx", "--exclude", "/dev/", "--exclude", "/proc/",
-                "--exclude", "/sys/", "--exclude", "/run/",
-                "--exclude", "/etc/machine-id", INSTALL_TREE+"/", ROOT_PATH]
+        excludes = ["/dev/", "/proc/", "/sys/", "/run/", "/etc/machine-id"]
         try:
-            rc = iutil.execWithRedirect(cmd, args)
-        except (OSError, RuntimeError) as e:
-            msg = None
+            treecopy.copy_tree(INSTALL_TREE, ROOT_PATH, excludes,
+                               self.manifest.total_bytes,
+                               self.manifest.total_files,
+                               storage=self.storage)
+        except (OSError, RuntimeError, treecopy.TreeCopyError) as e:
             err = str(e)
             log.error(err)
-        else:
-            err = None
-            msg = "%s exited with code %d" % (cmd, rc)
-            log.info(msg)
-
-        if err or rc == 12:
-            exn = PayloadInstallError(err or msg)
+            exn = PayloadInstallError(err)
             if errorHandler.cb(exn) == ERROR_RAISE:
                 raise exn
 
-        # Wait for progress thread to finish
-        with self.pct_lock:
-            self.pct = 100
-        threadMgr.wait(THREAD_LIVE_PROGRESS)
+        mismatches = treeverify.verify_tree(INSTALL_TREE, ROOT_PATH, excludes)
+        if mismatches:
+            exn = PayloadInstallError(
+                "%d installed files do not match the installation source: %s"
+                % (len(mismatches), ", ".join(mismatches[:10])))
+            if errorHandler.cb(exn) == ERROR_RAISE:
+                raise exn
 
     def _setDefaultBootTarget(self):
         """ Set the default systemd target for the system. """
@@ -190,26 +179,48 @@ class LiveCDCopyBackend(ImagePayload):
         super(LiveCDCopyBackend, self).postInstall()
 
         log.info("Preparing to configure Sabayon (backend postInstall)")
-
-        self._sabayon_install.spawn_chroot(
-            ["/usr/bin/systemd-machine-id-setup"]
-            )
-        self._sabayon_install.setup_secureboot()
-        self._sabayon_install.setup_sudo()
-        self._sabayon_install.remove_proprietary_drivers()
-        self._sabayon_install.setup_nvidia_legacy()
-        self._sabayon_install.configure_skel()
-        self._sabayon_install.configure_services()
-        self._sabayon_install.spawn_chroot(["env-update"])
-        self._sabayon_install.spawn_chroot(["ldconfig"])
+        facts.dump()
+
+        inst = self._sabayon_install
+        graph = TaskGraph("postInstall")
+        graph.add("machine-id", inst.spawn_chroot,
+                  ["/usr/bin/systemd-machine-id-setup"],
+                  writes=["/etc/machine-id"])
+        graph.add("secureboot", inst.setup_secureboot,
+                  writes=["/boot/SecureBoot", "/boot/efi"])
+        graph.add("sudo", inst.setup_sudo, writes=["/etc/sudoers"])
+        graph.add("drivers", inst.remove_proprietary_drivers,
+                  writes=[RES_ENTROPY, RES_PACKAGES, RES_SERVICES,
+                          "/etc/env.d", "/etc/modprobe.d", "/usr/lib/opengl"])
+        graph.add("nvidia-legacy", inst.setup_nvidia_legacy,
+                  writes=[RES_ENTROPY, RES_PACKAGES, RES_SERVICES,
+                          "/etc/env.d"])
+        graph.add("skel", inst.configure_skel,
+                  reads=["/usr/share/applications"], writes=["/etc/skel"])
+        graph.add("services", inst.configure_services,
+                  reads=[RES_PACKAGES, "/etc/skel"],
+                  writes=[RES_SERVICES, "/etc/gdm", "/install-data"])
+        graph.add("env-update", inst.spawn_chroot, ["env-update"],
+                  reads=[RES_PACKAGES, "/etc/env.d"],
+                  writes=["/etc/profile.env", "/etc/csh.env",
+                          "/etc/ld.so.conf", "/etc/ld.so.cache"])
+        graph.add("ldconfig", inst.spawn_chroot, ["ldconfig"],
+                  reads=[RES_PACKAGES, "/etc/ld.so.conf"],
+                  writes=["/etc/ld.so.cache"])
 
         if self._packages:
             log.info("Preparing to install these packages: %s" % (
                     self._packages,))
-            self._sabayon_install.setup_entropy_mirrors()
-            self._sabayon_install.maybe_install_packages(self._packages)
-
-        self._sabayon_install.configure_boot_args()
+            graph.add("mirrors", inst.setup_entropy_mirrors,
+                      writes=[RES_ENTROPY, RES_NETWORK])
+            graph.add("packages", inst.maybe_install_packages,
+                      self._packages,
+                      writes=[RES_ENTROPY, RES_PACKAGES, RES_SERVICES,
+                              RES_NETWORK])
+
+        graph.add("boot-args", inst.configure_boot_args,
+                  writes=["/etc/crypttab", "/boot/grub"])
+        graph.run()
 
         self._sabayon_install.emit_install_done()
 
@@ -20,10 +20,13 @@
 
 # Python imports
 import errno
+import glob
 import os
 import subprocess
 import shutil
-import commands
+import tarfile
+import tempfile
+import threading
 try:
     import ConfigParser
 except ImportError:
@@ -39,22 +42,96 @@ from entropy.services.client import WebService
 # Anaconda imports
 from pyanaconda import iutil
 from pyanaconda.constants import INSTALL_TREE, ROOT_PATH
+from pyanaconda.facts import facts, opengl_profile
+from pyanaconda.flags import flags
+from pyanaconda.packaging.download import ImageDownload, DownloadError
+from pyanaconda.packaging.fetchpool import FetchPool
+from pyanaconda.packaging.mirrors import rank_mirrors
+from pyanaconda.packaging.staging import StagedDirectory
 from pyanaconda.progress import progressQ
+from pyanaconda.servicebatch import ServiceBatch
 from pyanaconda.sabayon.const import REPO_NAME, \
-    SB_PRIVATE_KEY, SB_PUBLIC_X509, SB_PUBLIC_DER
-from pyanaconda.sabayon import Entropy
+    SB_PRIVATE_KEY, SB_PUBLIC_X509, SB_PUBLIC_DER, \
+    PRESTAGED_REPOS_DIR, REPOS_SYNC_TIME_BUDGET
 from pyanaconda.i18n import _
 
-from blivet import arch
 
 log = logging.getLogger("packaging")
 
+# number of packages downloaded at the same time by install_packages()
+FETCH_WORKERS = 4
+
+
+class EntropyChrootSession(object):
+    """
+    Reentrant context manager switching the entropy client to ROOT_PATH.
+
+    Only the outermost level switches the chroot (and back), nested levels
+    just bump a reference count and reuse the repository handles opened by
+    the session. The entropy chroot is process wide, so the session holds
+    a lock for its whole duration: other threads entering it wait.
+    """
+
+    def __init__(self, install):
+        self._install = install
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._root = None
+        self._avoided = 0
+        self._inst_repo = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            self._avoided += 1
+            return self
+
+        self._avoided = 0
+        root = etpSys['rootdir']
+        if root != ROOT_PATH:
+            self._root = root
+            self._install._change_entropy_chroot(ROOT_PATH)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        try:
+            self._depth -= 1
+            if self._depth:
+                return
+
+            self._inst_repo = None
+            if self._root is not None:
+                root, self._root = self._root, None
+                self._install._change_entropy_chroot(root)
+            if self._avoided:
+                log.info("Entropy chroot session: %d switches avoided" % (
+                        self._avoided,))
+        finally:
+            self._lock.release()
+
+    def installed_repository(self):
+        """
+        Return the installed packages repository of the chroot, opened
+        once per session.
+        """
+        if self._inst_repo is None:
+            self._inst_repo = self._install._backend.entropy.installed_repository()
+        return self._inst_repo
+
+    def invalidate(self):
+        """
+        Forget the repository handles, they have been closed.
+        """
+        self._inst_repo = None
+
 
 class SabayonInstall(object):
 
     def __init__(self, backend):
         self._backend = backend
         self._live_repo = self._open_live_installed_repository()
+        self.entropy_chroot = EntropyChrootSession(self)
 
     def spawn_chroot(self, args):
         return iutil.execWithRedirect(
@@ -84,17 +161,12 @@ class SabayonInstall(object):
             chroot = ""
         self._backend.entropy.switch_chroot(chroot)
 
-    def remove_package(self, atom, match = None):
-
-        chroot = ROOT_PATH
-        root = etpSys['rootdir']
-        if chroot != root:
-            self._change_entropy_chroot(chroot)
-
-        inst_repo = self._backend.entropy.installed_repository()
-        if match is None:
-            match = inst_repo.atomMatch(atom)
-
+    def _remove_installed(self, inst_repo, package_ids):
+        """
+        Remove the given installed package ids one after the other, sharing
+        the action factory. Return a dict mapping the package ids that
+        failed to be removed to their exit status.
+        """
         try:
             action_factory = self._backend.entropy.PackageActionFactory()
             action = action_factory.REMOVE_ACTION
@@ -102,35 +174,78 @@ class SabayonInstall(object):
             action_factory = None
             action = "remove"
 
-        rc = 0
-        if match[0] != -1:
+        failed = {}
+        for package_id in package_ids:
+            rc = 0
 
             if action_factory is not None:
                 pkg = action_factory.get(
-                    action, (match[0], inst_repo.name))
-                rc = pkg.start()
-                pkg.finalize()
+                    action, (package_id, inst_repo.name))
+                try:
+                    rc = pkg.start()
+                finally:
+                    pkg.finalize()
 
             else:
                 pkg = self._backend.entropy.Package()
-                pkg.prepare((match[0],), "remove")
+                pkg.prepare((package_id,), "remove")
                 if 'remove_installed_vanished' not in pkg.pkgmeta:
                     rc = pkg.run()
                     pkg.kill()
 
-        if chroot != root:
-            self._change_entropy_chroot(root)
+            if rc != 0:
+                failed[package_id] = rc
+
+        return failed
+
+    def remove_package(self, atom, match = None):
+
+        with self.entropy_chroot as session:
+            inst_repo = session.installed_repository()
+            if match is None:
+                match = inst_repo.atomMatch(atom)
+
+            rc = 0
+            if match[0] != -1:
+                failed = self._remove_installed(inst_repo, [match[0]])
+                rc = failed.get(match[0], 0)
 
         return rc
 
-    def install_package_file(self, package_file):
-        chroot = ROOT_PATH
-        root = etpSys['rootdir']
-        if chroot != root:
-            self._change_entropy_chroot(chroot)
+    def remove_packages(self, atoms):
+        """
+        Remove the installed packages matching atoms as a single batch:
+        the atoms are resolved against the installed repository in one
+        pass, the entropy chroot is switched once and the removals share
+        one action factory and one final repository commit. Atoms that
+        are not installed are skipped.
 
-        try:
+        Return the number of packages that could not be removed.
+        """
+        with self.entropy_chroot as session:
+            inst_repo = session.installed_repository()
+
+            package_ids = []
+            for atom in atoms:
+                package_id, _pkg_rc = inst_repo.atomMatch(atom)
+                if package_id != -1 and package_id not in package_ids:
+                    package_ids.append(package_id)
+
+            if not package_ids:
+                return 0
+
+            log.info("Removing %d packages of %d requested",
+                     len(package_ids), len(atoms))
+            failed = self._remove_installed(inst_repo, package_ids)
+            for package_id, rc in failed.items():
+                log.error("Cannot remove package id %s, error: %s",
+                          package_id, rc)
+            inst_repo.commit()
 
+        return len(failed)
+
+    def install_package_file(self, package_file):
+        with self.entropy_chroot:
             try:
                 atomsfound = self._backend.entropy.add_package_repository(
                     package_file)
@@ -157,21 +272,10 @@ class SabayonInstall(object):
             if repo != 0:
                 self._backend.entropy.remove_repository(repo)
 
-        finally:
-            if chroot != root:
-                self._change_entropy_chroot(root)
-
         return 0
 
     def install_package(self, package):
-        chroot = ROOT_PATH
-        root = etpSys['rootdir']
-
-        if chroot != root:
-            self._change_entropy_chroot(chroot)
-
-        try:
-
+        with self.entropy_chroot:
             match = self._backend.entropy.atom_match(package)
             package_id, _repository_id = match
             if package_id == -1:
@@ -197,10 +301,6 @@ class SabayonInstall(object):
 
             return exit_st
 
-        finally:
-            if chroot != root:
-                self._change_entropy_chroot(root)
-
     def configure_steambox(self, steambox_user):
 
         log.info("Configuring SteamBox mode using user: %s" % (
@@ -227,26 +327,19 @@ class SabayonInstall(object):
 
     def _detect_virt(self):
         """
-        Return a virtualization environment identifier using
-        systemd-detect-virt. This code is systemd only.
+        Return the virtualization environment identifier from the shared
+        facts cache, None on bare metal.
         """
-        proc = subprocess.Popen(
-            ["/usr/bin/systemd-detect-virt"],
-            stdout=subprocess.PIPE)
-        exit_st = proc.wait()
-        outcome = proc.stdout.read(256)
-        proc.stdout.close()
-        if exit_st == 0:
-            return outcome.strip()
+        return facts.virt
 
     def is_virtualbox(self):
-        return self._detect_virt() == "oracle"
+        return facts.is_virtualbox
 
     def is_kvm(self):
-        return self._detect_virt() == "kvm"
+        return facts.is_kvm
 
     def is_hyperv(self):
-        return self._detect_virt() == "microsoft"
+        return facts.is_hyperv
 
     def _is_encrypted(self):
         if self._backend.storage.encryptionPassphrase:
@@ -273,7 +366,7 @@ class SabayonInstall(object):
             "oemsystem",
             ]
 
-        if self._backend.entropy.is_sabayon_mce():
+        if facts.is_sabayon_mce:
             enable_srvs.append("sabayon-mce")
             enable_srvs.append("NetworkManager-wait-online")
         else:
@@ -284,15 +377,10 @@ class SabayonInstall(object):
         else:
             disable_srvs.append("virtualbox-guest-additions")
 
-        for srv in disable_srvs:
-            self.spawn_chroot(
-                ["systemctl", "--no-reload", "disable",
-                 srv + ".service"])
-
-        for srv in enable_srvs:
-            self.spawn_chroot(
-                ["systemctl", "--no-reload", "enable",
-                 srv + ".service"])
+        services = ServiceBatch()
+        services.disable(*disable_srvs)
+        services.enable(*enable_srvs)
+        services.apply()
 
         # For GDM, set DefaultSession= to /etc/skel/.dmrc value
         # This forces GDM to respect the default session and load Cinnamon
@@ -341,20 +429,19 @@ class SabayonInstall(object):
                 except (shutil.Error, OSError):
                     pass
 
-            self.remove_package("ati-drivers")
-            self.remove_package("ati-userspace")
-            self.remove_package("nvidia-settings")
-            self.remove_package("nvidia-drivers")
-            self.remove_package("nvidia-userspace")
+            self.remove_packages([
+                    "ati-drivers",
+                    "ati-userspace",
+                    "nvidia-settings",
+                    "nvidia-drivers",
+                    "nvidia-userspace",
+                    ])
 
         # bumblebee support
         if bb_enabled:
-            self.spawn_chroot(
-                [
-                    "systemctl", "--no-reload", "enable",
-                    "bumblebeed.service",
-                    ]
-                )
+            services = ServiceBatch()
+            services.enable("bumblebeed")
+            services.apply()
 
             udev_bl = ROOT_PATH + "/etc/modprobe.d/bbswitch-blacklist.conf"
             with open(udev_bl, "w") as bl_f:
@@ -371,27 +458,9 @@ blacklist nouveau
         """
         get the current OpenGL subsystem (ati,nvidia,xorg-x11)
         """
-
         if chroot is None:
-            oglprof = os.getenv('OPENGL_PROFILE')
-            if oglprof:
-                return oglprof
-            chroot = ""
-
-        ogl_path = chroot+"/etc/env.d/03opengl"
-        if os.path.isfile(ogl_path) and os.access(ogl_path,os.R_OK):
-            f = open(ogl_path,"r")
-            cont = [x.strip() for x in f.readlines() if \
-                x.strip().startswith("OPENGL_PROFILE")]
-            f.close()
-            if cont:
-                xprofile = cont[-1]
-                if "nvidia" in xprofile:
-                    return "nvidia"
-                elif "ati" in xprofile:
-                    return "ati"
-
-        return "xorg-x11"
+            return facts.opengl
+        return opengl_profile(chroot)
 
     def setup_sudo(self):
         sudoers_file = ROOT_PATH + '/etc/sudoers'
@@ -403,7 +472,7 @@ blacklist nouveau
                 sudo_f.flush()
 
     def setup_secureboot(self):
-        if not arch.isEfi():
+        if not facts.is_efi:
             # nothing to do about SecureBoot crap
             return
 
@@ -454,44 +523,33 @@ blacklist nouveau
             "x11-drivers:nvidia-userspace-" + nv_ver,
             ]
 
-        # remove current
-        self.remove_package("nvidia-drivers")
-        self.remove_package("nvidia-userspace")
-
-        # install new
-        packages = os.listdir(drivers_dir)
-        _packages = []
-        for pkg_file in packages:
-            for target_file in files:
-                if pkg_file.startswith(target_file):
-                    _packages.append(pkg_file)
-
-        packages = [os.path.join(drivers_dir, x) for x in _packages]
-        completed = True
-
-        for pkg_filepath in packages:
-
-            pkg_file = os.path.basename(pkg_filepath)
-            if not os.path.isfile(pkg_filepath):
-                continue
-
-            dest_pkg_filepath = os.path.join(
-                ROOT_PATH + "/", pkg_file)
-            shutil.copy2(pkg_filepath, dest_pkg_filepath)
-
-            rc = self.install_package_file(dest_pkg_filepath)
-            _completed = rc == 0
-
-            if not _completed:
-                log.error("An issue occurred while installing %s" % (pkg_file,))
-
-            try:
-                os.remove(dest_pkg_filepath)
-            except OSError:
-                pass
-
-            if not _completed:
-                completed = False
+        # switch the entropy chroot once for the removals and installs
+        with self.entropy_chroot:
+            # remove current
+            self.remove_packages(["nvidia-drivers", "nvidia-userspace"])
+
+            # install new
+            packages = os.listdir(drivers_dir)
+            _packages = []
+            for pkg_file in packages:
+                for target_file in files:
+                    if pkg_file.startswith(target_file):
+                        _packages.append(pkg_file)
+
+            _packages = [x for x in _packages if
+                         os.path.isfile(os.path.join(drivers_dir, x))]
+            completed = True
+
+            # the packages are only read while installing them, do not
+            # copy them into the target
+            with StagedDirectory(drivers_dir, names=_packages) as staged:
+                for pkg_file in _packages:
+                    dest_pkg_filepath = os.path.join(staged.path, pkg_file)
+
+                    rc = self.install_package_file(dest_pkg_filepath)
+                    if rc != 0:
+                        log.error("An issue occurred while installing %s" % (pkg_file,))
+                        completed = False
 
         if completed:
             # mask all the nvidia-drivers, this avoids having people
@@ -535,76 +593,393 @@ blacklist nouveau
 
     def setup_entropy_mirrors(self):
 
-        progressQ.send_message("%s: %s" % (
-            _("Reordering Entropy mirrors"), _("can take some time..."),))
+        progressQ.send_message(_("Reordering Entropy mirrors"))
 
-        chroot = ROOT_PATH
-        root = etpSys['rootdir']
-        if chroot != root:
-            self._change_entropy_chroot(chroot)
+        with self.entropy_chroot:
+            settings = SystemSettings()
+            try:
+                repo_data = settings['repositories']['available'][REPO_NAME]
+                mirrors = list(repo_data['plain_packages'])
+                ranked = rank_mirrors(
+                    mirrors,
+                    sample_path=self._mirror_sample_path(settings, REPO_NAME))
+                if ranked != mirrors:
+                    log.info("Entropy mirrors order: %s" % (ranked,))
+                    self._write_mirrors_order(REPO_NAME, ranked)
+            except Exception as err:
+                log.error("Mirror reordering failure: %s" % (err,))
+            finally:
+                # reload the repositories configuration
+                settings.clear()
+
+    def _mirror_sample_path(self, settings, repo):
+        """
+        Return the path, relative to the package mirror urls of repo, of a
+        file every mirror has and large enough to measure its throughput:
+        the compressed repository database of the current branch.
+        """
+        return "/".join((
+                etpConst.get('product', "standard"), repo, "database",
+                etpConst.get('currentarch', "amd64"),
+                settings['repositories']['branch'],
+                etpConst.get('etpdatabasefilebzip2', "packages.db.bz2")))
+
+    def _write_mirrors_order(self, repo, ranked):
+        """
+        Sort the "pkg = <url>" lines of the repo section of the entropy
+        repositories configuration in the target system like ranked.
+        """
+        conf_files = [ROOT_PATH + "/etc/entropy/repositories.conf"]
+        conf_files += sorted(glob.glob(
+                ROOT_PATH + "/etc/entropy/repositories.conf.d/*"))
+
+        def rank(line):
+            url = line.split("=", 1)[1].strip()
+            if url in ranked:
+                return ranked.index(url)
+            return len(ranked)
+
+        for conf_file in conf_files:
+            try:
+                with open(conf_file) as f:
+                    lines = f.readlines()
+            except (IOError, OSError):
+                continue
+
+            in_section = False
+            pkg_idx = []
+            for idx, line in enumerate(lines):
+                stripped = line.strip()
+                if stripped.startswith("["):
+                    in_section = stripped == "[%s]" % (repo,)
+                elif in_section and stripped.startswith("pkg") and \
+                        stripped[3:].lstrip().startswith("="):
+                    pkg_idx.append(idx)
+
+            if len(pkg_idx) < 2:
+                continue
+
+            # sorted() is stable, unknown urls keep their relative order
+            ordered = sorted([lines[idx] for idx in pkg_idx], key=rank)
+            for idx, line in zip(pkg_idx, ordered):
+                lines[idx] = line
+
+            tmp_file = conf_file + ".anaconda"
+            with open(tmp_file, "w") as f:
+                f.writelines(lines)
+            shutil.copystat(conf_file, tmp_file)
+            os.rename(tmp_file, conf_file)
+
+    def _repository_dir(self, settings, repo):
+        """
+        Return the database directory of repo inside the target system.
+        """
+        dbpath = settings['repositories']['available'][repo]['dbpath']
+        if not dbpath.startswith(ROOT_PATH + "/"):
+            dbpath = ROOT_PATH + dbpath
+        return dbpath
+
+    def _repository_revision(self, path):
+        """
+        Return the revision of the repository database in path, -1 if
+        there is none.
+        """
+        rev_file = os.path.join(path, etpConst.get(
+                'etpdatabaserevisionfile', "packages.db.revision"))
         try:
-            self._backend.entropy.reorder_mirrors(REPO_NAME)
-        except Exception as err:
-            log.error("Mirror reordering failure: %s" % (err,))
+            with open(rev_file) as f:
+                return int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return -1
+
+    def _fetch_prestaged(self, source, repo, tmp_dir):
+        """
+        Return a local directory with the prestaged copy of repo found in
+        source, None if there is none. Sources are directories holding a
+        subdirectory per repository or urls of directories holding a
+        <repo>.tar archive per repository.
+        """
+        if "://" not in source:
+            path = os.path.join(source, repo)
+            if os.path.isdir(path):
+                return path
+            return None
+
+        url = "%s/%s.tar" % (source.rstrip("/"), repo)
+        archive = os.path.join(tmp_dir, repo + ".tar")
+        path = os.path.join(tmp_dir, repo)
+        try:
+            ImageDownload(url, archive, retries=1, timeout=30).run()
+            with tarfile.open(archive, "r:*") as tar:
+                tar.extractall(path)
+        except (DownloadError, tarfile.TarError, EnvironmentError) as err:
+            log.warning("Cannot get prestaged repository %s: %s" % (
+                    url, err,))
+            return None
         finally:
-            if chroot != root:
-                self._change_entropy_chroot(root)
+            if os.path.exists(archive):
+                os.remove(archive)
+        return path
 
-    def update_entropy_repositories(self):
+    def _prestage_repositories(self, settings, repos, force = False):
+        """
+        Install the prestaged copies of repos that are newer than the
+        databases in the target system, or all of them if force is True.
 
+        Return the set of the repositories that have a local database.
+        """
+        source = flags.cmdline.get("entropy.prestage") or PRESTAGED_REPOS_DIR
+        tmp_dir = tempfile.mkdtemp(prefix="entropy-prestage-", dir="/tmp")
+        local = set()
+        try:
+            for repo in repos:
+                dest = self._repository_dir(settings, repo)
+                current = self._repository_revision(dest)
+                path = self._fetch_prestaged(source, repo, tmp_dir)
+                prestaged = -1
+                if path:
+                    prestaged = self._repository_revision(path)
+
+                if prestaged != -1 and (force or prestaged > current):
+                    log.info("Using prestaged repository %s, revision %d "
+                             "(installed: %d)" % (repo, prestaged, current))
+                    try:
+                        if os.path.lexists(dest):
+                            shutil.rmtree(dest)
+                        shutil.copytree(path, dest, symlinks=True)
+                        current = prestaged
+                    except (shutil.Error, EnvironmentError) as err:
+                        log.error("Cannot prestage repository %s: %s" % (
+                                repo, err,))
+                        current = self._repository_revision(dest)
+
+                if current != -1:
+                    local.add(repo)
+        finally:
+            shutil.rmtree(tmp_dir, True)
+
+        return local
+
+    def _sync_time_budget(self):
+        """
+        Return the seconds the repositories sync may take, 0 to not use
+        the network at all. Set with entropy.synctimeout=N.
+        """
+        value = flags.cmdline.get("entropy.synctimeout")
+        if value is None:
+            return REPOS_SYNC_TIME_BUDGET
+        try:
+            return max(0, int(value))
+        except ValueError:
+            log.warning("Invalid entropy.synctimeout value: %s" % (value,))
+            return REPOS_SYNC_TIME_BUDGET
+
+    def _sync_repositories(self, repos, budget):
+        """
+        Sync repos with equo running in the target system, killed after
+        budget seconds so a stalled download cannot stall the installation.
+        The sync is an exec'd process of its own: forking this multithreaded
+        process could leave the child with locks held by other threads.
+
+        Return True if the sync completed successfully.
+        """
+        if not repos:
+            log.error("No repositories in repositories.conf")
+            return False
+
+        pool = iutil.CommandPool(workers=1, name="AnaRepoSync")
+        future = pool.submit("equo", ["update"] + sorted(repos),
+                             root=ROOT_PATH, timeout=budget)
+        try:
+            pool.wait()
+        except OSError as err:
+            log.error("Sync error: %s" % (err,))
+            return False
+
+        if future.timed_out:
+            log.error("Repositories sync exceeded %d seconds, "
+                      "aborted it" % (budget,))
+            return False
+        return future.returncode == 0
+
+    def update_entropy_repositories(self):
+        """
+        Make the repository databases available in the target system.
+
+        Prestaged copies (from the live media, a local directory or mirror
+        set with entropy.prestage=) newer than the installed databases are
+        installed first, then the network sync only has to fetch what
+        changed since their revision. The sync has a time budget, when it
+        fails or times out the local databases are used if every
+        repository has one.
+        """
         progressQ.send_message(_("Downloading software repositories..."))
 
         settings = SystemSettings()
-        chroot = ROOT_PATH
-        root = etpSys['rootdir']
-        if chroot != root:
-            self._change_entropy_chroot(chroot)
+        with self.entropy_chroot as session:
 
-        repos = list(settings['repositories']['available'].keys())
+            repos = list(settings['repositories']['available'].keys())
 
-        try:
-            # fetch_security = False => avoid spamming stdout
             try:
-                repo_intf = self._backend.entropy.Repositories(
-                    repos, fetch_security=False)
-            except AttributeError as err:
-                log.error("No repositories in repositories.conf")
-                return False
-            except Exception as err:
-                log.error("Unhandled exception: %s" % (err,))
-                return False
+                local = self._prestage_repositories(settings, repos)
+                offline_ok = bool(repos) and set(repos) <= local
+
+                budget = self._sync_time_budget()
+                if not budget:
+                    if offline_ok:
+                        log.info("Not syncing repositories, using the "
+                                 "local databases")
+                    else:
+                        log.error("Repositories sync disabled and no "
+                                  "local databases for %s" % (
+                                sorted(set(repos) - local),))
+                    return offline_ok
+
+                if self._sync_repositories(repos, budget):
+                    return True
+
+                if offline_ok:
+                    # a killed sync can leave a database half written
+                    self._prestage_repositories(settings, repos, force=True)
+                    log.warning("Cannot download repositories atm, "
+                                "using the local databases")
+                    return True
 
-            try:
-                update_rc = repo_intf.sync()
-            except Exception as err:
-                log.error("Sync error: %s" % (err,))
-                return False
-
-            if repo_intf.sync_errors or (update_rc != 0):
                 log.error("Cannot download repositories atm")
                 return False
 
-            return update_rc == 0
+            finally:
 
-        finally:
+                self._backend.entropy.close_repositories()
+                settings.clear()
+                # the handles opened by the session were just closed
+                session.invalidate()
 
-            self._backend.entropy.close_repositories()
-            settings.clear()
-            if chroot != root:
-                self._change_entropy_chroot(root)
+    def _install_queue(self, matches):
+        """
+        Return matches and the dependencies they need, in install order.
+        If the queue cannot be computed, matches is returned as it is.
+        """
+        try:
+            outcome = self._backend.entropy.get_install_queue(
+                matches, False, False)
+        except Exception as err:
+            log.warning("Cannot compute the install queue: %s" % (err,))
+            return matches
+
+        # older entropy versions return a status instead of raising
+        if len(outcome) > 2 and outcome[2] != 0:
+            log.warning("Cannot compute the install queue, status: %s" % (
+                    outcome[2],))
+            return matches
+        return list(outcome[0])
+
+    def _package_atom(self, match):
+        package_id, repository_id = match
+        try:
+            repo = self._backend.entropy.open_repository(repository_id)
+            return repo.retrieveAtom(package_id)
+        except Exception:
+            return "%s@%s" % (package_id, repository_id)
 
-    def maybe_install_packages(self, packages):
+    def _package_download(self, settings, match):
+        """
+        Return (urls, local path, md5) of the package file of match, the
+        urls being those of the repository mirrors in their configured
+        order. Return None if the repository does not tell.
+        """
+        package_id, repository_id = match
+        try:
+            repo = self._backend.entropy.open_repository(repository_id)
+            download = repo.retrieveDownloadURL(package_id)
+            md5 = repo.retrieveDigest(package_id)
+            repo_data = settings['repositories']['available'][repository_id]
+            mirrors = list(repo_data['plain_packages'])
+        except Exception as err:
+            log.warning("Cannot locate the package file of %s: %s" % (
+                    match, err))
+            return None
 
-        chroot = ROOT_PATH
-        root = etpSys['rootdir']
+        product = etpConst.get('product', "standard")
+        urls = ["/".join((mirror.rstrip("/"), product, repository_id,
+                          download)) for mirror in mirrors]
+        path = os.path.join(etpConst['entropypackagesworkdir'], download)
+        return urls, path, md5
 
-        install = []
+    def install_packages(self, packages):
+        """
+        Install packages and their dependencies. All the package files are
+        downloaded by a bounded pool of threads, reusing the connections to
+        the mirrors, while the installation proceeds in dependency order,
+        each package being installed as soon as it has arrived.
 
-        if chroot != root:
-            self._change_entropy_chroot(chroot)
+        The downloads do not go through the entropy client, which is not
+        thread-safe and is only used by the calling thread. Its own fetch
+        still runs before each install: it finds the file in place and
+        only checks it, or downloads it if the pool could not.
 
-        try:
-            repo = self._backend.entropy.installed_repository()
+        Return the number of packages that could not be installed.
+        """
+        with self.entropy_chroot:
+            matches = []
+            failed = 0
+            for package in packages:
+                match = self._backend.entropy.atom_match(package)
+                if match[0] == -1:
+                    log.error("Package %s not found" % (package,))
+                    failed += 1
+                elif match not in matches:
+                    matches.append(match)
+
+            queue = self._install_queue(matches)
+            if not queue:
+                return failed
+
+            settings = SystemSettings()
+            action_factory = self._backend.entropy.PackageActionFactory()
+            pool = FetchPool(workers=FETCH_WORKERS, name="AnaPackageFetch")
+            try:
+                # in install order, so the first packages needed are the
+                # first ones to arrive
+                futures = {}
+                for match in queue:
+                    download = self._package_download(settings, match)
+                    if download:
+                        futures[match] = pool.submit(*download)
+
+                for match in queue:
+                    atom = self._package_atom(match)
+                    future = futures.get(match)
+                    error = future.exception() if future else None
+                    if error:
+                        log.warning("Cannot prefetch %s, leaving it to "
+                                    "entropy: %s" % (atom, error))
+
+                    progressQ.send_message(
+                        _("Installing package: %s") % (atom,))
+                    for action in (action_factory.FETCH_ACTION,
+                                   action_factory.INSTALL_ACTION):
+                        pkg = action_factory.get(action, match)
+                        try:
+                            exit_st = pkg.start()
+                        finally:
+                            pkg.finalize()
+                        if exit_st != 0:
+                            log.error("Cannot install %s, error: %s" % (
+                                    atom, exit_st))
+                            failed += 1
+                            break
+            finally:
+                pool.shutdown()
+
+        return failed
+
+    def maybe_install_packages(self, packages):
+
+        install = []
+
+        with self.entropy_chroot as session:
+            repo = session.installed_repository()
 
             for package in packages:
                 pkg_id, _pkg_rc = repo.atomMatch(package)
@@ -618,14 +993,7 @@ blacklist nouveau
             if not updated:
                 return # ouch
 
-            for package in install:
-                progressQ.send_message(
-                    _("Installing package: %s") % (package,))
-                self.install_package(package)
-
-        finally:
-            if chroot != root:
-                self._change_entropy_chroot(root)
+            self.install_packages(install)
 
     def cleanup_packages(self):
 
@@ -663,25 +1031,7 @@ blacklist nouveau
             "sys-process/audit",
             ]
 
-        chroot = ROOT_PATH
-        root = etpSys['rootdir']
-
-        if chroot != root:
-            self._change_entropy_chroot(chroot)
-        try:
-            repo = self._backend.entropy.installed_repository()
-
-            for package in packages:
-
-                pkg_id, _pkg_rc = repo.atomMatch(package)
-                if pkg_id == -1:
-                    continue
-
-                self.remove_package(package)
-
-        finally:
-            if chroot != root:
-                self._change_entropy_chroot(root)
+        self.remove_packages(packages)
 
     def _get_base_kernel_cmdline(self):
 
@@ -697,8 +1047,7 @@ blacklist nouveau
                    "dohyperv", "dovirtio"]
 
         # use reference, yeah
-        with open("/proc/cmdline") as cmd_f:
-            cmdline = cmd_f.readline().strip().split()
+        cmdline = list(facts.cmdline)
         final_cmdline = []
 
         if self.is_hyperv() and ("dohyperv" not in cmdline):
@@ -708,11 +1057,11 @@ blacklist nouveau
             cmdline.append("dovirtio")
 
         # Sabayon MCE install -> MCE support
-        if Entropy.is_sabayon_mce() and ("sabayonmce" not in cmdline):
+        if facts.is_sabayon_mce and ("sabayonmce" not in cmdline):
             cmdline.append("sabayonmce")
 
         # Sabayon Steam Box support
-        if Entropy.is_sabayon_steambox() and ("steambox" not in cmdline):
+        if facts.is_sabayon_steambox and ("steambox" not in cmdline):
             cmdline.append("steambox")
 
         # setup USB parameters, if installing on USB
@@ -726,9 +1075,7 @@ blacklist nouveau
             cmdline.append("domdadm")
 
         # setup LVM
-        lvscan_out = commands.getoutput("LANG=C LC_ALL=C lvscan").split(
-            "\n")[0].strip()
-        if not lvscan_out.startswith("No volume groups found"):
+        if facts.has_lvm:
             final_cmdline.append("dolvm")
 
         previous_vga = None
@@ -0,0 +1,300 @@
+#
+# servicebatch.py:  enable, disable and mask systemd units of the target
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    Enabling a unit only creates the symlinks listed in the [Install]
+    section of its unit file, disabling it removes them and masking links
+    the unit to /dev/null.  A ServiceBatch collects all the requests and
+    makes these changes itself, in the target root, instead of running a
+    chrooted systemctl once per unit.
+"""
+
+import os
+from collections import OrderedDict
+
+from pyanaconda.constants import ROOT_PATH
+
+import logging
+log = logging.getLogger("anaconda")
+
+# where the links are created
+CONFIG_DIR = "/etc/systemd/system"
+# where the unit files are looked up, in order of precedence
+UNIT_PATH = (CONFIG_DIR, "/usr/lib/systemd/system", "/lib/systemd/system")
+
+ENABLE = "enable"
+DISABLE = "disable"
+MASK = "mask"
+
+# suffixes of the systemd unit types, see systemd.unit(5)
+UNIT_SUFFIXES = (".service", ".socket", ".device", ".mount", ".automount",
+                 ".swap", ".target", ".path", ".timer", ".slice", ".scope")
+
+def unit_name(name):
+    """ Return name with the .service suffix added unless it already ends
+        with a unit type suffix; names like org.cups.cupsd have dots too.
+    """
+    if not name.endswith(UNIT_SUFFIXES):
+        return name + ".service"
+    return name
+
+def _split_instance(name):
+    """ Return (template name, instance) of a unit name, the instance is
+        None if name is not an instance of a template.
+    """
+    base, _dot, suffix = name.rpartition(".")
+    if "@" not in base:
+        return name, None
+    prefix, _at, instance = base.partition("@")
+    return "%s@.%s" % (prefix, suffix), instance or None
+
+def parse_install_section(path):
+    """ Return the settings of the [Install] section of the unit file at
+        path, as a dict of key -> list of values.
+    """
+    install = {}
+    section = None
+    with open(path) as f:
+        lines = iter(f.read().splitlines())
+    for line in lines:
+        line = line.strip()
+        while line.endswith("\\"):
+            line = line[:-1] + " " + next(lines, "").strip()
+        if not line or line[0] in "#;":
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1]
+            continue
+        if section != "Install" or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip()
+        value = value.strip()
+        if not value:
+            # an empty assignment resets the list
+            install[key] = []
+        else:
+            install.setdefault(key, []).extend(value.split())
+    return install
+
+class ServiceBatch(object):
+    """ Unit requests applied in a single pass. """
+    def __init__(self, root=ROOT_PATH):
+        """
+            :param root: root of the system to modify
+            :type root: str
+        """
+        self.root = root
+        self._requests = {}
+        self._order = []
+
+    def _add(self, action, units):
+        for unit in units:
+            unit = unit_name(unit)
+            if unit not in self._requests:
+                self._order.append(unit)
+            # the last request for a unit wins
+            self._requests[unit] = action
+
+    def enable(self, *units):
+        self._add(ENABLE, units)
+
+    def disable(self, *units):
+        self._add(DISABLE, units)
+
+    def mask(self, *units):
+        self._add(MASK, units)
+
+    def _path(self, path):
+        """ Return the path, relative to the target root, inside this
+            process.
+        """
+        return os.path.normpath(self.root + "/" + path)
+
+    def _find_unit(self, name):
+        """ Return the path of the unit file of name in the target, None if
+            there is none.  A symlink in the unit path is an alias, its
+            target is returned instead.
+        """
+        for directory in UNIT_PATH:
+            path = os.path.join(directory, name)
+            real = self._path(path)
+            if os.path.islink(real):
+                target = os.readlink(real)
+                if target == "/dev/null":
+                    # masked
+                    return None
+                if not target.startswith("/"):
+                    target = os.path.join(directory, target)
+                path = os.path.normpath(target)
+                real = self._path(path)
+            if os.path.isfile(real):
+                return path
+        return None
+
+    def _links(self, unit):
+        """ Return (unit file, [(link, target)]) enabling unit, the links
+            being paths in the target.
+        """
+        template, instance = _split_instance(unit)
+        path = self._find_unit(unit)
+        if path is None and instance:
+            path = self._find_unit(template)
+        if path is None:
+            return None, []
+
+        install = parse_install_section(self._path(path))
+        if instance is None and "@" in unit:
+            default = install.get("DefaultInstance")
+            if not default:
+                log.warning("cannot enable template %s without an instance",
+                            unit)
+                return path, []
+            instance = default[-1]
+            unit = unit.replace("@.", "@%s." % instance)
+
+        prefix = unit.partition("@")[0].rpartition(".")[0]
+        def expand(value):
+            return value.replace("%i", instance or "").replace(
+                "%n", unit).replace("%p", prefix).replace("%%", "%")
+
+        links = []
+        for key, suffix in (("WantedBy", ".wants"),
+                            ("RequiredBy", ".requires")):
+            for target in install.get(key, []):
+                links.append((os.path.join(CONFIG_DIR, expand(target) + suffix,
+                                           unit), path))
+        for alias in install.get("Alias", []):
+            links.append((os.path.join(CONFIG_DIR, expand(alias)), path))
+        return path, links
+
+    def _also(self, path):
+        if path is None:
+            return []
+        return [unit_name(u) for u in
+                parse_install_section(self._path(path)).get("Also", [])]
+
+    def _plan_enable(self, unit, changes):
+        path, links = self._links(unit)
+        if path is None:
+            log.warning("cannot enable %s: unit file not found", unit)
+            return
+        if not links:
+            log.info("%s has no [Install] section, nothing to enable", unit)
+        for link, target in links:
+            changes.append(("link", link, target))
+
+    def _plan_disable(self, unit, changes):
+        path, links = self._links(unit)
+        names = set([unit] + [os.path.basename(link) for link, _t in links])
+        config = self._path(CONFIG_DIR)
+        for dirpath, _dirnames, filenames in os.walk(config):
+            for filename in filenames:
+                real = os.path.join(dirpath, filename)
+                if not os.path.islink(real):
+                    continue
+                target = os.readlink(real)
+                if target == "/dev/null":
+                    # disabling does not unmask
+                    continue
+                if filename in names or os.path.basename(target) in names or \
+                        (path and target == path):
+                    changes.append(("unlink",
+                                    CONFIG_DIR + real[len(config):], None))
+
+    def _plan_mask(self, unit, changes):
+        link = os.path.join(CONFIG_DIR, unit)
+        real = self._path(link)
+        if os.path.exists(real) and not os.path.islink(real):
+            log.warning("cannot mask %s: %s is a regular file", unit, link)
+            return
+        changes.append(("link", link, "/dev/null"))
+
+    def plan(self):
+        """ Return the changes apply() would make, as a list of
+            ("link", path, target) and ("unlink", path, None) tuples.
+        """
+        changes = []
+        planners = {ENABLE: self._plan_enable,
+                    DISABLE: self._plan_disable,
+                    MASK: self._plan_mask}
+        # disable first, like a disable and an enable run one after the
+        # other; units listed in Also= follow the unit asking for them
+        for action in (DISABLE, MASK, ENABLE):
+            seen = set()
+            queue = [u for u in self._order if self._requests[u] == action]
+            while queue:
+                unit = queue.pop(0)
+                if unit in seen:
+                    continue
+                seen.add(unit)
+                planners[action](unit, changes)
+                if action != MASK:
+                    queue.extend(self._also(self._find_unit(unit)))
+
+        # only the last change of each link counts, and only if it differs
+        # from what is there already
+        final = OrderedDict()
+        for action, link, target in changes:
+            final.pop(link, None)
+            final[link] = target
+        result = []
+        for link, target in final.items():
+            real = self._path(link)
+            current = os.readlink(real) if os.path.islink(real) else None
+            if target is None and current is not None:
+                result.append(("unlink", link, None))
+            elif target is not None and target != current:
+                result.append(("link", link, target))
+        return result
+
+    def apply(self, dry_run=False):
+        """ Make the requested changes.
+
+            :param dry_run: only log the changes
+            :type dry_run: bool
+            :returns: the changes, see plan()
+            :rtype: list of tuples
+        """
+        changes = self.plan()
+        for action, link, target in changes:
+            if action == "link":
+                log.info("%slinking %s -> %s", "would be " if dry_run else "",
+                         link, target)
+            else:
+                log.info("%sremoving %s", "would be " if dry_run else "", link)
+            if dry_run:
+                continue
+
+            real = self._path(link)
+            try:
+                if os.path.islink(real):
+                    os.unlink(real)
+                if action == "link":
+                    directory = os.path.dirname(real)
+                    if not os.path.isdir(directory):
+                        os.makedirs(directory)
+                    os.symlink(target, real)
+            except OSError as e:
+                log.error("cannot update %s: %s", link, e)
+
+        if not dry_run:
+            self._requests.clear()
+            del self._order[:]
+        return changes
@@ -0,0 +1,226 @@
+#
+# taskgraph.py:  run independent installation steps concurrently
+#
+# Copyright (C) 2016
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+    A TaskGraph runs a list of steps on a pool of threads.  Every step
+    declares the resources it reads and writes; a step only starts once
+    all the steps added before it that it conflicts with have finished, so
+    conflicting steps keep the order they were added in and independent
+    ones overlap.
+
+    Resources are plain strings.  Those starting with "/" are paths (inside
+    the target system, by convention) and conflict with their parent and
+    child paths too; any other string, like "network", only conflicts with
+    itself.
+"""
+
+import sys
+import time
+import threading
+import multiprocessing
+from Queue import Queue
+
+import logging
+log = logging.getLogger("anaconda")
+
+class TaskGraphError(Exception):
+    pass
+
+def _overlap(res1, res2):
+    if res1 == res2:
+        return True
+    if res1.startswith("/") and res2.startswith("/"):
+        res1 = res1.rstrip("/") + "/"
+        res2 = res2.rstrip("/") + "/"
+        return res1.startswith(res2) or res2.startswith(res1)
+    return False
+
+class Task(object):
+    """ A single step of a TaskGraph. """
+    def __init__(self, name, func, args=(), kwargs=None, reads=(), writes=(),
+                 after=()):
+        """
+            :param name: unique name of the step, used in the logs
+            :type name: str
+            :param func: the callable running the step
+            :param args: positional arguments for func
+            :param kwargs: keyword arguments for func
+            :param reads: resources the step reads
+            :type reads: list of str
+            :param writes: resources the step modifies
+            :type writes: list of str
+            :param after: names of steps that have to finish first, on top of
+                          the ones ordered by the resources
+            :type after: list of str
+        """
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.reads = frozenset(reads)
+        self.writes = frozenset(writes)
+        self.after = frozenset(after)
+        self.elapsed = None
+
+    def conflicts(self, other):
+        """ Return True if self and other cannot run at the same time. """
+        for res1 in self.writes:
+            for res2 in other.reads | other.writes:
+                if _overlap(res1, res2):
+                    return True
+        for res1 in self.reads:
+            for res2 in other.writes:
+                if _overlap(res1, res2):
+                    return True
+        return False
+
+class TaskGraph(object):
+    """ Run steps concurrently, ordered by the resources they use. """
+    def __init__(self, name, workers=None):
+        """
+            :param name: name of the graph, used in the logs
+            :type name: str
+            :param workers: number of threads, the number of CPUs if not given
+            :type workers: int or None
+        """
+        self.name = name
+        self.workers = workers or min(multiprocessing.cpu_count(), 8)
+        self.tasks = []
+
+    def add(self, name, func, *args, **kwargs):
+        """ Add a step calling func(*args).
+
+            The reads, writes and after keyword arguments are passed to Task,
+            see there.
+
+            :returns: the new task
+            :rtype: Task
+        """
+        if name in [task.name for task in self.tasks]:
+            raise KeyError("task %s already exists" % name)
+        task = Task(name, func, args,
+                    reads=kwargs.pop("reads", ()),
+                    writes=kwargs.pop("writes", ()),
+                    after=kwargs.pop("after", ()),
+                    kwargs=kwargs)
+        self.tasks.append(task)
+        return task
+
+    def _dependencies(self):
+        """ Return task name -> set of the names of the steps it waits for. """
+        deps = {}
+        for idx, task in enumerate(self.tasks):
+            deps[task.name] = set(task.after)
+            for earlier in self.tasks[:idx]:
+                if task.conflicts(earlier):
+                    deps[task.name].add(earlier.name)
+        return deps
+
+    def _worker(self, work_q, done_q):
+        while True:
+            task = work_q.get()
+            if task is None:
+                return
+            start = time.time()
+            exc_info = None
+            try:
+                task.func(*task.args, **task.kwargs)
+            except Exception: # pylint: disable=broad-except
+                exc_info = sys.exc_info()
+            task.elapsed = time.time() - start
+            done_q.put((task, exc_info))
+
+    def run(self):
+        """ Run all the steps and wait for them.
+
+            When a step fails no more steps are started; the exception of
+            the first failed step is raised once the running ones finish.
+
+            :raises TaskGraphError: if steps wait for each other, through
+                                    after, or for a step added after them
+        """
+        deps = self._dependencies()
+        names = set(task.name for task in self.tasks)
+        for name, waits in deps.items():
+            if not waits <= names:
+                raise KeyError("%s waits for unknown tasks %s"
+                               % (name, sorted(waits - names)))
+
+        work_q = Queue()
+        done_q = Queue()
+        threads = []
+        for i in range(min(self.workers, len(self.tasks))):
+            thread = threading.Thread(name="AnaTask%d" % i,
+                                      target=self._worker,
+                                      args=(work_q, done_q))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        start = time.time()
+        pending = list(self.tasks)
+        running = set()
+        done = set()
+        error = None
+        try:
+            while pending or running:
+                if error is None:
+                    for task in list(pending):
+                        if deps[task.name] <= done:
+                            pending.remove(task)
+                            running.add(task.name)
+                            log.debug("%s: starting %s", self.name, task.name)
+                            work_q.put(task)
+                if not running:
+                    if error is None:
+                        stuck = ["%s (waits for %s)"
+                                 % (task.name,
+                                    ", ".join(sorted(deps[task.name] - done)))
+                                 for task in pending]
+                        raise TaskGraphError("%s: steps can never start: %s"
+                                             % (self.name, ", ".join(stuck)))
+                    break
+
+                task, exc_info = done_q.get()
+                running.remove(task.name)
+                done.add(task.name)
+                if exc_info:
+                    log.error("%s: %s failed after %.1f seconds: %s",
+                              self.name, task.name, task.elapsed, exc_info[1])
+                    if error is None:
+                        error = exc_info
+                else:
+                    log.info("%s: %s took %.1f seconds", self.name, task.name,
+                             task.elapsed)
+        finally:
+            for _thread in threads:
+                work_q.put(None)
+            for thread in threads:
+                thread.join()
+
+        elapsed = time.time() - start
+        work = sum(task.elapsed or 0 for task in self.tasks)
+        log.info("%s: %d steps took %.1f seconds (%.1f seconds of work)",
+                 self.name, len(done), elapsed, work)
+
+        if error is not None:
+            if pending:
+                log.error("%s: skipped %s", self.name,
+                          ", ".join(task.name for task in pending))
+            raise error[0], error[1], error[2]
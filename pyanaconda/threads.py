@@ -22,7 +22,19 @@
 import logging
 log = logging.getLogger("anaconda")
 
+import sys
+import time
 import threading
+import itertools
+from Queue import PriorityQueue
+
+# priorities of the tasks run by a TaskExecutor, lower values run first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+# size of the pool of threads running the tasks of the thread manager
+DEFAULT_WORKERS = 4
 
 class ThreadManager(object):
     """A singleton class for managing threads and processes.
@@ -35,11 +47,25 @@ class ThreadManager(object):
        names are unique and meaningful.  This is an okay assumption for us
        to make given that anaconda is only ever going to have a handful of
        special purpose threads.
+
+       Short jobs that do not deserve a thread of their own are submitted
+       as tasks with submit() and run by a bounded pool of threads.  Tasks
+       are named like threads and their errors are handled the same way.
+
+       Threads added with add_task() declare the threads they require and
+       are started as soon as those finish, which makes a graph of the
+       startup work; log_critical_path() tells which of them delayed a
+       given point.
     """
     def __init__(self):
         self._objs = {}
         self._errors = {}
         self._main_thread = threading.current_thread()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._graph = {}
+        self._graph_lock = threading.RLock()
+        self._reported = set()
 
     def __call__(self):
         return self
@@ -62,16 +88,121 @@ class ThreadManager(object):
         """
         self._objs.pop(name)
 
-    def exists(self, name):
-        """Determine if a thread or process exists with the given name."""
+        with self._graph_lock:
+            task = self._graph.get(name)
+            if task is not None and task.started is not None and \
+                    not task.done():
+                task.finish()
+            self._start_ready_tasks()
+
+    def add_task(self, name, target, args=(), kwargs=None, requires=()):
+        """Add a thread of the startup task graph, started as soon as the
+           threads it requires have finished.
+
+           Required names that are neither known nor running when the task
+           becomes ready count as finished, like for wait().  If one of
+           them failed, the task is not started and fails with its error.
+
+           :param name: unique name of the thread
+           :type name: str
+           :param target: the callable run by the thread
+           :param args: positional arguments for target
+           :param kwargs: keyword arguments for target
+           :param requires: names of the threads that have to finish first
+           :type requires: list of str
+           :returns: the task
+           :rtype: GraphTask
+           :raises KeyError: if a thread or task with the same name exists
+        """
+        with self._graph_lock:
+            if self.exists(name):
+                raise KeyError("Cannot add task '%s', a thread with the same name already running" % name)
+            task = GraphTask(name, target, args, kwargs, requires)
+            self._graph[name] = task
+            self._errors[name] = None
+            self._start_ready_tasks()
+        return task
+
+    def _waiting(self, name):
+        """Return True if the thread or task called name is not done."""
+        task = self._graph.get(name)
+        if task is not None:
+            return not task.done()
         return name in self._objs
 
+    def _start_ready_tasks(self):
+        now = time.time()
+        changed = True
+        while changed:
+            changed = False
+            for task in self._graph.values():
+                if task.started is not None or task.done():
+                    continue
+
+                failed = [n for n in task.requires if self._errors.get(n)]
+                if failed:
+                    log.error("Not starting %s, %s failed", task.name,
+                              failed[0])
+                    self._errors[task.name] = self._errors[failed[0]]
+                    task.finish()
+                    changed = True
+                    continue
+
+                if any(self._waiting(n) for n in task.requires):
+                    continue
+
+                task.started = now
+                if task.requires:
+                    log.debug("Starting %s after %s", task.name,
+                              ", ".join(task.requires))
+                self.add(AnacondaThread(name=task.name, target=task.target,
+                                        args=task.args, kwargs=task.kwargs))
+
+    def exists(self, name):
+        """Determine if a thread or process exists with the given name.
+           Pending and running tasks count too.
+        """
+        if name in self._objs:
+            return True
+        task = self._graph.get(name)
+        if task is not None and not task.done():
+            return True
+        return self._executor is not None and \
+            self._executor.get(name) is not None
+
+    @property
+    def executor(self):
+        """The TaskExecutor running the tasks given to submit()."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = TaskExecutor(self)
+            return self._executor
+
+    def submit(self, target, args=(), kwargs=None, name=None,
+               priority=PRIORITY_NORMAL):
+        """Run target(*args, **kwargs) as a task on the pool of threads.
+
+           :param name: unique name of the task, generated if not given
+           :type name: str or None
+           :param priority: one of the PRIORITY_ constants
+           :type priority: int
+           :returns: the future of the task
+           :rtype: TaskFuture
+           :raises KeyError: if a task with the same name is pending or running
+        """
+        return self.executor.submit(target, args, kwargs, name, priority)
+
     def get(self, name):
         """Given an object name, see if it exists and return the object.
            Return None if no such object exists.  Additionally, this method
            will re-raise any uncaught exception in the thread.
         """
         obj = self._objs.get(name)
+        if obj is None:
+            # a task of the graph waiting for the threads it requires
+            task = self._graph.get(name)
+            if task is not None and task.started is None and not task.done():
+                obj = task
         if obj:
             self.raise_error(name)
 
@@ -79,22 +210,94 @@ class ThreadManager(object):
 
     def wait(self, name):
         """Wait for the thread to exit and if the thread exited with an error
-           re-raise it here.
+           re-raise it here.  Tasks of the graph that have not been started
+           yet are waited for too.
         """
-        if self.exists(name):
+        task = self._graph.get(name)
+        if task is not None:
+            if not task.done():
+                start = time.time()
+                task.join()
+                task.add_wait(threading.current_thread().name,
+                              time.time() - start)
+        elif self.exists(name):
             self.get(name).join()
 
         self.raise_error(name)
 
+    def log_critical_path(self, milestone):
+        """Log the chain of startup tasks that delayed milestone, only the
+           first time it is reached.
+
+           The task at the end of the chain is the last one to finish among
+           the tasks someone had to wait for, or among all the tasks if no
+           one waited.  Each task before it is the one it required that
+           finished last.
+
+           :param milestone: what is ready now, used in the logs
+           :type milestone: str
+        """
+        now = time.time()
+        with self._graph_lock:
+            if milestone in self._reported or not self._graph:
+                return
+            self._reported.add(milestone)
+            graph = dict(self._graph)
+
+        tasks = sorted(graph.values(), key=lambda t: t.added)
+        epoch = tasks[0].added
+        log.info("%s ready %.1f seconds after the startup tasks were added",
+                 milestone, now - epoch)
+
+        ran = [t for t in tasks if t.started is not None and t.done()]
+        waited = [t for t in ran if t.waits]
+        if ran:
+            path = [max(waited or ran, key=lambda t: t.finished)]
+            while True:
+                required = [graph[n] for n in path[0].requires
+                            if n in graph and graph[n] in ran and
+                            graph[n].finished <= path[0].started]
+                if not required:
+                    break
+                path.insert(0, max(required, key=lambda t: t.finished))
+
+            log.info("critical path of %s:", milestone)
+            for task in path:
+                log.info("  %s: started after %.1f s, ran for %.1f s",
+                         task.name, task.started - epoch,
+                         task.finished - task.started)
+            log.info("  %s ready %.1f s after %s finished", milestone,
+                     now - path[-1].finished, path[-1].name)
+
+        for task in tasks:
+            for waiter, seconds in sorted(task.waits.items()):
+                log.info("%s kept %s waiting for %.1f s", task.name, waiter,
+                         seconds)
+            if task.started is None and not task.done():
+                log.info("%s is still waiting for %s", task.name,
+                         ", ".join(n for n in task.requires
+                                   if self._waiting(n)))
+            elif not task.done():
+                log.info("%s is still running, for %.1f s", task.name,
+                         now - task.started)
+
     def wait_all(self):
-        """Wait for all threads to exit and if there was an error re-raise it.
+        """Wait for all threads and tasks to exit and if there was an error
+           re-raise it.
         """
-        for name in self._objs.keys():
-            if self.get(name) == threading.current_thread():
+        with self._graph_lock:
+            pending = [t.name for t in self._graph.values()
+                       if t.started is None and not t.done()]
+        for name in pending + self._objs.keys():
+            if self._objs.get(name) == threading.current_thread():
                 continue
             log.debug("Waiting for thread %s to exit", name)
             self.wait(name)
 
+        if self._executor is not None:
+            for future in self._executor.wait():
+                self.raise_error(future.name)
+
     def set_error(self, name, *exc_info):
         """Set the error data for a thread
 
@@ -132,7 +335,7 @@ class ThreadManager(object):
             :returns: number of running threads
             :rtype:   int
         """
-        return len(self._objs)
+        return len(self.names)
 
     @property
     def names(self):
@@ -141,7 +344,303 @@ class ThreadManager(object):
             :returns: list of thread names
             :rtype:   list of strings
         """
-        return self._objs.keys()
+        names = self._objs.keys()
+        with self._graph_lock:
+            names.extend(t.name for t in self._graph.values()
+                         if t.started is None and not t.done())
+        if self._executor is not None:
+            names.extend(self._executor.names)
+        return names
+
+class GraphTask(object):
+    """A thread of the startup task graph, see ThreadManager.add_task()."""
+    def __init__(self, name, target, args, kwargs, requires):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.requires = tuple(requires)
+        self.added = time.time()
+        self.started = None
+        self.finished = None
+        # name of the waiting thread -> seconds spent in ThreadManager.wait()
+        self.waits = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def done(self):
+        """Return True if the thread has finished or will never start."""
+        return self._done.is_set()
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+    def finish(self):
+        self.finished = time.time()
+        self._done.set()
+
+    def add_wait(self, waiter, seconds):
+        with self._lock:
+            self.waits[waiter] = self.waits.get(waiter, 0) + seconds
+
+class CancelledError(Exception):
+    """The task was cancelled before it could run."""
+    pass
+
+class TaskFuture(object):
+    """The outcome of a task submitted to a TaskExecutor."""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+
+    def __init__(self, name, target, args, kwargs, priority):
+        self.name = name
+        self.priority = priority
+        self._target = target
+        self._args = args
+        self._kwargs = kwargs or {}
+        self._state = self.PENDING
+        self._thread = None
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._cond = threading.Condition()
+
+    def cancel(self):
+        """Cancel the task if it has not started yet.
+
+           :returns: whether the task is cancelled
+           :rtype: bool
+        """
+        with self._cond:
+            if self._state == self.CANCELLED:
+                return True
+            if self._state != self.PENDING:
+                return False
+            self._state = self.CANCELLED
+            self._cond.notify_all()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        return self._state == self.CANCELLED
+
+    def running(self):
+        return self._state == self.RUNNING
+
+    def done(self):
+        """Return True if the task finished or was cancelled."""
+        return self._state in (self.DONE, self.CANCELLED)
+
+    def wait(self, timeout=None):
+        """Wait for the task to finish or be cancelled.
+
+           :param timeout: seconds to wait at most, forever if None
+           :type timeout: float or None
+           :returns: whether the task is done
+           :rtype: bool
+        """
+        with self._cond:
+            if timeout is None:
+                while not self.done():
+                    self._cond.wait()
+            elif not self.done():
+                self._cond.wait(timeout)
+            return self.done()
+
+    def result(self):
+        """Wait for the task and return its result, re-raising its exception
+           if it failed.
+
+           :raises CancelledError: if the task was cancelled
+        """
+        self.wait()
+        if self.cancelled():
+            raise CancelledError(self.name)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        """Wait for the task and return its exception, None if it succeeded.
+
+           :raises CancelledError: if the task was cancelled
+        """
+        self.wait()
+        if self.cancelled():
+            raise CancelledError(self.name)
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, func):
+        """Call func with this future once the task is done or cancelled,
+           right away if it is already.  It is called in the thread that
+           ran or cancelled the task.
+        """
+        with self._cond:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _start(self):
+        with self._cond:
+            if self._state != self.PENDING:
+                return False
+            self._state = self.RUNNING
+            self._thread = threading.current_thread()
+            return True
+
+    def _run(self):
+        try:
+            result = self._target(*self._args, **self._kwargs)
+        except:
+            self._finish(None, sys.exc_info())
+            raise
+        self._finish(result, None)
+
+    def _finish(self, result, exc_info):
+        with self._cond:
+            self._result = result
+            self._exc_info = exc_info
+            self._state = self.DONE
+            self._cond.notify_all()
+
+    def _run_callbacks(self):
+        with self._cond:
+            callbacks = self._callbacks
+            self._callbacks = []
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception: # pylint: disable=broad-except
+                log.exception("Callback of task %s failed", self.name)
+
+class TaskExecutor(object):
+    """A bounded pool of threads running tasks by priority.
+
+       Threads are started as tasks are submitted, up to max_workers, and
+       then kept for the next tasks.  Errors of the tasks are recorded by
+       the thread manager under the task names and handed to sys.excepthook,
+       like the errors of AnacondaThreads.
+    """
+    def __init__(self, manager=None, max_workers=DEFAULT_WORKERS,
+                 name="AnaWorker"):
+        """
+           :param manager: thread manager recording the errors of the tasks
+           :type manager: ThreadManager or None
+           :param max_workers: maximum number of threads
+           :type max_workers: int
+           :param name: prefix of the names of the threads
+           :type name: str
+        """
+        self.max_workers = max_workers
+        self.name = name
+        self._manager = manager
+        self._queue = PriorityQueue()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._workers = 0
+        self._idle = 0
+
+    def submit(self, target, args=(), kwargs=None, name=None,
+               priority=PRIORITY_NORMAL):
+        """Queue target(*args, **kwargs) to be run by the pool.
+
+           :returns: the future of the task
+           :rtype: TaskFuture
+           :raises KeyError: if a task with the same name is pending or running
+        """
+        with self._lock:
+            number = next(self._counter)
+            if name is None:
+                name = "%sTask%d" % (self.name, number)
+            if name in self._tasks and not self._tasks[name].done():
+                raise KeyError("Cannot add task '%s', a task with the same name already queued" % name)
+
+            future = TaskFuture(name, target, args, kwargs, priority)
+            self._tasks[name] = future
+            # equal priorities run in submission order
+            self._queue.put((priority, number, future))
+            if self._queue.qsize() > self._idle and \
+                    self._workers < self.max_workers:
+                thread = threading.Thread(name="%s%d" % (self.name, self._workers),
+                                          target=self._work)
+                thread.daemon = True
+                self._workers += 1
+                thread.start()
+        future.add_done_callback(self._forget)
+        return future
+
+    def get(self, name):
+        """Return the future of the pending or running task called name,
+           None if there is none.
+        """
+        with self._lock:
+            future = self._tasks.get(name)
+        if future is None or future.done():
+            return None
+        return future
+
+    @property
+    def names(self):
+        """Names of the pending and running tasks."""
+        with self._lock:
+            futures = self._tasks.values()
+        return [future.name for future in futures if not future.done()]
+
+    def cancel_all(self):
+        """Cancel all the pending tasks."""
+        with self._lock:
+            futures = self._tasks.values()
+        for future in futures:
+            future.cancel()
+
+    def wait(self):
+        """Wait for the pending and running tasks, except the one calling.
+
+           :returns: the futures waited for
+           :rtype: list of TaskFuture
+        """
+        with self._lock:
+            futures = self._tasks.values()
+        current = threading.current_thread()
+        waited = []
+        for future in futures:
+            if future._thread is current:
+                continue
+            log.debug("Waiting for task %s to finish", future.name)
+            future.wait()
+            waited.append(future)
+        return waited
+
+    def _forget(self, future):
+        with self._lock:
+            if self._tasks.get(future.name) is future:
+                del self._tasks[future.name]
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            future = self._queue.get()[2]
+            with self._lock:
+                self._idle -= 1
+            if not future._start():
+                # cancelled meanwhile
+                continue
+
+            try:
+                future._run()
+            except KeyboardInterrupt:
+                raise
+            except:
+                if self._manager:
+                    self._manager.set_error(future.name, *sys.exc_info())
+                sys.excepthook(*sys.exc_info())
+            finally:
+                future._run_callbacks()
 
 class AnacondaThread(threading.Thread):
     """A threading.Thread subclass that exists only for a couple purposes:
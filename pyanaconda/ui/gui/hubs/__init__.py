@@ -26,6 +26,7 @@ from gi.repository import GLib
 from pyanaconda.flags import flags
 from pyanaconda.i18n import _
 from pyanaconda.product import distributionText
+from pyanaconda.threads import threadMgr
 
 from pyanaconda.ui import common
 from pyanaconda.ui.gui import GUIObject
@@ -361,6 +362,9 @@ class Hub(GUIObject, common.Hub):
 
             q.task_done()
 
+        if not self._notReadySpokes:
+            threadMgr.log_critical_path("first hub")
+
         return True
 
     def refresh(self):
@@ -40,7 +40,7 @@ from pyanaconda import nm
 from pyanaconda import ntp
 from pyanaconda import flags
 from pyanaconda import constants
-from pyanaconda.threads import threadMgr, AnacondaThread
+from pyanaconda.threads import threadMgr, AnacondaThread, PRIORITY_LOW
 
 import datetime
 import os
@@ -62,9 +62,6 @@ class NTPconfigDialog(GUIObject):
     def __init__(self, *args):
         GUIObject.__init__(self, *args)
 
-        #used to ensure uniqueness of the threads' names
-        self._threads_counter = 0
-
         #epoch is increased when serversStore is repopulated
         self._epoch = 0
         self._epoch_lock = threading.Lock()
@@ -207,14 +204,11 @@ class NTPconfigDialog(GUIObject):
 
     @gtk_action_nowait
     def _refresh_server_working(self, itr):
-        """ Runs a new thread with _set_server_ok_nok(itr) as a taget. """
+        """ Submits a task with _set_server_ok_nok(itr) as a target. """
 
         self._serversStore.set_value(itr, 1, SERVER_QUERY)
-        new_thread_name = "AnaNTPserver%d" % self._threads_counter
-        threadMgr.add(AnacondaThread(name=new_thread_name,
-                                     target=self._set_server_ok_nok,
-                                     args=(itr, self._epoch)))
-        self._threads_counter += 1
+        threadMgr.submit(self._set_server_ok_nok, args=(itr, self._epoch),
+                         priority=PRIORITY_LOW)
 
     def _add_server(self, server):
         """
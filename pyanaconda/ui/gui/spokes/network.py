@@ -1349,12 +1349,14 @@ class NetworkStandaloneSpoke(StandaloneSpoke):
 
         log.debug("network standalone spoke (apply) payload: %s completed: %s", self.payload.baseRepo, self._now_available)
         if not self.payload.baseRepo and not self._initially_available and self._now_available:
-            from pyanaconda.packaging import payloadInitialize
-            from pyanaconda.threads import threadMgr, AnacondaThread
+            from pyanaconda.packaging import payloadInitialize, PAYLOAD_INIT_REQUIRES
+            from pyanaconda.threads import threadMgr
 
             threadMgr.wait(constants.THREAD_PAYLOAD)
 
-            threadMgr.add(AnacondaThread(name=constants.THREAD_PAYLOAD, target=payloadInitialize, args=(self.storage, self.data, self.payload)))
+            threadMgr.add_task(constants.THREAD_PAYLOAD, payloadInitialize,
+                               args=(self.storage, self.data, self.payload),
+                               requires=PAYLOAD_INIT_REQUIRES)
 
         self.network_control_box.kill_nmce(msg="leaving standalone network spoke")
 
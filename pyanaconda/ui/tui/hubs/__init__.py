@@ -22,6 +22,7 @@ from pyanaconda.ui.tui import simpleline as tui
 from pyanaconda.ui.tui.tuiobject import TUIObject
 from pyanaconda.ui.tui.spokes import collect_spokes
 from pyanaconda.ui import common
+from pyanaconda.threads import threadMgr
 
 from pyanaconda.i18n import _
 
@@ -94,6 +95,9 @@ class TUIHub(TUIObject, common.Hub):
         c = tui.ColumnWidget([(39, left), (39, right)], 2)
         self._window.append(c)
 
+        if all(spoke.ready for spoke in self._spokes.values()):
+            threadMgr.log_critical_path("first hub")
+
         return True
 
     def input(self, args, key):
@@ -25,7 +25,7 @@ import sys
 import Queue
 import getpass
 import threading
-from pyanaconda.threads import threadMgr, AnacondaThread
+from pyanaconda.threads import threadMgr, PRIORITY_HIGH
 from pyanaconda.ui.communication import hubQ
 from pyanaconda import constants
 from pyanaconda.i18n import _, N_
@@ -411,11 +411,8 @@ class App(object):
         thread_name = "%s%d" % (constants.THREAD_INPUT_BASENAME,
                                 self._in_thread_counter)
         self._in_thread_counter += 1
-        input_thread = AnacondaThread(name=thread_name,
-                                      target=self._thread_input,
-                                      args=(self.queue, prompt, hidden))
-        input_thread.daemon = True
-        threadMgr.add(input_thread)
+        threadMgr.submit(self._thread_input, args=(self.queue, prompt, hidden),
+                         name=thread_name, priority=PRIORITY_HIGH)
         event = self.process_events(return_at=hubQ.HUB_CODE_INPUT)
         return event[1][0] # return the user input
 
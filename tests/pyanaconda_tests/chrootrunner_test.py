@@ -0,0 +1,53 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.chrootrunner import ChrootRunner
+import os
+import threading
+import unittest
+
+@unittest.skipIf(os.geteuid() != 0, "chroot needs root privileges")
+class ChrootRunnerTests(unittest.TestCase):
+    def setUp(self):
+        self.runner = ChrootRunner("/")
+        self.runner.start()
+
+    def tearDown(self):
+        self.runner.stop()
+
+    def output_test(self):
+        """The output and the return code should be returned."""
+        output = self.runner.run(["sh", "-c", "echo out; echo err >&2; exit 3"])
+        self.assertEqual("".join(output), "out\nerr\n")
+        self.assertEqual(output.returncode, 3)
+
+    def missing_test(self):
+        """Commands that cannot be started should raise OSError."""
+        with self.assertRaises(OSError):
+            self.runner.run(["/nonexistent/command"])
+
+    def concurrent_test(self):
+        """Commands should run at the same time and keep their output."""
+        results = {}
+        def run(i):
+            output = self.runner.run(["sh", "-c", "sleep 0.2; echo %d" % i])
+            results[i] = ("".join(output), output.returncode)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((i, ("%d\n" % i, 0)) for i in range(4)))
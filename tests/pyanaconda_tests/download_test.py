@@ -0,0 +1,122 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import download
+import BaseHTTPServer
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serve DATA, honouring byte ranges if the server allows them. """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        start, end = 0, len(DATA) - 1
+        rng = self.headers.get("Range")
+        ranged = rng and self.server.ranges
+        if ranged:
+            first, _sep, last = rng[len("bytes="):].partition("-")
+            start = int(first)
+            if last:
+                end = int(last)
+            self.send_response(206)
+            self.send_header("Content-Range",
+                             "bytes %d-%d/%d" % (start, end, len(DATA)))
+        else:
+            self.send_response(200)
+            self.server.full_requests += 1
+        body = DATA[start:end + 1]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if self.server.drop_after and len(body) > self.server.drop_after:
+            # simulate a dropped connection, only once
+            body = body[:self.server.drop_after]
+            self.server.drop_after = None
+        self.wfile.write(body)
+
+class DownloadTests(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.ranges = True
+        self.server.drop_after = None
+        self.server.full_requests = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.url = "http://127.0.0.1:%d/image.img" % self.server.server_port
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "image.img")
+        self._min_segment = download.MIN_SEGMENT_SIZE
+
+    def tearDown(self):
+        download.MIN_SEGMENT_SIZE = self._min_segment
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _check(self, digest):
+        self.assertEqual(digest, hashlib.sha256(DATA).hexdigest())
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), DATA)
+
+    def stream_test(self):
+        """Downloaded data and inline checksum should match."""
+        self._check(download.ImageDownload(self.url, self.path).run())
+
+    def resume_test(self):
+        """A dropped connection should be resumed, not restarted."""
+        self.server.drop_after = 1024 * 1024
+        dl = download.ImageDownload(self.url, self.path, retries=1)
+        download.time.sleep, sleep = (lambda s: None), download.time.sleep
+        try:
+            self._check(dl.run())
+        finally:
+            download.time.sleep = sleep
+        # only the initial request fetched the whole file
+        self.assertEqual(self.server.full_requests, 1)
+
+    def no_ranges_test(self):
+        """Servers without range support should still work."""
+        self.server.ranges = False
+        self._check(download.ImageDownload(self.url, self.path,
+                                           segments=4).run())
+
+    def segmented_test(self):
+        """Segmented downloads should hash the data in order."""
+        download.MIN_SEGMENT_SIZE = 512 * 1024
+        self._check(download.ImageDownload(self.url, self.path,
+                                           segments=4).run())
+
+    def missing_test(self):
+        """Missing files should raise DownloadError."""
+        url = "http://127.0.0.1:%d/nothing" % self.server.server_port
+
+        class _NotFound(_Handler):
+            def do_GET(self):
+                self.send_error(404)
+
+        self.server.RequestHandlerClass = _NotFound
+        dl = download.ImageDownload(url, self.path)
+        self.assertRaises(download.DownloadError, dl.run)
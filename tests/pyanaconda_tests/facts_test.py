@@ -0,0 +1,113 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda import facts
+import os
+import threading
+import time
+import unittest
+
+class FakeArch(object):
+    @staticmethod
+    def isEfi():
+        return True
+
+class FactsTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.outputs = {"/usr/bin/systemd-detect-virt": (0, "kvm\n"),
+                        "lvscan": (0, "  ACTIVE '/dev/vg/root' [10 GiB]\n")}
+        self.delay = 0.0
+        tests = self
+
+        class FakePopen(object):
+            def __init__(self, argv, **_kwargs):
+                tests.calls.append(argv[0])
+                self.returncode, self._output = tests.outputs[argv[0]]
+
+            def communicate(self):
+                time.sleep(tests.delay)
+                return (self._output, None)
+
+        self._popen = facts.subprocess.Popen
+        self._arch = facts.arch
+        self._opengl = os.environ.pop("OPENGL_PROFILE", None)
+        facts.subprocess.Popen = FakePopen
+        facts.arch = FakeArch
+        self.facts = facts.Facts()
+
+    def tearDown(self):
+        facts.subprocess.Popen = self._popen
+        facts.arch = self._arch
+        if self._opengl is not None:
+            os.environ["OPENGL_PROFILE"] = self._opengl
+
+    def lazy_test(self):
+        """Facts should be computed on first use, once."""
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.facts.virt, "kvm")
+        self.assertTrue(self.facts.is_kvm)
+        self.assertFalse(self.facts.is_virtualbox)
+        self.assertEqual(self.calls, ["/usr/bin/systemd-detect-virt"])
+
+        self.outputs["/usr/bin/systemd-detect-virt"] = (1, "none\n")
+        self.assertEqual(self.facts.virt, "kvm")
+        self.assertEqual(len(self.calls), 1)
+
+    def concurrent_test(self):
+        """Threads asking for a fact at the same time should share it."""
+        self.delay = 0.2
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                   self.facts.get("virt"))) for _i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["kvm"] * 4)
+        self.assertEqual(self.calls, ["/usr/bin/systemd-detect-virt"])
+
+    def invalidate_test(self):
+        """Invalidated facts should be computed again."""
+        self.assertTrue(self.facts.has_lvm)
+        self.assertEqual(self.facts.virt, "kvm")
+
+        self.outputs["lvscan"] = (5, "  No volume groups found\n")
+        self.outputs["/usr/bin/systemd-detect-virt"] = (1, "none\n")
+        self.facts.invalidate("lvm")
+        self.assertFalse(self.facts.has_lvm)
+        self.assertEqual(self.facts.virt, "kvm")
+
+        self.facts.invalidate()
+        self.assertIsNone(self.facts.virt)
+        self.assertEqual(self.calls.count("lvscan"), 2)
+        self.assertEqual(self.calls.count("/usr/bin/systemd-detect-virt"), 2)
+
+    def dump_test(self):
+        """dump() should compute and return every fact."""
+        os.environ["OPENGL_PROFILE"] = "nvidia"
+        try:
+            values = self.facts.dump()
+        finally:
+            del os.environ["OPENGL_PROFILE"]
+        self.assertEqual(sorted(values),
+                         ["cmdline", "efi", "lvm", "opengl", "virt"])
+        self.assertEqual(values["virt"], "kvm")
+        self.assertTrue(values["efi"])
+        self.assertTrue(values["lvm"])
+        self.assertEqual(values["opengl"], "nvidia")
+        self.assertEqual(values["cmdline"], self.facts.cmdline)
+        self.assertEqual(sorted(self.calls),
+                         ["/usr/bin/systemd-detect-virt", "lvscan"])
@@ -0,0 +1,153 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import fetchpool
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serve the files of the server, keeping connections open. """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            body = "not found"
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FetchPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.servers = []
+        self.files = dict(("/repo/packages/pkg%d.tbz2" % i, "package %d" % i * 1000)
+                          for i in range(20))
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _mirror(self, files):
+        server = _Server(("127.0.0.1", 0), _Handler)
+        server.files = files
+        server.lock = threading.Lock()
+        server.connections = 0
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.servers.append(server)
+        return "http://127.0.0.1:%d/repo" % server.server_port
+
+    def _dead_mirror(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return "http://127.0.0.1:%d/repo" % port
+
+    def _submit(self, pool, mirrors, relpath, md5=True):
+        content = self.files["/repo/" + relpath]
+        return pool.submit([mirror + "/" + relpath for mirror in mirrors],
+                           os.path.join(self.tmpdir, relpath),
+                           hashlib.md5(content).hexdigest() if md5 else None)
+
+    def _content(self, relpath):
+        with open(os.path.join(self.tmpdir, relpath)) as f:
+            return f.read()
+
+    def fetch_test(self):
+        """Files should be fetched over one connection per worker."""
+        mirror = self._mirror(self.files)
+        with fetchpool.FetchPool(workers=3) as pool:
+            futures = [self._submit(pool, [mirror], "packages/pkg%d.tbz2" % i)
+                       for i in range(20)]
+        for i, future in enumerate(futures):
+            self.assertEqual(future.result(), os.path.join(
+                self.tmpdir, "packages/pkg%d.tbz2" % i))
+            self.assertEqual(self._content("packages/pkg%d.tbz2" % i),
+                             self.files["/repo/packages/pkg%d.tbz2" % i])
+        self.assertTrue(pool.connections <= 3)
+        self.assertEqual(self.servers[0].connections, pool.connections)
+
+    def fallback_test(self):
+        """Dead mirrors and bad files should fall back to the next url."""
+        bad = dict((path, "corrupted") for path in self.files)
+        mirrors = [self._dead_mirror(), self._mirror(bad),
+                   self._mirror(self.files)]
+        with fetchpool.FetchPool(workers=2) as pool:
+            future = self._submit(pool, mirrors, "packages/pkg3.tbz2")
+        self.assertIsNone(future.exception())
+        self.assertEqual(future.url, mirrors[2] + "/packages/pkg3.tbz2")
+        self.assertEqual(self._content("packages/pkg3.tbz2"),
+                         self.files["/repo/packages/pkg3.tbz2"])
+
+    def error_test(self):
+        """A file no url provides should fail without leaving a file."""
+        mirror = self._mirror({})
+        with fetchpool.FetchPool(workers=1) as pool:
+            futures = [self._submit(pool, [mirror], "packages/pkg%d.tbz2" % i)
+                       for i in range(2)]
+        for future in futures:
+            self.assertRaises(fetchpool.FetchError, future.result)
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, "packages")), [])
+        # the connection is reused after an error page
+        self.assertEqual(self.servers[0].connections, 1)
+
+    def file_url_test(self):
+        """file:// urls should be copied."""
+        path = os.path.join(self.tmpdir, "source")
+        with open(path, "w") as f:
+            f.write("local package")
+        with fetchpool.FetchPool(workers=1) as pool:
+            future = pool.submit(["file://" + path],
+                                 os.path.join(self.tmpdir, "dest/copy"),
+                                 hashlib.md5("local package").hexdigest())
+        self.assertIsNone(future.exception())
+        self.assertEqual(self._content("dest/copy"), "local package")
+
+    def existing_file_test(self):
+        """A file already there with the right checksum should be kept."""
+        os.makedirs(os.path.join(self.tmpdir, "packages"))
+        with open(os.path.join(self.tmpdir, "packages/pkg2.tbz2"), "w") as f:
+            f.write(self.files["/repo/packages/pkg2.tbz2"])
+        with fetchpool.FetchPool(workers=1) as pool:
+            future = self._submit(pool, [self._dead_mirror()],
+                                  "packages/pkg2.tbz2")
+        self.assertIsNone(future.exception())
+        self.assertIsNone(future.url)
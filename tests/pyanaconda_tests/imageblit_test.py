@@ -0,0 +1,111 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import imageblit
+import os
+import shutil
+import tempfile
+import unittest
+
+class FakeFormat(object):
+    def __init__(self, fstype):
+        self.type = fstype
+        self.uuid = None
+
+class FakeDevice(object):
+    def __init__(self, path, fstype="ext4"):
+        self.path = path
+        self.format = FakeFormat(fstype)
+
+class FakeStorage(object):
+    def __init__(self, root):
+        self.rootDevice = root
+        self.mountpoints = {"/": root}
+
+class FakeProgress(object):
+    def __init__(self):
+        self.done = 0
+
+    def update(self, nbytes):
+        self.done += nbytes
+
+class ImageBlitTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmpdir, "image")
+        self.target = os.path.join(self.tmpdir, "target")
+        # a few full blocks and an unaligned tail
+        self.content = os.urandom(2 * imageblit.BLOCK_SIZE + 5000)
+        with open(self.image, "w") as f:
+            f.write(self.content)
+        with open(self.target, "w") as f:
+            f.truncate(len(self.content) + 4096)
+        self.storage = FakeStorage(FakeDevice(self.target))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _target(self):
+        with open(self.target) as f:
+            return f.read(len(self.content))
+
+    def write_test(self):
+        """The image should be written to the root device."""
+        progress = FakeProgress()
+        imageblit.ImageBlitter(self.storage, self.image, "ext4",
+                               progress)._write()
+        self.assertEqual(self._target(), self.content)
+        self.assertEqual(progress.done, len(self.content))
+
+    def short_write_test(self):
+        """Short writes should be retried until all is written."""
+        real_write = os.write
+
+        def short_write(fd, data):
+            # a view keeps the alignment O_DIRECT needs
+            return real_write(fd, buffer(data, 0, 64 * 1024))
+
+        os.write = short_write
+        try:
+            imageblit.ImageBlitter(self.storage, self.image, "ext4")._write()
+        finally:
+            os.write = real_write
+        self.assertEqual(self._target(), self.content)
+
+    def find_blit_source_test(self):
+        """Images backed by a file on the target should not be blitted."""
+        mount_source = imageblit.mount_source
+        backing_file = imageblit.backing_file
+        device_size = imageblit.device_size
+        backing = {"/dev/loop0": "/run/initramfs/live/squashfs.img",
+                   "/dev/loop1": imageblit.ROOT_PATH + "/disk.img"}
+        imageblit.backing_file = lambda device: backing[device]
+        try:
+            imageblit.mount_source = lambda _mnt: (self.image, "ext4")
+            self.assertIsNone(imageblit.find_blit_source(self.storage, "/mnt"))
+
+            os.rename(self.image, self.tmpdir + "/loop0")
+            imageblit.device_size = lambda path: os.stat(
+                self.tmpdir + "/" + os.path.basename(path)).st_size
+            imageblit.mount_source = lambda _mnt: ("/dev/loop0", "ext4")
+            self.assertEqual(imageblit.find_blit_source(self.storage, "/mnt"),
+                             ("/dev/loop0", "ext4"))
+
+            imageblit.mount_source = lambda _mnt: ("/dev/loop1", "ext4")
+            self.assertIsNone(imageblit.find_blit_source(self.storage, "/mnt"))
+        finally:
+            imageblit.mount_source = mount_source
+            imageblit.backing_file = backing_file
+            imageblit.device_size = device_size
@@ -19,6 +19,13 @@
 #
 
 from pyanaconda import iutil
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
 
 class UpcaseFirstLetterTests(unittest.TestCase):
@@ -39,3 +46,152 @@ class UpcaseFirstLetterTests(unittest.TestCase):
         # no lowercase
         self.assertEqual(iutil.upcase_first_letter("czech Republic"),
                          "Czech Republic")
+
+class RunProgramTests(unittest.TestCase):
+    def concurrent_test(self):
+        """Commands run by different threads should overlap."""
+        results = []
+        def run():
+            results.append(iutil.execWithCapture("sh", ["-c", "sleep 0.5; echo done"]))
+
+        threads = [threading.Thread(target=run) for _i in range(3)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.time() - start, 1.4)
+        self.assertEqual(results, ["done\n"] * 3)
+
+class CommandTraceTests(unittest.TestCase):
+    def setUp(self):
+        self._trace_file = iutil.COMMAND_TRACE_FILE
+        fd, iutil.COMMAND_TRACE_FILE = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(iutil.COMMAND_TRACE_FILE)
+        iutil.COMMAND_TRACE_FILE = self._trace_file
+
+    def command_trace_test(self):
+        """Every command should be traced with its resource usage."""
+        iutil.execWithCapture("sh", ["-c", "echo 12345; exit 3"])
+        list(iutil.execReadlines("echo", ["abc"]))
+        with open(iutil.COMMAND_TRACE_FILE) as f:
+            records = [json.loads(line) for line in f]
+
+        self.assertEqual([r["argv"] for r in records],
+                         [["sh", "-c", "echo 12345; exit 3"], ["echo", "abc"]])
+        self.assertEqual([r["returncode"] for r in records], [3, 0])
+        self.assertEqual([r["output_bytes"] for r in records], [6, 4])
+        for record in records:
+            self.assertGreater(record["maxrss_kb"], 0)
+            self.assertGreaterEqual(record["wall"], 0)
+            self.assertEqual(record["thread"], threading.current_thread().name)
+
+class ReadlinesTests(unittest.TestCase):
+    def exec_readlines_test(self):
+        """All the lines should be returned, stripped, the last one too."""
+        self.assertEqual(list(iutil.execReadlines("printf", ["a\\n b \\nlast"])),
+                         ["a", "b", "last"])
+
+    def line_reader_test(self):
+        """Lines of several processes should be read at the same time."""
+        reader = iutil.LineReader()
+        for key in ("x", "y"):
+            proc = subprocess.Popen(["sh", "-c", "echo %s1; sleep 0.2; echo %s2"
+                                     % (key, key)], stdout=subprocess.PIPE)
+            reader.add(key, proc)
+        lines = list(reader)
+        self.assertEqual(sorted(lines[:2]), [("x", "x1"), ("y", "y1")])
+        self.assertEqual(sorted(lines[2:]), [("x", "x2"), ("y", "y2")])
+
+class CommandPoolTests(unittest.TestCase):
+    def parallel_test(self):
+        """Commands should run at the same time, up to the limit."""
+        pool = iutil.CommandPool(workers=2)
+        start = time.time()
+        futures = pool.submit_all([("sh", ["-c", "sleep 0.4; echo %d" % i])
+                                   for i in range(4)])
+        self.assertEqual(pool.wait(), [0, 0, 0, 0])
+        elapsed = time.time() - start
+        self.assertTrue(0.8 <= elapsed < 1.2, elapsed)
+        self.assertEqual([f.output for f in futures],
+                         ["%d\n" % i for i in range(4)])
+
+    def timeout_test(self):
+        """Commands running for too long should be killed."""
+        pool = iutil.CommandPool()
+        future = pool.submit("sleep", ["10"], timeout=0.2)
+        pool.wait()
+        self.assertTrue(future.timed_out)
+        self.assertNotEqual(future.returncode, 0)
+
+    def error_test(self):
+        """Errors starting a command should be raised by wait()."""
+        pool = iutil.CommandPool()
+        pool.submit("true", [])
+        pool.submit("/nonexistent/command", [])
+        self.assertRaises(OSError, pool.wait)
+
+class DirUsageTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "a", "b"))
+        with open(os.path.join(self.root, "a", "b", "file"), "w") as f:
+            f.write("x" * 5000)
+        with open(os.path.join(self.root, "a", "other"), "w") as f:
+            f.write("y" * 1000)
+        os.link(os.path.join(self.root, "a", "b", "file"),
+                os.path.join(self.root, "link"))
+        os.symlink("a", os.path.join(self.root, "symlink"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def dir_usage_test(self):
+        """Hardlinked files should be counted once."""
+        usage = iutil.dir_usage(self.root, workers=2, depth=1)
+        self.assertEqual(usage.bytes, 6000)
+        self.assertEqual(usage.files, 4)
+        self.assertEqual(usage.hardlinks, 1)
+        self.assertTrue(usage.allocated > 0)
+        self.assertEqual(sorted(usage.dirs), ["/", "/a"])
+        self.assertEqual(usage.dirs["/"][0], 6000)
+
+    def get_dir_size_test(self):
+        """getDirSize should return kilobytes."""
+        self.assertEqual(iutil.getDirSize(self.root), 6000 / 1024)
+
+class ChownDirTreeTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "a/b"))
+        for path in ("f", "a/g", "a/b/h"):
+            open(os.path.join(self.root, path), "w").close()
+        os.symlink("/nonexistent", os.path.join(self.root, "a/link"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def chown_dir_tree_test(self):
+        """All the entries, root and symlinks included, should be changed."""
+        uid, gid = os.getuid(), os.getgid()
+        self.assertEqual(iutil.chown_dir_tree(self.root, uid, gid), 7)
+        self.assertEqual(iutil.chown_dir_tree(self.root, uid, gid, uid + 1),
+                         0)
+        self.assertEqual(iutil.chown_dir_tree(self.root, uid, gid, uid, gid),
+                         7)
+
+    def fd_tree_map_test(self):
+        """Only the requested kind of entries should be visited."""
+        names = []
+        lock = threading.Lock()
+        def func(_dir_fd, name, _stats):
+            with lock:
+                names.append(name)
+            return False
+
+        self.assertEqual(iutil.fd_tree_map(self.root, func, dirs=False,
+                                           workers=2), 0)
+        self.assertEqual(sorted(names), ["f", "g", "h", "link"])
@@ -0,0 +1,91 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import mirrors
+import BaseHTTPServer
+import socket
+import threading
+import time
+import unittest
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serve 64 KiB after the delay configured on the server. """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        body = "x" * (64 * 1024)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class MirrorRankerTests(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+        mirrors._cache.clear()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def _mirror(self, delay):
+        server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), _Handler)
+        server.delay = delay
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.servers.append(server)
+        return "http://127.0.0.1:%d/repo" % server.server_port
+
+    def _dead_mirror(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return "http://127.0.0.1:%d/repo" % port
+
+    def rank_test(self):
+        """Faster mirrors should come first, dead ones last."""
+        slow = self._mirror(0.3)
+        fast = self._mirror(0)
+        dead = self._dead_mirror()
+        ranked = mirrors.MirrorRanker([dead, slow, fast], budget=5).rank()
+        self.assertEqual(ranked, [fast, slow, dead])
+
+    def budget_test(self):
+        """The ranking should not take longer than its budget."""
+        stuck = self._mirror(3)
+        fast = self._mirror(0)
+        start = time.time()
+        ranked = mirrors.MirrorRanker([stuck, fast], budget=1).rank()
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual(ranked, [fast, stuck])
+
+    def cache_test(self):
+        """Rankings should be cached for the same network."""
+        slow = self._mirror(0.2)
+        fast = self._mirror(0)
+        self.assertEqual(mirrors.rank_mirrors([slow, fast], budget=5),
+                         [fast, slow])
+
+        # the cached ranking is used even if the mirrors changed speed
+        for server in self.servers:
+            server.delay = 0.2 if server.delay == 0 else 0
+        self.assertEqual(mirrors.rank_mirrors([slow, fast], budget=5),
+                         [fast, slow])
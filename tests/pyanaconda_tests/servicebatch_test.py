@@ -0,0 +1,122 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.servicebatch import ServiceBatch, unit_name
+import os
+import shutil
+import tempfile
+import unittest
+
+UNIT_DIR = "/usr/lib/systemd/system"
+CONFIG_DIR = "/etc/systemd/system"
+
+class ServiceBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(self.root + UNIT_DIR)
+        os.makedirs(self.root + CONFIG_DIR)
+        self._unit("sshd.service", "[Install]\nWantedBy=multi-user.target\n"
+                   "Also=sshd.socket\n")
+        self._unit("sshd.socket", "[Install]\nWantedBy=sockets.target\n")
+        self._unit("gdm.service", "[Service]\nWantedBy=wrong.target\n\n"
+                   "[Install]\nAlias=display-manager.service\n")
+        self._unit("getty@.service", "[Install]\nWantedBy=getty.target\n"
+                   "DefaultInstance=tty1\n")
+        self._unit("static.service", "[Service]\nType=oneshot\n")
+        self._unit("org.cups.cupsd.service",
+                   "[Install]\nWantedBy=multi-user.target\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _unit(self, name, content):
+        with open(self.root + UNIT_DIR + "/" + name, "w") as f:
+            f.write(content)
+
+    def _link(self, path):
+        path = self.root + CONFIG_DIR + "/" + path
+        if os.path.islink(path):
+            return os.readlink(path)
+        return None
+
+    def enable_test(self):
+        """Enabling should create the [Install] links and follow Also=."""
+        batch = ServiceBatch(self.root)
+        batch.enable("sshd", "gdm", "getty@.service", "static", "missing")
+        batch.apply()
+
+        self.assertEqual(self._link("multi-user.target.wants/sshd.service"),
+                         UNIT_DIR + "/sshd.service")
+        self.assertEqual(self._link("sockets.target.wants/sshd.socket"),
+                         UNIT_DIR + "/sshd.socket")
+        self.assertEqual(self._link("display-manager.service"),
+                         UNIT_DIR + "/gdm.service")
+        self.assertEqual(self._link("getty.target.wants/getty@tty1.service"),
+                         UNIT_DIR + "/getty@.service")
+        self.assertFalse(os.path.exists(self.root + CONFIG_DIR +
+                                        "/wrong.target.wants"))
+
+    def unit_name_test(self):
+        """Only names without a unit type suffix should get .service."""
+        self.assertEqual(unit_name("sshd"), "sshd.service")
+        self.assertEqual(unit_name("sshd.socket"), "sshd.socket")
+        self.assertEqual(unit_name("graphical.target"), "graphical.target")
+        self.assertEqual(unit_name("org.cups.cupsd"),
+                         "org.cups.cupsd.service")
+
+    def dotted_name_test(self):
+        """Dotted service names should be enabled without their suffix."""
+        batch = ServiceBatch(self.root)
+        batch.enable("org.cups.cupsd")
+        batch.apply()
+        self.assertEqual(
+            self._link("multi-user.target.wants/org.cups.cupsd.service"),
+            UNIT_DIR + "/org.cups.cupsd.service")
+
+    def disable_test(self):
+        """Disabling should remove the links but keep the masks."""
+        batch = ServiceBatch(self.root)
+        batch.enable("sshd", "gdm")
+        batch.mask("cdeject")
+        batch.apply()
+
+        batch.disable("sshd", "gdm", "cdeject")
+        batch.apply()
+        self.assertIsNone(self._link("multi-user.target.wants/sshd.service"))
+        self.assertIsNone(self._link("sockets.target.wants/sshd.socket"))
+        self.assertIsNone(self._link("display-manager.service"))
+        self.assertEqual(self._link("cdeject.service"), "/dev/null")
+
+    def dry_run_test(self):
+        """A dry run should only report the changes, nothing if done."""
+        batch = ServiceBatch(self.root)
+        batch.enable("sshd")
+        changes = batch.apply(dry_run=True)
+        self.assertEqual(sorted(change[1] for change in changes),
+                         [CONFIG_DIR + "/multi-user.target.wants/sshd.service",
+                          CONFIG_DIR + "/sockets.target.wants/sshd.socket"])
+        self.assertIsNone(self._link("multi-user.target.wants/sshd.service"))
+
+        batch.apply()
+        batch.enable("sshd")
+        self.assertEqual(batch.apply(dry_run=True), [])
+
+    def last_request_test(self):
+        """The last request for a unit should win."""
+        batch = ServiceBatch(self.root)
+        batch.enable("gdm")
+        batch.disable("gdm.service")
+        self.assertEqual(batch.apply(), [])
+        self.assertIsNone(self._link("display-manager.service"))
@@ -0,0 +1,79 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import staging
+from pyanaconda import fsutil
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+class StagingTests(unittest.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, "tmp"))
+        for name in ("a", "b", "c"):
+            with open(os.path.join(self.source, name), "w") as f:
+                f.write(name * 4096)
+        self._mount = fsutil.mount
+
+    def tearDown(self):
+        fsutil.mount = self._mount
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.root)
+
+    def _check_staged(self, staged, names):
+        self.assertTrue(staged.path.startswith(self.root + "/tmp/"))
+        self.assertEqual(staged.chroot_path,
+                         staged.path[len(self.root):])
+        for name in names:
+            with open(os.path.join(staged.path, name)) as f:
+                self.assertEqual(f.read(), name * 4096)
+
+    @unittest.skipIf(os.geteuid() != 0, "bind mounts need root privileges")
+    def bind_test(self):
+        """The directory should be mounted read-only and then removed."""
+        with staging.StagedDirectory(self.source, self.root) as staged:
+            self.assertEqual(staged.method, staging.METHOD_BIND)
+            self._check_staged(staged, ["a", "b", "c"])
+            with self.assertRaises(IOError):
+                open(os.path.join(staged.path, "new"), "w")
+        self.assertEqual(os.listdir(os.path.join(self.root, "tmp")), [])
+
+    def fallback_test(self):
+        """Only the needed files should be copied if mounting fails."""
+        def mount(*args):
+            raise OSError(errno.EPERM, "not permitted")
+        fsutil.mount = mount
+
+        with staging.StagedDirectory(self.source, self.root,
+                                     names=["a", "b"]) as staged:
+            self.assertNotEqual(staged.method, staging.METHOD_BIND)
+            self._check_staged(staged, ["a", "b"])
+            self.assertEqual(sorted(os.listdir(staged.path)), ["a", "b"])
+        self.assertEqual(os.listdir(os.path.join(self.root, "tmp")), [])
+
+    def clone_tree_test(self):
+        """The tree should be copied with its symlinks."""
+        os.mkdir(os.path.join(self.source, "dir"))
+        os.symlink("a", os.path.join(self.source, "dir", "link"))
+        dest = os.path.join(self.root, "copy")
+        counts = staging.clone_tree(self.source, dest)
+        self.assertEqual(sum(counts.values()), 3)
+        self.assertEqual(os.readlink(os.path.join(dest, "dir", "link")), "a")
+        with open(os.path.join(dest, "c")) as f:
+            self.assertEqual(f.read(), "c" * 4096)
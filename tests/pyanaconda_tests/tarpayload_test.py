@@ -0,0 +1,125 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import tarpayload
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+class FakeProgress(object):
+    def __init__(self):
+        self.done = 0
+
+    def update(self, nbytes):
+        self.done += nbytes
+
+class TarPayloadTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        tree = os.path.join(self.tmpdir, "tree")
+        os.makedirs(os.path.join(tree, "boot"))
+        os.makedirs(os.path.join(tree, "etc"))
+        for path, size in (("boot/vmlinuz-4.4.0", 3000), ("etc/hosts", 200)):
+            with open(os.path.join(tree, path), "w") as f:
+                f.write("x" * size)
+        self.plain = self._archive(tree, "w")
+        self.gzipped = self._archive(tree, "w:gz")
+        self.root = os.path.join(self.tmpdir, "root")
+        os.mkdir(self.root)
+        self._root_path = tarpayload.ROOT_PATH
+        tarpayload.ROOT_PATH = self.root
+
+    def tearDown(self):
+        tarpayload.ROOT_PATH = self._root_path
+        shutil.rmtree(self.tmpdir)
+
+    def _archive(self, tree, mode):
+        path = os.path.join(self.tmpdir, "image.tar" + mode[2:])
+        archive = tarfile.open(path, mode)
+        try:
+            for name in ("boot", "etc"):
+                archive.add(os.path.join(tree, name), name)
+        finally:
+            archive.close()
+        return path
+
+    def _payload(self, path):
+        payload = tarpayload.TarPayload.__new__(tarpayload.TarPayload)
+        payload.image_file = path
+        return payload
+
+    def decompressor_test(self):
+        """The decompressor should be chosen from the magic bytes."""
+        self.assertEqual(tarpayload.decompressor(self.plain), (False, None))
+        compressed, argv = tarpayload.decompressor(self.gzipped)
+        self.assertTrue(compressed)
+        self.assertIn(argv[0], ("pigz", "gzip"))
+
+        path = os.environ.get("PATH")
+        os.environ["PATH"] = self.tmpdir
+        try:
+            self.assertEqual(tarpayload.decompressor(self.gzipped),
+                             (True, None))
+        finally:
+            os.environ["PATH"] = path
+
+    def index_test(self):
+        """The index should hold the totals and kernels, and be saved."""
+        for path in (self.plain, self.gzipped):
+            index = tarpayload.TarIndex.build(path, "identity")
+            # two directories and two files
+            self.assertEqual(index.total_files, 4)
+            self.assertEqual(index.total_bytes, 3200)
+            self.assertEqual(index.kernels, ["boot/vmlinuz-4.4.0"])
+
+        cache = os.path.join(self.tmpdir, "index.json")
+        index.save(cache)
+        loaded = tarpayload.TarIndex.load(cache)
+        self.assertEqual((loaded.total_bytes, loaded.total_files,
+                          loaded.kernels, loaded.identity),
+                         (3200, 4, ["boot/vmlinuz-4.4.0"], "identity"))
+
+        with open(cache, "w") as f:
+            f.write("{\"version\": 0}")
+        self.assertIsNone(tarpayload.TarIndex.load(cache))
+        self.assertIsNone(tarpayload.TarIndex.load(cache + ".missing"))
+
+    def extract_pipeline_test(self):
+        """The pipeline should extract the archive and report progress."""
+        for path in (self.plain, self.gzipped):
+            progress = FakeProgress()
+            argv = tarpayload.decompressor(path)[1]
+            self._payload(path)._extract_pipeline(argv, progress)
+            self.assertEqual(progress.done, os.stat(path).st_size)
+            with open(os.path.join(self.root, "etc/hosts")) as f:
+                self.assertEqual(f.read(), "x" * 200)
+            shutil.rmtree(self.root)
+            os.mkdir(self.root)
+
+    def extract_pipeline_error_test(self):
+        """A bad archive or read error should fail, not hang."""
+        bad = os.path.join(self.tmpdir, "bad.tar.gz")
+        with open(self.gzipped) as src, open(bad, "w") as dst:
+            dst.write(src.read()[:30] + "garbage" * 100)
+        argv = tarpayload.decompressor(bad)[1]
+        self.assertRaises(tarfile.ExtractError,
+                          self._payload(bad)._extract_pipeline, argv,
+                          FakeProgress())
+
+        # the archive cannot be read at all
+        self.assertRaises(IOError, self._payload(self.tmpdir)._extract_pipeline,
+                          argv, FakeProgress())
@@ -0,0 +1,97 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.taskgraph import TaskGraph, TaskGraphError
+import threading
+import time
+import unittest
+
+class TaskGraphTests(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def _step(self, name, delay=0.0):
+        with self.lock:
+            self.events.append(("start", name))
+        time.sleep(delay)
+        with self.lock:
+            self.events.append(("end", name))
+
+    def _index(self, event, name):
+        return self.events.index((event, name))
+
+    def conflicts_test(self):
+        """Conflicting steps should keep their order."""
+        graph = TaskGraph("test", workers=4)
+        graph.add("a", self._step, "a", 0.1, writes=["/etc"])
+        graph.add("b", self._step, "b", reads=["/etc/sudoers"])
+        graph.add("c", self._step, "c", writes=["network"])
+        graph.add("d", self._step, "d", writes=["network"])
+        graph.run()
+
+        self.assertTrue(self._index("end", "a") < self._index("start", "b"))
+        self.assertTrue(self._index("end", "c") < self._index("start", "d"))
+
+    def independent_test(self):
+        """Independent steps should run at the same time."""
+        graph = TaskGraph("test", workers=2)
+        graph.add("a", self._step, "a", 0.2, writes=["/etc/sudoers"])
+        graph.add("b", self._step, "b", 0.2, writes=["/etc/skel"])
+        graph.run()
+
+        self.assertTrue(self._index("start", "b") < self._index("end", "a"))
+
+    def after_test(self):
+        """Explicit dependencies should be honoured."""
+        graph = TaskGraph("test", workers=2)
+        graph.add("a", self._step, "a", 0.1)
+        graph.add("b", self._step, "b", after=["a"])
+        graph.run()
+
+        self.assertTrue(self._index("end", "a") < self._index("start", "b"))
+
+    def stuck_test(self):
+        """Steps that can never start should be an error, not skipped."""
+        graph = TaskGraph("test", workers=2)
+        graph.add("a", self._step, "a", after=["b"])
+        graph.add("b", self._step, "b", after=["a"])
+        self.assertRaises(TaskGraphError, graph.run)
+        self.assertEqual(self.events, [])
+
+        # "a" waits for "b", which waits for "a" through the resources
+        graph = TaskGraph("test", workers=2)
+        graph.add("a", self._step, "a", writes=["/etc"], after=["b"])
+        graph.add("b", self._step, "b", reads=["/etc/hosts"])
+        graph.add("c", self._step, "c")
+        self.assertRaises(TaskGraphError, graph.run)
+        self.assertEqual(self.events, [("start", "c"), ("end", "c")])
+
+    def error_test(self):
+        """The first error should be raised, later steps not started."""
+        def fail():
+            raise ValueError("boom")
+
+        graph = TaskGraph("test", workers=2)
+        graph.add("a", fail, writes=["x"])
+        graph.add("b", self._step, "b", writes=["x"])
+        self.assertRaises(ValueError, graph.run)
+        self.assertEqual(self.events, [])
+
+    def duplicate_test(self):
+        """Step names should be unique."""
+        graph = TaskGraph("test")
+        graph.add("a", self._step, "a")
+        self.assertRaises(KeyError, graph.add, "a", self._step, "a")
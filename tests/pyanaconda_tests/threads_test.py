@@ -0,0 +1,144 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda import threads
+import sys
+import threading
+import time
+import unittest
+
+class TaskExecutorTests(unittest.TestCase):
+    def setUp(self):
+        self.manager = threads.ThreadManager()
+        self.executor = threads.TaskExecutor(self.manager, max_workers=1)
+        self._excepthook = sys.excepthook
+        sys.excepthook = lambda *exc_info: None
+
+    def tearDown(self):
+        sys.excepthook = self._excepthook
+
+    def _block(self):
+        """Keep the only worker busy until the returned event is set."""
+        event = threading.Event()
+        self.executor.submit(event.wait)
+        return event
+
+    def priority_test(self):
+        """Pending tasks should run by priority, then in submission order."""
+        event = self._block()
+        order = []
+        futures = [self.executor.submit(order.append, args=(name,),
+                                        priority=priority)
+                   for name, priority in (("low", threads.PRIORITY_LOW),
+                                          ("normal1", threads.PRIORITY_NORMAL),
+                                          ("high", threads.PRIORITY_HIGH),
+                                          ("normal2", threads.PRIORITY_NORMAL))]
+        event.set()
+        for future in futures:
+            future.result()
+        self.assertEqual(order, ["high", "normal1", "normal2", "low"])
+
+    def cancel_test(self):
+        """Only pending tasks can be cancelled."""
+        event = self._block()
+        ran = []
+        future = self.executor.submit(ran.append, args=(1,), name="cancelled")
+        self.assertTrue(self.executor.get("cancelled") is future)
+        self.assertTrue(future.cancel())
+        self.assertIsNone(self.executor.get("cancelled"))
+        event.set()
+
+        done = self.executor.submit(ran.append, args=(2,))
+        done.result()
+        self.assertFalse(done.cancel())
+        self.assertRaises(threads.CancelledError, future.result)
+        self.assertEqual(ran, [2])
+
+    def error_test(self):
+        """Errors should reach the future and the thread manager."""
+        def fail():
+            raise ValueError("failed")
+
+        future = self.executor.submit(fail, name="failing")
+        self.assertIsInstance(future.exception(), ValueError)
+        self.assertRaises(ValueError, future.result)
+        self.assertRaises(ValueError, self.manager.raise_error, "failing")
+        # the worker survives
+        self.assertEqual(self.executor.submit(lambda: 42).result(), 42)
+
+    def bounded_test(self):
+        """No more than max_workers tasks should run at the same time."""
+        executor = threads.TaskExecutor(max_workers=3)
+        lock = threading.Lock()
+        running = [0, 0]
+        def task():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        futures = [executor.submit(task) for _i in range(12)]
+        executor.wait()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(running[1], 3)
+        self.assertEqual(executor.names, [])
+
+class TaskGraphTests(unittest.TestCase):
+    def setUp(self):
+        self._manager = threads.threadMgr
+        threads.initThreading()
+        self.manager = threads.threadMgr
+        self._excepthook = sys.excepthook
+        sys.excepthook = lambda *exc_info: None
+
+    def tearDown(self):
+        sys.excepthook = self._excepthook
+        threads.threadMgr = self._manager
+
+    def requires_test(self):
+        """Tasks should start once the tasks they require are done."""
+        order = []
+        def step(name, seconds):
+            time.sleep(seconds)
+            order.append(name)
+
+        self.manager.add_task("storage", step, args=("storage", 0.1))
+        self.manager.add_task("network", step, args=("network", 0.2))
+        self.manager.add_task("payload", step, args=("payload", 0),
+                              requires=("storage", "network", "unknown"))
+        self.assertTrue(self.manager.exists("payload"))
+        self.assertIsNotNone(self.manager.get("payload"))
+
+        self.manager.wait("payload")
+        self.assertEqual(order, ["storage", "network", "payload"])
+        task = self.manager.get("payload")
+        self.assertIsNone(task)
+        self.assertIn("MainThread", self.manager._graph["payload"].waits)
+        self.manager.log_critical_path("first hub")
+
+    def failure_test(self):
+        """Tasks requiring a failed task should fail with its error."""
+        def fail_later():
+            time.sleep(0.1)
+            raise ValueError("failed")
+
+        ran = []
+        self.manager.add_task("failing", fail_later)
+        self.manager.add_task("dependent", ran.append, args=(1,),
+                              requires=("failing",))
+        self.assertRaises(ValueError, self.manager.wait, "dependent")
+        self.assertEqual(ran, [])
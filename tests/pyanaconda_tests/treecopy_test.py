@@ -0,0 +1,122 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import treecopy
+from pyanaconda import fsutil
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+class ExcludedTests(unittest.TestCase):
+    def excluded_test(self):
+        """Excludes should follow the rsync rules."""
+        excludes = ["/dev/", "/boot/*rescue*", "*.pyc", "cache/", "/a/**/z"]
+        self.assertTrue(treecopy.excluded("/dev", True, excludes))
+        self.assertFalse(treecopy.excluded("/dev", False, excludes))
+        self.assertFalse(treecopy.excluded("/usr/dev", True, excludes))
+        self.assertTrue(treecopy.excluded("/boot/vmlinuz-rescue", False,
+                                          excludes))
+        # "*" does not match "/"
+        self.assertFalse(treecopy.excluded("/boot/x/vmlinuz-rescue", False,
+                                           excludes))
+        self.assertTrue(treecopy.excluded("/usr/lib/x.pyc", False, excludes))
+        self.assertFalse(treecopy.excluded("/usr/lib/x.pyc.txt", False,
+                                           excludes))
+        self.assertTrue(treecopy.excluded("/var/cache", True, excludes))
+        self.assertFalse(treecopy.excluded("/var/nocache", True, excludes))
+        self.assertTrue(treecopy.excluded("/a/b/c/z", False, excludes))
+
+class TreeCopierTests(unittest.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.dest = os.path.join(tempfile.mkdtemp(), "dest")
+        self._src("etc/hosts", "127.0.0.1 localhost\n")
+        self._src("usr/bin/tool", "x" * 100000)
+        os.link(self._path("usr/bin/tool"), self._path("usr/bin/tool2"))
+        self._src("dev/null", "")
+        os.symlink("../usr/bin/tool", self._path("etc/link"))
+        os.mkfifo(self._path("etc/fifo"), 0640)
+        os.mkdir(self._path("private"), 0700)
+        os.utime(self._path("private"), (1000000000, 1000000000))
+        os.chmod(self._path("usr/bin/tool"), 04755)
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(os.path.dirname(self.dest))
+
+    def _path(self, relpath, root=None):
+        return os.path.join(root or self.source, relpath)
+
+    def _src(self, relpath, content):
+        path = self._path(relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def _copy(self, excludes=None, workers=2):
+        treecopy.TreeCopier(self.source, self.dest, excludes,
+                            workers=workers).run()
+
+    def copy_test(self):
+        """Contents, hardlinks, symlinks and special files should be kept."""
+        self._copy(["/dev/"])
+        with open(self._path("usr/bin/tool", self.dest)) as f:
+            self.assertEqual(f.read(), "x" * 100000)
+        tool = os.lstat(self._path("usr/bin/tool", self.dest))
+        self.assertEqual(stat.S_IMODE(tool.st_mode), 04755)
+        self.assertEqual(tool.st_nlink, 2)
+        self.assertEqual(tool.st_ino,
+                         os.lstat(self._path("usr/bin/tool2", self.dest)).st_ino)
+        self.assertEqual(os.readlink(self._path("etc/link", self.dest)),
+                         "../usr/bin/tool")
+        fifo = os.lstat(self._path("etc/fifo", self.dest))
+        self.assertTrue(stat.S_ISFIFO(fifo.st_mode))
+        self.assertEqual(stat.S_IMODE(fifo.st_mode), 0640)
+        self.assertFalse(os.path.exists(self._path("dev", self.dest)))
+
+    def directory_metadata_test(self):
+        """Directory modes and times should be applied after the copy."""
+        self._copy()
+        private = os.lstat(self._path("private", self.dest))
+        self.assertEqual(stat.S_IMODE(private.st_mode), 0700)
+        self.assertEqual(int(private.st_mtime), 1000000000)
+
+    def xattrs_test(self):
+        """Extended attributes should be copied."""
+        try:
+            fsutil.lsetxattr(self._path("etc/hosts"), "user.test", "value")
+        except OSError as e:
+            if e.errno in (errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS):
+                self.skipTest("no user xattrs on %s" % self.source)
+            raise
+        self._copy()
+        self.assertEqual(fsutil.lgetxattr(self._path("etc/hosts", self.dest),
+                                          "user.test"), "value")
+
+    def error_test(self):
+        """Failed files should fail the copy, even with a full queue."""
+        for i in range(200):
+            self._src("many/%d" % i, str(i))
+        def copy_file(*args):
+            raise ValueError("broken")
+
+        copier = treecopy.TreeCopier(self.source, self.dest, workers=1)
+        copier._copy_file = copy_file
+        self.assertRaises(treecopy.TreeCopyError, copier.run)
+        self.assertTrue(copier.errors)
@@ -0,0 +1,83 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import treemanifest
+import os
+import shutil
+import tempfile
+import unittest
+
+class TreeManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "usr/lib"))
+        os.makedirs(os.path.join(self.root, "etc"))
+        for path, size in (("usr/lib/a", 3000), ("usr/b", 2000),
+                           ("etc/c", 1000)):
+            with open(os.path.join(self.root, path), "w") as f:
+                f.write("x" * size)
+        os.link(os.path.join(self.root, "usr/lib/a"),
+                os.path.join(self.root, "etc/a"))
+        os.symlink("usr", os.path.join(self.root, "link"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def build_test(self):
+        """Totals and directory sizes should count hardlinks once."""
+        manifest = treemanifest.TreeManifest.build(self.root, "image")
+        self.assertEqual(manifest.total_bytes, 6000)
+        # a, b, c and the symlink
+        self.assertEqual(manifest.total_files, 4)
+        self.assertEqual(manifest.dir_size("/"), 6000)
+        # the hardlinked file counts in whichever directory is walked first
+        self.assertEqual(manifest.dir_size("usr") + manifest.dir_size("etc/"),
+                         6000)
+        self.assertIn(manifest.dir_size("/usr/lib"), (0, 3000))
+        self.assertEqual(manifest.dir_size("/missing"), 0)
+        self.assertEqual(manifest.identity, "image")
+
+    def save_load_test(self):
+        """A saved manifest should load back unchanged."""
+        manifest = treemanifest.TreeManifest.build(self.root, "image")
+        path = os.path.join(self.root, "manifest.json")
+        manifest.save(path)
+        loaded = treemanifest.TreeManifest.load(path)
+        self.assertEqual(loaded.total_bytes, manifest.total_bytes)
+        self.assertEqual(loaded.total_files, manifest.total_files)
+        self.assertEqual(loaded.dirs, manifest.dirs)
+        self.assertEqual(loaded.identity, "image")
+
+    def load_invalid_test(self):
+        """Missing, broken and outdated manifests should not load."""
+        path = os.path.join(self.root, "manifest.json")
+        self.assertIsNone(treemanifest.TreeManifest.load(path))
+        with open(path, "w") as f:
+            f.write("{broken")
+        self.assertIsNone(treemanifest.TreeManifest.load(path))
+        with open(path, "w") as f:
+            f.write('{"version": 0, "total_bytes": 1, "total_files": 1}')
+        self.assertIsNone(treemanifest.TreeManifest.load(path))
+
+    def get_manifest_test(self):
+        """A manifest shipped in the tree should be preferred."""
+        shipped = treemanifest.TreeManifest(42, 1)
+        path = self.root + treemanifest.SHIPPED_MANIFEST
+        os.makedirs(os.path.dirname(path))
+        shipped.save(path)
+        cache = os.path.join(self.root, "cache.json")
+        manifest = treemanifest.get_manifest(self.root, cache)
+        self.assertEqual(manifest.total_bytes, 42)
+        self.assertFalse(os.path.exists(cache))
@@ -0,0 +1,87 @@
+#
+# Copyright (C) 2016
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+
+from pyanaconda.packaging import treeverify
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+class TreeVerifierTests(unittest.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.dest = tempfile.mkdtemp()
+        for root in (self.source, self.dest):
+            self._write(root, "etc/hosts", "127.0.0.1 localhost\n")
+            self._write(root, "usr/bin/tool", "x" * 100000)
+            self._write(root, "usr/lib/empty", "")
+            self._write(root, "dev/null", "")
+            os.symlink("../usr/bin/tool", os.path.join(root, "etc/link"))
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.dest)
+
+    def _write(self, root, relpath, content):
+        path = os.path.join(root, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def _verify(self, **kwargs):
+        return treeverify.TreeVerifier(self.source, self.dest, ["/dev/"],
+                                       workers=2, **kwargs).run()
+
+    def good_copy_test(self):
+        """An identical copy should pass."""
+        self.assertEqual(self._verify(), [])
+
+    def changed_file_test(self):
+        """A changed file should be reported."""
+        self._write(self.dest, "usr/bin/tool", "x" * 99999 + "y")
+        self.assertEqual(self._verify(), ["/usr/bin/tool"])
+
+    def missing_file_test(self):
+        """A file missing from the copy should be reported."""
+        os.unlink(os.path.join(self.dest, "etc/hosts"))
+        self.assertEqual(self._verify(), ["/etc/hosts"])
+
+    def extra_file_test(self):
+        """A file only in the copy should be reported, excludes are not."""
+        self._write(self.dest, "etc/extra", "extra")
+        self._write(self.dest, "dev/extra", "extra")
+        self.assertEqual(self._verify(), ["/etc/extra"])
+        self.assertEqual(self._verify(percentage=1), ["/etc/extra"])
+
+    def payload_file_test(self):
+        """Files the payload keeps in the copy should not be reported."""
+        self._write(self.dest, "disk.img", "image")
+        self.assertEqual(self._verify(), ["/disk.img"])
+        self.assertEqual(self._verify(dest_excludes=["/disk.img"]), [])
+
+    def checksums_test(self):
+        """The checksum manifest should be used instead of the source."""
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write("%s  ./etc/hosts\n" % hashlib.sha256("bad").hexdigest())
+                f.write("%s *usr/lib/empty\n" % hashlib.sha256("").hexdigest())
+            checksums = treeverify.load_checksums(path)
+        finally:
+            os.unlink(path)
+        self.assertEqual(sorted(checksums), ["/etc/hosts", "/usr/lib/empty"])
+        self.assertEqual(self._verify(checksums=checksums), ["/etc/hosts"])